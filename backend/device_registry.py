@@ -0,0 +1,214 @@
+"""
+Fleet device registry: which NIMI_DEV_* devices exist, when each was last seen and which
+keyword set it holds.
+
+Every device is kept in memory (a few hundred bytes each), so the fleet queries, stale and
+out of date, are a scan of a dict. Sightings (heartbeats, telemetry posts, encounter
+uploads) only update that dict and mark the device dirty; a flusher thread writes the dirty
+devices with one executemany() UPSERT every FLUSH_INTERVAL_S, so a device reporting every
+second costs one row write per interval, not one per report.
+
+Keyword versions are the CRC32 of the uncompressed keyword JSON (keywords_version()), the
+same CRC the device checks when send_keywords.py transfers that file. target_version is the
+set last generated for the device (/device-payload?device=); a device is out of date when
+the version it reported differs from its target.
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from log_ingest import connect
+
+FLUSH_INTERVAL_S = 5.0
+STALE_AFTER_S = 15 * 60
+
+DEVICE_TABLE = """CREATE TABLE IF NOT EXISTS devices (
+    name TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    last_source TEXT,
+    sightings INTEGER NOT NULL DEFAULT 0,
+    keywords_version INTEGER,
+    keywords_at REAL,
+    target_version INTEGER,
+    target_at REAL
+)"""
+_COLUMNS = ("name", "first_seen", "last_seen", "last_source", "sightings",
+            "keywords_version", "keywords_at", "target_version", "target_at")
+_TIMES = ("first_seen", "last_seen", "keywords_at", "target_at")
+# the in-memory copy is authoritative while the API runs, so a flush overwrites the row
+_UPSERT = ("INSERT INTO devices (%s) VALUES (%s) ON CONFLICT (name) DO UPDATE SET %s" % (
+    ", ".join(_COLUMNS), ", ".join("?" * len(_COLUMNS)),
+    ", ".join("%s = excluded.%s" % (c, c) for c in _COLUMNS[1:])))
+
+
+def keywords_version(payload):
+    """Version of an uncompressed keyword JSON payload."""
+    return zlib.crc32(payload) & 0xFFFFFFFF
+
+
+class Device:
+    __slots__ = _COLUMNS
+
+    def __init__(self, name, first_seen, last_seen, last_source=None, sightings=0, keywords_version=None,
+                 keywords_at=None, target_version=None, target_at=None):
+        self.name = name
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.last_source = last_source
+        self.sightings = sightings
+        self.keywords_version = keywords_version
+        self.keywords_at = keywords_at
+        self.target_version = target_version
+        self.target_at = target_at
+
+    @property
+    def outdated(self):
+        return self.target_version is not None and self.keywords_version != self.target_version
+
+    def row(self):
+        return tuple(getattr(self, c) for c in _COLUMNS)
+
+    def as_dict(self, now):
+        d = {c: getattr(self, c) for c in _COLUMNS}
+        for c in _TIMES:
+            d[c] = datetime.fromtimestamp(d[c], timezone.utc).isoformat() if d[c] else None
+        d["age_s"] = round(now - self.last_seen, 1) if self.last_seen else None
+        d["outdated"] = self.outdated
+        return d
+
+
+class DeviceRegistry:
+
+    def __init__(self, db_path, flush_interval_s=FLUSH_INTERVAL_S):
+        self.db_path = db_path
+        self.flush_interval_s = flush_interval_s
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._dirty = set()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._conn = None
+        # stats
+        self.sightings = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def load(self):
+        conn = self._connection()
+        rows = conn.execute("SELECT %s FROM devices" % ", ".join(_COLUMNS)).fetchall()
+        with self._lock:
+            self._devices = {row[0]: Device(*row) for row in rows}
+            self._dirty.clear()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = connect(self.db_path)
+            self._conn.execute(DEVICE_TABLE)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_devices_last_seen ON devices (last_seen)")
+            self._conn.commit()
+        return self._conn
+
+    def _device(self, name, now):
+        device = self._devices.get(name)
+        if device is None:
+            device = self._devices[name] = Device(name, now, now)
+        self._dirty.add(name)
+        return device
+
+    def seen(self, name, source=None, keywords_version=None, now=None):
+        """Record a sighting. Memory only; the flusher stores it."""
+        now = time.time() if now is None else now
+        with self._lock:
+            device = self._device(name, now)
+            if now > device.last_seen:
+                device.last_seen = now
+            if source is not None:
+                device.last_source = source
+            device.sightings += 1
+            if keywords_version is not None:
+                device.keywords_version = keywords_version
+                device.keywords_at = now
+            self.sightings += 1
+
+    def set_target(self, name, version, now=None):
+        """Record the keyword set generated for a device; it is out of date until it reports it."""
+        now = time.time() if now is None else now
+        with self._lock:
+            device = self._devices.get(name)
+            if device is None:
+                # known from now on, but never seen: last_seen 0 keeps it stale until it reports
+                device = self._devices[name] = Device(name, now, 0.0)
+            device.target_version = version
+            device.target_at = now
+            self._dirty.add(name)
+
+    def get(self, name):
+        return self._devices.get(name)
+
+    def devices(self):
+        with self._lock:
+            return list(self._devices.values())
+
+    def stale(self, after_s=STALE_AFTER_S, now=None):
+        """Devices not seen for after_s seconds, longest silent first."""
+        cutoff = (time.time() if now is None else now) - after_s
+        return sorted((d for d in self.devices() if d.last_seen < cutoff), key=lambda d: d.last_seen)
+
+    def outdated(self):
+        return sorted((d for d in self.devices() if d.outdated), key=lambda d: d.name)
+
+    def flush(self):
+        """Write every device touched since the last flush. Returns the rows written."""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            rows = [self._devices[name].row() for name in self._dirty]
+            self._dirty.clear()
+        conn = self._connection()
+        try:
+            with conn:
+                conn.executemany(_UPSERT, rows)
+        except sqlite3.Error:
+            with self._lock:
+                # retry them on the next round
+                self._dirty.update(row[0] for row in rows)
+            raise
+        self.flushes += 1
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def start(self):
+        self.load()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="device-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval_s):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print("device registry flush:", e)
+
+    def stats(self):
+        return {
+            "devices": len(self._devices),
+            "dirty": len(self._dirty),
+            "sightings": self.sightings,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
@@ -0,0 +1,310 @@
+"""
+Write-optimised intake for bulk encounter uploads (POST /encounters/bulk).
+
+The endpoint only appends the request body, as one framed batch, to the current segment
+file and returns; nothing touches SQLite on the request path. A compactor thread rolls the
+segment every COMPACT_INTERVAL_S (sooner once it reaches SEGMENT_MAX_BYTES), parses the
+closed segments and folds them into the `encounters` table (log_ingest.py) in one
+transaction per segment, then deletes them. The segment's name is stored in the same
+transaction, so a crash between commit and delete cannot insert a segment twice.
+After each round the analytics rollups (rollups.py) are brought up to date.
+
+Segment frame:
+    magic "NEL1"(4) format(1) device_len(2) payload_len(4) device(device_len) payload crc32(4)
+
+Formats:
+    FORMAT_BINARY   match log records exactly as the device stores them (micropython/match_log.py)
+    FORMAT_NDJSON   one JSON object per line:
+                    {"ts": 1718000000.5, "peer": "AA:BB:..", "ids": [..] | "keywords": [..],
+                     "kind": "match", "rssi": -60, "seq": 12, "device": "NIMI_DEV_3A7F"}
+                    only ts is required; device defaults to the one given with the upload.
+                    Lines whose fields have the wrong type are skipped and counted.
+
+A segment whose rows the database still rejects is renamed to <name>.bad (QUARANTINE_SUFFIX)
+and left for inspection, so it cannot hold up the segments behind it.
+"""
+
+import binascii
+import json
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+import rollups
+from log_ingest import KIND_MATCH, INSERT_RECORD, connect
+
+FORMAT_BINARY = 1
+FORMAT_NDJSON = 2
+
+# must match RECORD_FORMAT in micropython/match_log.py
+RECORD_FORMAT = "<IH6sBbBB4I"
+RECORD_SIZE = 32
+# device time.time() counts from 2000-01-01
+DEVICE_EPOCH_OFFSET = 946684800
+
+_MAGIC = b"NEL1"
+_FRAME_HEADER = "<4sBHI"
+_FRAME_HEADER_SIZE = struct.calcsize(_FRAME_HEADER)
+
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+COMPACT_INTERVAL_S = 2.0
+SEGMENT_SUFFIX = ".seg"
+QUARANTINE_SUFFIX = ".bad"
+SEGMENT_TABLE = "CREATE TABLE IF NOT EXISTS encounter_segments (name TEXT PRIMARY KEY, rows INTEGER)"
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+
+def records_to_rows(device, payload):
+    """Rows for INSERT_RECORD from a run of binary match log records.
+
+    peer is kept as the address the device heard; log_ingest.peer_device() names it.
+    """
+    rows = []
+    for time_s, seq, addr, addr_type, rssi, n_ids, flags, *ids in struct.iter_unpack(RECORD_FORMAT, payload):
+        peer = ":".join("%02X" % b for b in addr)
+        rows.append((device, float(time_s + DEVICE_EPOCH_OFFSET), KIND_MATCH, peer, n_ids,
+                     json.dumps(ids[:n_ids]), rssi, seq))
+    return rows
+
+
+def _opt_int(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise TypeError("not an integer: %r" % (value,))
+    value = int(value)
+    if not _INT64_MIN <= value <= _INT64_MAX:
+        raise ValueError("out of range: %d" % value)
+    return value
+
+
+def _opt_str(value):
+    if value is not None and not isinstance(value, str):
+        raise TypeError("not a string: %r" % (value,))
+    return value
+
+
+def _values(value):
+    """The ids/keywords list: integers (hashes) or strings (words)."""
+    if not isinstance(value, list):
+        raise TypeError("not a list: %r" % (value,))
+    return [_opt_int(v) if not isinstance(v, str) else v for v in value]
+
+
+def ndjson_to_rows(device, payload):
+    """Rows for INSERT_RECORD from NDJSON lines, plus the number of lines that were skipped.
+
+    Every field is checked and converted to its column's type here; a line that does not
+    fit is skipped rather than failing the whole segment at insert time.
+    """
+    rows = []
+    skipped = 0
+    for line in payload.splitlines():
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+            ts = float(obj["ts"])
+            if not math.isfinite(ts) or isinstance(obj["ts"], bool):
+                raise ValueError("bad ts")
+            values = _values(obj.get("ids", obj.get("keywords", [])))
+            if None in values:
+                raise TypeError("null id")
+            rows.append((_opt_str(obj.get("device")) or device, ts, _opt_str(obj.get("kind")) or KIND_MATCH,
+                         _opt_str(obj.get("peer")), len(values), json.dumps(values),
+                         _opt_int(obj.get("rssi")), _opt_int(obj.get("seq"))))
+        except (ValueError, KeyError, TypeError, AttributeError, OverflowError):
+            skipped += 1
+    return rows, skipped
+
+
+def read_frames(path):
+    """Yield (device, format, payload) from a segment; stops at a torn or corrupt frame."""
+    with open(path, "rb") as f:
+        data = f.read()
+    off = 0
+    while off + _FRAME_HEADER_SIZE <= len(data):
+        magic, fmt, device_len, payload_len = struct.unpack_from(_FRAME_HEADER, data, off)
+        start = off + _FRAME_HEADER_SIZE
+        end = start + device_len + payload_len
+        if magic != _MAGIC or end + 4 > len(data):
+            return
+        payload = data[start + device_len:end]
+        if binascii.crc32(payload) != struct.unpack_from("<I", data, end)[0]:
+            return
+        yield data[start:start + device_len].decode(errors="replace"), fmt, payload
+        off = end + 4
+
+
+class EncounterLog:
+
+    def __init__(self, directory, db_path, fsync=False, rollups=True, hash_index=None):
+        self.directory = directory
+        self.db_path = db_path
+        self.fsync = fsync
+        self.rollups = rollups
+        self.hash_index = hash_index
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._active = None
+        self._active_path = None
+        self._active_bytes = 0
+        self._counter = 0
+        # stats for GET /encounters/ingest
+        self.batches = 0
+        self.bytes = 0
+        self.rows = 0               # rows inserted by the compactor
+        self.duplicates = 0         # rows already stored (re-uploaded records)
+        self.skipped = 0            # NDJSON lines that did not parse
+        self.segments = 0
+        self.quarantined = 0        # segments renamed to .bad
+        self.last_compaction_ms = 0.0
+        self.rolled_up = 0          # match events folded into the rollups
+        self.last_rollup_ms = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, device, fmt, payload):
+        """Append one batch. Called on the request path: a buffered write and a flush, nothing more."""
+        name = device.encode()
+        frame = (struct.pack(_FRAME_HEADER, _MAGIC, fmt, len(name), len(payload)) + name + payload
+                 + struct.pack("<I", binascii.crc32(payload)))
+        with self._lock:
+            if self._active is None:
+                self._open_segment()
+            self._active.write(frame)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self._active_bytes += len(frame)
+            self.batches += 1
+            self.bytes += len(payload)
+            full = self._active_bytes >= SEGMENT_MAX_BYTES
+        if full:
+            self._wake.set()
+
+    def _open_segment(self):
+        # names sort in write order and are never reused, which the segment table relies on
+        self._counter += 1
+        name = "%016x-%04d%s" % (time.time_ns(), self._counter % 10000, SEGMENT_SUFFIX)
+        self._active_path = os.path.join(self.directory, name)
+        self._active = open(self._active_path, "ab")
+        self._active_bytes = 0
+
+    def _roll(self):
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+
+    def pending(self):
+        """Closed or open segment files not yet compacted."""
+        return sorted(n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX))
+
+    def compact(self, conn):
+        """Fold every segment written so far into the database. Returns the rows inserted."""
+        self._roll()
+        inserted = 0
+        for name in self.pending():
+            path = os.path.join(self.directory, name)
+            with self._lock:
+                if path == self._active_path and self._active is not None:
+                    continue  # opened by an upload since the roll; next round
+            t0 = time.perf_counter()
+            done = conn.execute("SELECT 1 FROM encounter_segments WHERE name = ?", (name,)).fetchone()
+            if not done:
+                rows = []
+                skipped = 0
+                for device, fmt, payload in read_frames(path):
+                    if fmt == FORMAT_BINARY:
+                        rows.extend(records_to_rows(device, payload))
+                    elif fmt == FORMAT_NDJSON:
+                        parsed, bad = ndjson_to_rows(device, payload)
+                        rows.extend(parsed)
+                        skipped += bad
+                before = conn.total_changes
+                try:
+                    with conn:
+                        conn.executemany(INSERT_RECORD, rows)
+                        conn.execute("INSERT INTO encounter_segments (name, rows) VALUES (?, ?)", (name, len(rows)))
+                except sqlite3.OperationalError:
+                    raise  # locked or I/O: the same segment is retried next round
+                except (sqlite3.Error, OverflowError) as e:
+                    # the data itself is rejected; retrying would only block every later segment
+                    os.replace(path, path + QUARANTINE_SUFFIX)
+                    self.quarantined += 1
+                    print("encounter compactor: %s quarantined: %s" % (name, e))
+                    continue
+                # counted once committed, so a segment retried after a lock is not counted twice
+                self.skipped += skipped
+                added = conn.total_changes - before - 1
+                inserted += added
+                self.rows += added
+                self.duplicates += len(rows) - added
+                self.segments += 1
+                self.last_compaction_ms = (time.perf_counter() - t0) * 1000.0
+            os.remove(path)
+        return inserted
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="encounter-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def connect(self):
+        """A connection with the encounter and segment tables in place, as compact() needs."""
+        conn = connect(self.db_path)
+        conn.execute(SEGMENT_TABLE)
+        conn.commit()
+        return conn
+
+    def _run(self):
+        conn = self.connect()
+        if self.rollups:
+            rollups.ensure_schema(conn)
+        try:
+            while True:
+                self._wake.wait(COMPACT_INTERVAL_S)
+                self._wake.clear()
+                try:
+                    self.compact(conn)
+                    if self.rollups:
+                        t0 = time.perf_counter()
+                        n = rollups.update_all(conn, index=self.hash_index)
+                        if n:
+                            self.rolled_up += n
+                            self.last_rollup_ms = (time.perf_counter() - t0) * 1000.0
+                except (OSError, sqlite3.Error) as e:
+                    print("encounter compactor:", e)
+                if self._stopping.is_set():
+                    break
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "bytes": self.bytes,
+            "rows": self.rows,
+            "duplicates": self.duplicates,
+            "skipped_lines": self.skipped,
+            "segments_compacted": self.segments,
+            "segments_pending": len(self.pending()),
+            "segments_quarantined": self.quarantined,
+            "last_compaction_ms": round(self.last_compaction_ms, 2),
+            "rolled_up": self.rolled_up,
+            "last_rollup_ms": round(self.last_rollup_ms, 2),
+        }
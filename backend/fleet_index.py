@@ -0,0 +1,230 @@
+"""
+Inverted index of the fleet's keyword sets: keyword hash -> devices that hold it.
+
+Each device gets a slot number and each posting list is a Python int used as a bitmap over
+the slots, so set algebra runs in C: "devices that would match X" is the OR of the postings
+of X's hashes, and a batch of intersections is a few ANDs each. A device's keyword set
+changes by flipping its bit in the postings of the hashes that came and went, nothing else.
+For 100k devices a posting is 12.5 KB whatever its density.
+
+Fleet-wide degrees (how many devices each device would match) are computed at load, once
+per distinct keyword set, and then kept current: when a device's set changes, only the
+devices whose match with it appeared or went away gain or lose one. /fleet/summary and
+whole-fleet match counts read them instead of OR-ing 20 postings per device (seconds at 100k).
+
+Writers hold the lock and build new dicts and lists that they swap in (copy-on-write, as in
+hash_index.py), so readers take no lock and never see a container change under them.
+
+Keyword sets are stored in device_keywords and loaded at startup (DEVICE_KEYWORDS_QUERY).
+"""
+
+import heapq
+import threading
+
+DEVICE_KEYWORDS_TABLE = """CREATE TABLE IF NOT EXISTS device_keywords (
+    device TEXT NOT NULL,
+    hash INTEGER NOT NULL,
+    PRIMARY KEY (device, hash)
+) WITHOUT ROWID"""
+DEVICE_KEYWORDS_QUERY = "SELECT device, hash FROM device_keywords ORDER BY device"
+
+
+def _slots_of(bitmap):
+    """Slot numbers of the set bits, ascending."""
+    if not bitmap:
+        return []
+    bits = bin(bitmap)[:1:-1]  # least significant first
+    out = []
+    i = bits.find("1")
+    while i >= 0:
+        out.append(i)
+        i = bits.find("1", i + 1)
+    return out
+
+
+def _union(postings, hashes):
+    bitmap = 0
+    for h in hashes:
+        bitmap |= postings.get(h, 0)
+    return bitmap
+
+
+def _degrees(sets, postings):
+    """slot -> devices it would match, computed once per distinct keyword set."""
+    degrees = [0] * len(sets)
+    by_set = {}
+    for slot, hashes in enumerate(sets):
+        by_set.setdefault(hashes, []).append(slot)
+    for hashes, slots in by_set.items():
+        # devices with the same set match each other and are in the union; drop self
+        n = _union(postings, hashes).bit_count() - 1 if hashes else 0
+        for slot in slots:
+            degrees[slot] = n
+    return degrees
+
+
+class FleetIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()   # serialises writers; readers use the current containers
+        self._slots = {}                # device name -> slot
+        self._names = []                # slot -> device name
+        self._sets = []                 # slot -> frozenset of hashes
+        self._postings = {}             # hash -> bitmap of slots
+        self._degrees = []              # slot -> number of other devices it would match
+
+    def __len__(self):
+        return len(self._slots)
+
+    def load(self, rows):
+        """Replace the contents with (device, hash) rows. Postings are built in one pass."""
+        sets = {}
+        for device, hash_value in rows:
+            sets.setdefault(device, set()).add(hash_value)
+        names = list(sets)
+        slots_by_hash = {}
+        for slot, name in enumerate(names):
+            for h in sets[name]:
+                slots_by_hash.setdefault(h, []).append(slot)
+        nbytes = (len(names) + 7) // 8
+        postings = {}
+        for h, slots in slots_by_hash.items():
+            buf = bytearray(nbytes)
+            for slot in slots:
+                buf[slot >> 3] |= 1 << (slot & 7)
+            postings[h] = int.from_bytes(buf, "little")
+        frozen = [frozenset(sets[name]) for name in names]
+        degrees = _degrees(frozen, postings)
+        with self._lock:
+            self._slots = {name: slot for slot, name in enumerate(names)}
+            self._names = names
+            self._sets = frozen
+            self._postings = postings
+            self._degrees = degrees
+
+    def set_device(self, name, hashes):
+        """Replace a device's keyword set. Returns (hashes added, hashes removed)."""
+        new = frozenset(hashes)
+        with self._lock:
+            slot = self._slots.get(name)
+            names, sets, degrees = self._names, self._sets, self._degrees
+            if slot is None:
+                slot = len(names)
+                slots = dict(self._slots)
+                slots[name] = slot
+                names = names + [name]
+                sets = sets + [frozenset()]
+                degrees = degrees + [0]
+            else:
+                slots = self._slots
+            old = sets[slot]
+            if old == new and slots is self._slots:
+                return 0, 0
+            bit = 1 << slot
+            before = _union(self._postings, old)
+            postings = dict(self._postings)
+            for h in old - new:
+                remaining = postings[h] & ~bit
+                if remaining:
+                    postings[h] = remaining
+                else:
+                    del postings[h]
+            for h in new - old:
+                postings[h] = postings.get(h, 0) | bit
+            after = _union(postings, new)
+            # only the devices whose match with this one appeared or went away change degree
+            changed = (before ^ after) & ~bit
+            degrees = list(degrees)
+            for other in _slots_of(changed & after):
+                degrees[other] += 1
+            for other in _slots_of(changed & before):
+                degrees[other] -= 1
+            degrees[slot] = (after & ~bit).bit_count()
+            sets = list(sets)
+            sets[slot] = new
+            # lists before the slots that index them, postings last: a reader holding any newer
+            # container can resolve every slot it finds in it
+            self._sets, self._degrees, self._names = sets, degrees, names
+            self._slots = slots
+            self._postings = postings
+        return len(new - old), len(old - new)
+
+    def devices(self):
+        return list(self._names)
+
+    def keywords(self, name):
+        slot = self._slots.get(name)
+        return None if slot is None else self._sets[slot]
+
+    def names(self, bitmap):
+        names = self._names
+        return [names[slot] for slot in _slots_of(bitmap)]
+
+    def _union(self, hashes):
+        return _union(self._postings, hashes)
+
+    def _intersection(self, hashes):
+        postings = self._postings
+        bitmap = None
+        for h in hashes:
+            p = postings.get(h, 0)
+            bitmap = p if bitmap is None else bitmap & p
+            if not bitmap:
+                return 0
+        return bitmap or 0
+
+    def holding_all(self, hash_lists):
+        """For each list of hashes, the devices that hold every one of them."""
+        return [self.names(self._intersection(hashes)) for hashes in hash_lists]
+
+    def holding_any(self, hash_lists):
+        """For each list of hashes, the devices that hold at least one of them."""
+        return [self.names(self._union(hashes)) for hashes in hash_lists]
+
+    def match_bitmap(self, name):
+        """Devices sharing at least one keyword with `name` (excluding itself), or None if unknown."""
+        slot = self._slots.get(name)
+        if slot is None:
+            return None
+        return self._union(self._sets[slot]) & ~(1 << slot)
+
+    def matches(self, names, columns=None):
+        """Rows of the match matrix: {name: bitmap} for each known name, limited to `columns`."""
+        mask = None
+        if columns is not None:
+            mask = 0
+            for column in columns:
+                slot = self._slots.get(column)
+                if slot is not None:
+                    mask |= 1 << slot
+        rows = {}
+        for name in names:
+            bitmap = self.match_bitmap(name)
+            if bitmap is not None:
+                rows[name] = bitmap if mask is None else bitmap & mask
+        return rows
+
+    def suggest(self, name, limit=10):
+        """Hashes `name` does not hold, ranked by how many devices it would newly match."""
+        slot = self._slots.get(name)
+        if slot is None:
+            return None
+        held = self._sets[slot]
+        unmatched = ~(self._union(held) | (1 << slot))
+        gains = ((h, (p & unmatched).bit_count()) for h, p in self._postings.items() if h not in held)
+        return [(h, n) for h, n in heapq.nlargest(limit, gains, key=lambda g: g[1]) if n]
+
+    def degrees(self):
+        """{name: number of devices it would match}, kept current by set_device()."""
+        return dict(zip(self._names, self._degrees))
+
+    def match_counts(self, names, columns=None):
+        """{name: devices it would match} for each known name, limited to `columns`."""
+        if columns is None:
+            slots, degrees = self._slots, self._degrees
+            return {name: degrees[slots[name]] for name in names if name in slots}
+        return {name: bitmap.bit_count() for name, bitmap in self.matches(names, columns).items()}
+
+    def stats(self):
+        return {"devices": len(self._slots), "hashes": len(self._postings),
+                "distinct_sets": len(set(self._sets))}
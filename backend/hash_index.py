@@ -0,0 +1,103 @@
+"""
+In-memory index of keyword hashes (the id_for() values in keyword_group_category_hash).
+
+Devices and their logs report matches as 32-bit hashes; turning them back into words used
+to cost a query per hash. The API loads the whole table once at startup (a few hundred bytes
+per keyword), adds to it as links are created and reloads it after deletes, so resolving is
+a dict lookup. Readers take no lock: updates build new dicts and swap them in.
+"""
+
+import threading
+from collections import namedtuple
+
+# keyword/group/category names come from the LEFT JOINs and are None for dangling ids
+HASH_INDEX_QUERY = (
+    "SELECT h.hash_value, h.keyword_id, k.word, h.group_id, g.name, h.category_id, c.name "
+    "FROM keyword_group_category_hash h "
+    "LEFT JOIN keywords k ON k.id = h.keyword_id "
+    "LEFT JOIN groups g ON g.id = h.group_id "
+    "LEFT JOIN categories c ON c.id = h.category_id"
+)
+
+Entry = namedtuple("Entry", "hash keyword_id word group_id group category_id category")
+
+
+class HashIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()   # serialises writers only
+        self._by_hash = {}
+        self._by_link = {}              # (keyword_id, group_id, category_id) -> hash
+        self._by_keyword = {}           # keyword_id -> first hash seen for it
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._by_hash)
+
+    def load(self, rows):
+        """Replace the contents with rows from HASH_INDEX_QUERY."""
+        by_hash = {}
+        by_link = {}
+        by_keyword = {}
+        for row in rows:
+            entry = Entry(*row)
+            by_hash[entry.hash] = entry
+            by_link[entry.keyword_id, entry.group_id, entry.category_id] = entry.hash
+            by_keyword.setdefault(entry.keyword_id, entry.hash)
+        with self._lock:
+            self._by_hash, self._by_link, self._by_keyword = by_hash, by_link, by_keyword
+            self.loaded = True
+
+    def add(self, hash_value, keyword_id, word, group_id, group, category_id, category):
+        entry = Entry(hash_value, keyword_id, word, group_id, group, category_id, category)
+        with self._lock:
+            by_hash = dict(self._by_hash)
+            by_hash[hash_value] = entry
+            by_link = dict(self._by_link)
+            by_link[keyword_id, group_id, category_id] = hash_value
+            by_keyword = self._by_keyword
+            if keyword_id not in by_keyword:
+                by_keyword = dict(by_keyword)
+                by_keyword[keyword_id] = hash_value
+            self._by_hash, self._by_link, self._by_keyword = by_hash, by_link, by_keyword
+
+    def get(self, hash_value):
+        return self._by_hash.get(hash_value)
+
+    def resolve(self, hash_values):
+        """({hash: Entry} for the known hashes, [unknown hashes]), in input order."""
+        by_hash = self._by_hash
+        found = {}
+        unknown = []
+        for h in hash_values:
+            entry = by_hash.get(h)
+            if entry is None:
+                unknown.append(h)
+            else:
+                found[h] = entry
+        return found, unknown
+
+    def hash_for(self, keyword_id, group_id=None, category_id=None):
+        """The hash of one keyword link, or of any link of the keyword when no group is given."""
+        if group_id is None:
+            return self._by_keyword.get(keyword_id)
+        return self._by_link.get((keyword_id, group_id, category_id))
+
+    def words(self):
+        """{word: hash} for words that belong to exactly one hash."""
+        words = {}
+        ambiguous = set()
+        for entry in self._by_hash.values():
+            if entry.word is None:
+                continue
+            if entry.word in words:
+                ambiguous.add(entry.word)
+            words[entry.word] = entry.hash
+        for word in ambiguous:
+            del words[word]
+        return words
+
+    def categories(self):
+        """{hash: (group_id, category_id)} for hashes linked to both."""
+        return {h: (e.group_id, e.category_id) for h, e in self._by_hash.items()
+                if e.group_id is not None and e.category_id is not None}
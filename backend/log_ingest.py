@@ -0,0 +1,325 @@
+"""
+Serial log ingestion: tail device consoles (or saved logs), parse the firmware's [MATCH],
+[SCAN] and [TRANSFER] lines and store them in the `encounters` table.
+
+Usage (from backend/):
+    python log_ingest.py --serial COM3 --serial COM5
+    python log_ingest.py --serial /dev/ttyACM0=NIMI_DEV_3A7F
+    python log_ingest.py --file logs/dev3.txt --follow
+    python log_ingest.py --file capture.txt               # one-shot import, prints the rate
+
+Each source is read on its own thread; parsed rows go through a bounded queue to a single
+writer that inserts them with executemany() and commits at most every COMMIT_INTERVAL_S,
+so the database sees a few transactions per second however fast the lines arrive.
+A source is named after the device's "Advertising as:" line once it has seen one.
+"""
+
+import argparse
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+DATABASE_PATH = os.getenv("NEW_DATABASE_PATH", "./data/keywords_new.db")
+
+KIND_MATCH = "match"
+KIND_SCAN = "scan"
+KIND_TRANSFER = "transfer"
+
+# ts is when the line was read (unix seconds); count and payload depend on the kind:
+#   match     peer address (newer firmware; peer_device() gives its name), count = matched keywords, payload = JSON list of them
+#   scan      count = IDs in the peer's packet, payload = JSON list of the IDs that are ours
+#             (older firmware printed every scanned ID instead)
+#   transfer  payload = the message text
+# rssi and seq come only with uploaded match log records (encounter_log.py); a record is
+# stored once per (device, seq, ts) however often a gateway uploads the same log.
+ENCOUNTER_TABLE = """CREATE TABLE IF NOT EXISTS encounters (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    peer TEXT,
+    count INTEGER,
+    payload TEXT,
+    rssi INTEGER,
+    seq INTEGER
+)"""
+# columns added after the table first shipped; connect() adds them to older databases
+ENCOUNTER_ADDED_COLUMNS = (("rssi", "INTEGER"), ("seq", "INTEGER"))
+ENCOUNTER_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_encounters_device_ts ON encounters (device, ts)",
+    "CREATE INDEX IF NOT EXISTS ix_encounters_kind_ts ON encounters (kind, ts)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_encounters_record ON encounters (device, seq, ts) WHERE seq IS NOT NULL",
+)
+INSERT_ENCOUNTER = "INSERT INTO encounters (device, ts, kind, peer, count, payload) VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_RECORD = ("INSERT OR IGNORE INTO encounters (device, ts, kind, peer, count, payload, rssi, seq) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+# devices name themselves after the last two bytes of their public MAC (ble_utils.device_name)
+DEVICE_NAME_PREFIX = "NIMI_DEV_"
+
+BATCH_ROWS = 500            # rows per executemany()
+COMMIT_INTERVAL_S = 1.0
+QUEUE_MAX = 50000           # sources block (back-pressure) once the writer is this far behind
+SERIAL_BAUD = 115200
+RECONNECT_S = 2.0
+FOLLOW_POLL_S = 0.2
+STATS_INTERVAL_S = 10.0
+
+
+def connect(path=DATABASE_PATH):
+    """Open the store with the pragmas the ingesters rely on, creating the table if needed."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")      # readers never block the writer
+    conn.execute("PRAGMA synchronous=NORMAL")    # fsync per checkpoint, not per commit
+    conn.execute(ENCOUNTER_TABLE)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(encounters)")}
+    for name, sql_type in ENCOUNTER_ADDED_COLUMNS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE encounters ADD COLUMN {name} {sql_type}")
+    for statement in ENCOUNTER_INDEXES:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+# Parsing. Lines are tested with startswith() before any regex runs, and the lists are
+# pulled out with findall() rather than literal_eval(), which is several times slower.
+_MATCH_PREFIX = "[MATCH] Matches found: "
+_SCAN_PREFIX = "[SCAN] Scanned "
+_SCAN_OLD_PREFIX = "[SCAN] Scanned numbers are: "
+_TRANSFER_PREFIX = "[TRANSFER] "
+_NAME_PREFIX = "Advertising as: "
+_SCAN = re.compile(r"\[SCAN\] Scanned (\d+) numbers, ours: \[([^\]]*)\]")
+_QUOTED = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"")
+_INT = re.compile(r"\d+")
+_ADDR = re.compile(r"(?:[0-9A-F]{2}:){5}[0-9A-F]{2}$")
+
+
+def peer_device(peer):
+    """Device name for an encounter's peer: "AA:BB:CC:DD:3A:7F" -> "NIMI_DEV_3A7F".
+
+    Peers are stored as the address the device heard, while devices are known by name; this
+    puts both ends of an encounter in one namespace. Anything that is not an address (a name
+    given in an NDJSON upload, None) is returned unchanged.
+    """
+    if peer and len(peer) == 17 and _ADDR.match(peer.upper()):
+        return DEVICE_NAME_PREFIX + (peer[12:14] + peer[15:17]).upper()
+    return peer
+
+
+def parse_line(line):
+    """Return (kind, peer, count, payload) for an encounter line, or None for anything else."""
+    if line.startswith(_MATCH_PREFIX):
+        rest = line[len(_MATCH_PREFIX):]
+        peer = None
+        cut = rest.rfind(" from ")
+        if cut >= 0 and _ADDR.match(rest, cut + 6):
+            peer = rest[cut + 6:]
+            rest = rest[:cut]
+        values = [a or b for a, b in _QUOTED.findall(rest)]
+        return KIND_MATCH, peer, len(values), json.dumps(values)
+    if line.startswith(_SCAN_PREFIX):
+        m = _SCAN.match(line)
+        if m:
+            return KIND_SCAN, None, int(m.group(1)), json.dumps([int(n) for n in _INT.findall(m.group(2))])
+        if line.startswith(_SCAN_OLD_PREFIX):
+            numbers = [int(n) for n in _INT.findall(line, len(_SCAN_OLD_PREFIX))]
+            return KIND_SCAN, None, len(numbers), json.dumps(numbers)
+        return None
+    if line.startswith(_TRANSFER_PREFIX):
+        return KIND_TRANSFER, None, None, line[len(_TRANSFER_PREFIX):]
+    return None
+
+
+class EncounterWriter(threading.Thread):
+    """The single writer: batches rows from every source into executemany() and timed commits."""
+
+    def __init__(self, path=DATABASE_PATH, batch_rows=BATCH_ROWS, commit_interval_s=COMMIT_INTERVAL_S):
+        super().__init__(name="encounter-writer", daemon=True)
+        self.path = path
+        self.batch_rows = batch_rows
+        self.commit_interval_s = commit_interval_s
+        self.queue = queue.Queue(maxsize=QUEUE_MAX)
+        self.stopping = threading.Event()
+        self.rows = 0
+        self.commits = 0
+
+    def put(self, row):
+        self.queue.put(row)
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def run(self):
+        conn = connect(self.path)
+        batch = []
+        uncommitted = 0
+        last_commit = time.monotonic()
+        get = self.queue.get
+        while True:
+            try:
+                batch.append(get(timeout=self.commit_interval_s))
+                while len(batch) < self.batch_rows:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                conn.executemany(INSERT_ENCOUNTER, batch)
+                uncommitted += len(batch)
+                batch.clear()
+            now = time.monotonic()
+            if uncommitted and now - last_commit >= self.commit_interval_s:
+                conn.commit()
+                self.rows += uncommitted
+                self.commits += 1
+                uncommitted = 0
+                last_commit = now
+            if self.stopping.is_set() and self.queue.empty():
+                break
+        if uncommitted:
+            conn.commit()
+            self.rows += uncommitted
+            self.commits += 1
+        conn.close()
+
+
+class Source(threading.Thread):
+    """Turns one device's text stream into encounter rows for the writer."""
+
+    def __init__(self, device, writer):
+        super().__init__(name="source-" + device, daemon=True)
+        self.device = device
+        self.writer = writer
+        self.lines = 0
+        self.stopping = threading.Event()
+
+    def handle(self, line):
+        self.lines += 1
+        event = parse_line(line)
+        if event is not None:
+            self.writer.put((self.device, time.time()) + event)
+        elif line.startswith(_NAME_PREFIX):
+            self.device = line[len(_NAME_PREFIX):].split(" ", 1)[0]
+
+    def handle_block(self, text):
+        """Feed a block of text; returns the unterminated tail to prepend to the next block."""
+        lines = text.split("\n")
+        for line in lines[:-1]:
+            self.handle(line.rstrip("\r"))
+        return lines[-1]
+
+
+class SerialSource(Source):
+    """A device console. Reads whatever is waiting in one call instead of line by line."""
+
+    def __init__(self, port, writer, device=None, baud=SERIAL_BAUD):
+        super().__init__(device or port, writer)
+        self.port = port
+        self.baud = baud
+
+    def run(self):
+        import serial
+
+        while not self.stopping.is_set():
+            try:
+                with serial.Serial(self.port, self.baud, timeout=0.5) as ser:
+                    tail = ""
+                    while not self.stopping.is_set():
+                        data = ser.read(ser.in_waiting or 1)
+                        if data:
+                            tail = self.handle_block(tail + data.decode(errors="replace"))
+            except serial.SerialException as e:
+                print("%s: %s, retrying in %.0f s" % (self.port, e, RECONNECT_S), file=sys.stderr)
+                self.stopping.wait(RECONNECT_S)
+
+
+class FileSource(Source):
+    """A saved console log. With follow=True it keeps reading like tail -F, across rotation."""
+
+    def __init__(self, path, writer, device=None, follow=False):
+        super().__init__(device or os.path.basename(path), writer)
+        self.path = path
+        self.follow = follow
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                f = open(self.path, "r", errors="replace", newline="")
+            except OSError:
+                if not self.follow:
+                    raise
+                self.stopping.wait(FOLLOW_POLL_S)
+                continue
+            with f:
+                inode = os.fstat(f.fileno()).st_ino
+                tail = ""
+                while not self.stopping.is_set():
+                    block = f.read(1 << 16)
+                    if block:
+                        tail = self.handle_block(tail + block)
+                        continue
+                    if not self.follow:
+                        if tail:
+                            self.handle(tail.rstrip("\r"))
+                        return
+                    self.stopping.wait(FOLLOW_POLL_S)
+                    try:
+                        st = os.stat(self.path)
+                    except OSError:
+                        continue
+                    if st.st_ino != inode or st.st_size < f.tell():
+                        break  # rotated or truncated: reopen from the start
+
+
+def _split_source(spec):
+    """"PORT" or "PORT=DEVICE_NAME"."""
+    target, _, device = spec.partition("=")
+    return target, device or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest NIMI device logs into the encounter store")
+    parser.add_argument("--serial", action="append", default=[], metavar="PORT[=NAME]", help="device serial port")
+    parser.add_argument("--file", action="append", default=[], metavar="PATH[=NAME]", help="saved console log")
+    parser.add_argument("--follow", action="store_true", help="keep reading files as they grow")
+    parser.add_argument("--db", default=DATABASE_PATH, help="SQLite database (default: $NEW_DATABASE_PATH)")
+    args = parser.parse_args(argv)
+    if not args.serial and not args.file:
+        parser.error("give at least one --serial or --file")
+
+    writer = EncounterWriter(args.db)
+    writer.start()
+    sources = [SerialSource(port, writer, name) for port, name in map(_split_source, args.serial)]
+    sources += [FileSource(path, writer, name, args.follow) for path, name in map(_split_source, args.file)]
+    t0 = time.monotonic()
+    for source in sources:
+        source.start()
+    try:
+        while any(source.is_alive() for source in sources):
+            for source in sources:
+                source.join(STATS_INTERVAL_S / len(sources))
+            if args.serial or args.follow:
+                print("%d lines, %d rows stored, %d queued" % (
+                    sum(s.lines for s in sources), writer.rows, writer.queue.qsize()), file=sys.stderr)
+    except KeyboardInterrupt:
+        for source in sources:
+            source.stopping.set()
+    writer.stop()
+    elapsed = time.monotonic() - t0
+    lines = sum(s.lines for s in sources)
+    print("%d lines, %d rows in %.2f s (%.0f lines/s, %d commits)" % (
+        lines, writer.rows, elapsed, lines / elapsed if elapsed else 0.0, writer.commits), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,33 @@
+import binascii
 import hashlib
+import heapq
+import json
+import struct
+import zlib
 # Database Models
 
-from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, func
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, func, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+from datetime import datetime, timezone
 import os
+import time
+import rollups
+from hash_index import HASH_INDEX_QUERY, HashIndex
+from device_registry import DeviceRegistry, STALE_AFTER_S, keywords_version
+from fleet_index import DEVICE_KEYWORDS_QUERY, DEVICE_KEYWORDS_TABLE, FleetIndex
+import overlap
+from encounter_log import EncounterLog, FORMAT_BINARY, FORMAT_NDJSON, RECORD_SIZE
 
 # Database setup
 DATABASE_PATH = os.getenv("NEW_DATABASE_PATH", "./data/keywords_new.db")
+# bulk encounter uploads land here first; the compactor moves them into the database
+ENCOUNTER_LOG_DIR = os.getenv("ENCOUNTER_LOG_DIR", os.path.join(os.path.dirname(DATABASE_PATH) or ".", "encounter_log"))
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -59,10 +75,66 @@ class KeywordGroupCategory(Base):
     group = relationship("Group", back_populates="group_links")
     category = relationship("Category", back_populates="group_links")
 
+class DeviceTelemetry(Base):
+    __tablename__ = "device_telemetry"
+    id = Column(Integer, primary_key=True, index=True)
+    device = Column(String, index=True, nullable=False)
+    received_at = Column(DateTime, server_default=func.now(), index=True)
+    version = Column(Integer)
+    uptime_s = Column(Integer)
+    scans_per_s = Column(Integer)
+    scans = Column(Integer)
+    nimi = Column(Integer)
+    matches = Column(Integer)
+    ring_dropped = Column(Integer)
+    irqs = Column(Integer)
+    irq_avg_us = Column(Integer)
+    irq_max_us = Column(Integer)
+    mem_free = Column(Integer)
+    mem_low = Column(Integer)
+    boot_adv_ms = Column(Integer, nullable=True)  # version 2+
+    boot_scan_ms = Column(Integer, nullable=True)
+
 def id_for(group, category, keyword):
     s = f"{group}:{category}:{keyword}"
     return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'big')
 
+# Devices inflate with a 512-byte window; must match DEFLATE_WBITS in micropython/ble_transfer.py
+DEVICE_DEFLATE_WBITS = 9
+
+def device_keywords_payload(keywords, compress=True):
+    """Serialise a {hash: word} dict the way devices store it, optionally zlib/deflate-compressed."""
+    data = json.dumps(keywords, separators=(",", ":")).encode()
+    if compress:
+        c = zlib.compressobj(9, zlib.DEFLATED, DEVICE_DEFLATE_WBITS)
+        data = c.compress(data) + c.flush()
+    return data
+
+# Device telemetry record; must match TELEMETRY_FORMAT in micropython/telemetry.py
+# (tests/test_telemetry_format.py packs a record with the firmware and decodes it here)
+TELEMETRY_VERSION = 2
+TELEMETRY_FORMAT = "<BBHIIIIIIHHIIII"
+TELEMETRY_FIELDS = ("version", "reserved", "scans_per_s", "uptime_s", "scans", "nimi", "matches",
+                    "ring_dropped", "irqs", "irq_avg_us", "irq_max_us", "mem_free", "mem_low",
+                    "boot_adv_ms", "boot_scan_ms")
+# devices not yet updated still send version 1 (no boot timings)
+TELEMETRY_FORMATS = {
+    1: ("<BBHIIIIIIHHII", TELEMETRY_FIELDS[:13]),
+    TELEMETRY_VERSION: (TELEMETRY_FORMAT, TELEMETRY_FIELDS),
+}
+
+def decode_telemetry(raw):
+    """Unpack a device telemetry record into a dict, or None if the version is unknown."""
+    if not raw or raw[0] not in TELEMETRY_FORMATS:
+        return None
+    fmt, fields = TELEMETRY_FORMATS[raw[0]]
+    size = struct.calcsize(fmt)
+    if len(raw) < size:
+        return None
+    values = dict(zip(fields, struct.unpack(fmt, raw[:size])))
+    del values["reserved"]
+    return values
+
 # Pydantic Models
 class KeywordBase(BaseModel):
     word: str
@@ -102,9 +174,40 @@ class KeywordGroupCategoryResponse(KeywordGroupCategoryCreate):
     class Config:
         orm_mode = True
 
+class TelemetryCreate(BaseModel):
+    device: str
+    payload: str  # hex of the packed record, as read from the characteristic or the "TEL" console line
+class TelemetryResponse(BaseModel):
+    id: int
+    device: str
+    received_at: datetime
+    version: int
+    uptime_s: int
+    scans_per_s: int
+    scans: int
+    nimi: int
+    matches: int
+    ring_dropped: int
+    irqs: int
+    irq_avg_us: int
+    irq_max_us: int
+    mem_free: int
+    mem_low: int
+    boot_adv_ms: Optional[int] = None
+    boot_scan_ms: Optional[int] = None
+    class Config:
+        orm_mode = True
+
 # Create tables
 Base.metadata.create_all(bind=engine)
 
+# create_all does not add columns to an existing table; catch up telemetry tables made before v2
+_telemetry_columns = {c["name"] for c in inspect(engine).get_columns("device_telemetry")}
+with engine.begin() as conn:
+    for _column in ("boot_adv_ms", "boot_scan_ms"):
+        if _column not in _telemetry_columns:
+            conn.execute(text(f"ALTER TABLE device_telemetry ADD COLUMN {_column} INTEGER"))
+
 # FastAPI app
 app = FastAPI(title="Group/Category/Keyword API", version="1.0.0")
 app.add_middleware(
@@ -115,6 +218,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# hash -> keyword/group/category, loaded at startup and kept current by the endpoints that write links
+hash_index = HashIndex()
+
+encounter_log = EncounterLog(ENCOUNTER_LOG_DIR, DATABASE_PATH, fsync=os.getenv("ENCOUNTER_LOG_FSYNC") == "1",
+                             hash_index=hash_index)
+
+device_registry = DeviceRegistry(DATABASE_PATH)
+# keyword hash -> devices holding it, for match prediction; persisted in device_keywords
+fleet_index = FleetIndex()
+
+def reload_hash_index():
+    with engine.connect() as conn:
+        hash_index.load(conn.execute(text(HASH_INDEX_QUERY)))
+
+@app.on_event("startup")
+def start_encounter_compactor():
+    # the analytics endpoints may be asked before the compactor's first round
+    with engine.begin() as conn:
+        for statement in rollups.ROLLUP_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(DEVICE_KEYWORDS_TABLE))
+        fleet_index.load(conn.execute(text(DEVICE_KEYWORDS_QUERY)))
+    reload_hash_index()
+    device_registry.start()
+    encounter_log.start()
+
+@app.on_event("shutdown")
+def stop_encounter_compactor():
+    encounter_log.stop()
+    device_registry.stop()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -153,6 +287,7 @@ def delete_group(group_id: int, db: Session = Depends(get_db)):
     # Optionally: check for related categories/keywords and handle them
     db.delete(group)
     db.commit()
+    reload_hash_index()
     return {"detail": "Group deleted."}
 
 # Category Endpoints
@@ -183,13 +318,8 @@ def create_keyword(keyword: KeywordCreate, db: Session = Depends(get_db)):
 @app.get("/keywords", response_model=List[KeywordResponse])
 def list_keywords(db: Session = Depends(get_db)):
     keywords = db.query(Keyword).all()
-    results = []
-    for kw in keywords:
-        # Find the hash for this keyword (if any)
-        hash_entry = db.query(KeywordGroupCategoryHash).filter_by(keyword_id=kw.id).first()
-        uuid = hash_entry.hash_value if hash_entry else None
-        results.append(KeywordResponse(id=kw.id, word=kw.word, uuid=uuid))
-    return results
+    # the hash of one of the keyword's links, if it has any
+    return [KeywordResponse(id=kw.id, word=kw.word, uuid=hash_index.hash_for(kw.id)) for kw in keywords]
 
 # Keyword-Group-Category Endpoints
 @app.post("/keyword-group-category", response_model=KeywordGroupCategoryResponse)
@@ -208,6 +338,7 @@ def link_keyword_group_category(link: KeywordGroupCategoryCreate, db: Session =
         db_hash = KeywordGroupCategoryHash(hash_value=hash_value, group_id=group.id, category_id=category.id, keyword_id=keyword.id)
         db.add(db_hash)
         db.commit()
+        hash_index.add(hash_value, keyword.id, keyword.word, group.id, group.name, category.id, category.name)
     return db_link
 
 @app.get("/keyword-group-category", response_model=List[KeywordGroupCategoryResponse])
@@ -220,12 +351,353 @@ def keywords_by_group_category(group_id: int, category_id: int, db: Session = De
     links = db.query(KeywordGroupCategory).filter_by(group_id=group_id, category_id=category_id).all()
     keyword_ids = [link.keyword_id for link in links]
     keywords = db.query(Keyword).filter(Keyword.id.in_(keyword_ids)).all()
-    results = []
-    for kw in keywords:
-        # Find the hash for this keyword in this group/category
-        hash_entry = db.query(KeywordGroupCategoryHash).filter_by(
-            keyword_id=kw.id, group_id=group_id, category_id=category_id
-        ).first()
-        uuid = hash_entry.hash_value if hash_entry else None
-        results.append(KeywordResponse(id=kw.id, word=kw.word, uuid=uuid))
-    return results
+    return [KeywordResponse(id=kw.id, word=kw.word, uuid=hash_index.hash_for(kw.id, group_id, category_id))
+            for kw in keywords]
+
+# Device keyword payload: {hash: word} JSON for the selected hashes, deflated by default
+@app.post("/device-payload")
+def device_payload(hash_values: List[int], compress: bool = Query(True), device: Optional[str] = Query(None),
+                   db: Session = Depends(get_db)):
+    found, _ = hash_index.resolve(hash_values)
+    keywords = {str(h): entry.word for h, entry in found.items() if entry.word is not None}
+    if not keywords:
+        raise HTTPException(status_code=404, detail="No keywords found")
+    raw = device_keywords_payload(keywords, compress=False)
+    version = keywords_version(raw)
+    if device:
+        assign_device_keywords(db, device, [int(h) for h in keywords], version)
+    body = device_keywords_payload(keywords, compress=compress) if compress else raw
+    return Response(
+        content=body,
+        media_type="application/octet-stream" if compress else "application/json",
+        headers={
+            "X-Keyword-Count": str(len(keywords)),
+            "X-Uncompressed-Length": str(len(raw)),
+            "X-Keywords-Version": str(version),
+            "X-Payload-Encoding": "zlib-w%d" % DEVICE_DEFLATE_WBITS if compress else "identity",
+        },
+    )
+
+def assign_device_keywords(db, device, hash_values, version):
+    """Make hash_values the device's keyword set: stored, indexed, and its registry target."""
+    db.execute(text("DELETE FROM device_keywords WHERE device = :device"), {"device": device})
+    if hash_values:
+        db.execute(text("INSERT INTO device_keywords (device, hash) VALUES (:device, :hash)"),
+                   [{"device": device, "hash": h} for h in hash_values])
+    db.commit()
+    fleet_index.set_device(device, hash_values)
+    # the registry reports the device out of date until it confirms this version
+    device_registry.set_target(device, version)
+
+# Batch hash resolution for match logs and encounter processing, served from hash_index
+MAX_RESOLVE_HASHES = 20000
+
+@app.post("/hashes/resolve")
+def resolve_hashes(hash_values: List[int]):
+    if len(hash_values) > MAX_RESOLVE_HASHES:
+        raise HTTPException(status_code=413, detail=f"at most {MAX_RESOLVE_HASHES} hashes per call")
+    found, unknown = hash_index.resolve(hash_values)
+    body = {
+        "keywords": {
+            str(h): {"word": e.word, "keyword_id": e.keyword_id, "group": e.group, "group_id": e.group_id,
+                     "category": e.category, "category_id": e.category_id}
+            for h, e in found.items()
+        },
+        "unknown": unknown,
+    }
+    # already plain JSON types; skips jsonable_encoder, which dominates the time for large batches
+    return Response(content=json.dumps(body, separators=(",", ":")), media_type="application/json")
+
+# Device telemetry: collectors (micropython/tools/collect_telemetry.py) post raw records here
+@app.post("/telemetry", response_model=TelemetryResponse)
+def add_telemetry(record: TelemetryCreate, db: Session = Depends(get_db)):
+    try:
+        raw = binascii.unhexlify(record.payload)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="payload is not hex")
+    values = decode_telemetry(raw)
+    if values is None:
+        raise HTTPException(status_code=400, detail="Unknown telemetry record")
+    device_registry.seen(record.device, "telemetry")
+    row = DeviceTelemetry(device=record.device, **values)
+    db.add(row)
+    db.commit()
+    db.refresh(row)
+    return row
+
+# Latest record per device, for a fleet overview
+@app.get("/telemetry", response_model=List[TelemetryResponse])
+def latest_telemetry(db: Session = Depends(get_db)):
+    latest = (
+        db.query(DeviceTelemetry.device, func.max(DeviceTelemetry.id).label("id"))
+        .group_by(DeviceTelemetry.device)
+        .subquery()
+    )
+    return (
+        db.query(DeviceTelemetry)
+        .join(latest, DeviceTelemetry.id == latest.c.id)
+        .order_by(DeviceTelemetry.device)
+        .all()
+    )
+
+# Time series for one device, oldest first, ready to chart
+@app.get("/telemetry/{device}", response_model=List[TelemetryResponse])
+def device_telemetry(device: str, since: Optional[datetime] = Query(None), limit: int = Query(500, le=5000),
+                     db: Session = Depends(get_db)):
+    query = db.query(DeviceTelemetry).filter(DeviceTelemetry.device == device)
+    if since is not None:
+        query = query.filter(DeviceTelemetry.received_at >= since)
+    rows = query.order_by(DeviceTelemetry.id.desc()).limit(limit).all()
+    return rows[::-1]
+
+# Bulk encounter upload from gateways: binary match log records (?device= required) or NDJSON.
+# The body is appended to the encounter log and acknowledged; the compactor stores it shortly after.
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq", "text/plain")
+
+@app.post("/encounters/bulk", status_code=202)
+async def upload_encounters(request: Request, device: Optional[str] = Query(None)):
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "application/octet-stream":
+        if not device:
+            raise HTTPException(status_code=400, detail="device is required for binary uploads")
+        if len(body) % RECORD_SIZE:
+            raise HTTPException(status_code=400, detail=f"binary body must be a whole number of {RECORD_SIZE}-byte records")
+        fmt, records = FORMAT_BINARY, len(body) // RECORD_SIZE
+    elif content_type in NDJSON_TYPES:
+        fmt, records = FORMAT_NDJSON, sum(1 for line in body.splitlines() if line.strip())
+    else:
+        raise HTTPException(status_code=415, detail="send application/octet-stream or application/x-ndjson")
+    if body:
+        # a file write, a flush and maybe an fsync: off the event loop
+        await run_in_threadpool(encounter_log.append, device or "", fmt, body)
+        if device:
+            device_registry.seen(device, "upload")
+    return {"accepted": records, "bytes": len(body)}
+
+@app.get("/encounters/ingest")
+def encounter_ingest_status():
+    return encounter_log.stats()
+
+# Encounter analytics. These read only the rollup tables (rollups.py), which the compactor
+# keeps current, so they cost the same however many raw encounters are stored.
+# since/until default to the last ANALYTICS_DEFAULT_BUCKETS buckets; naive datetimes are UTC.
+ANALYTICS_DEFAULT_BUCKETS = 24
+
+def _bucket_range(resolution, since, until):
+    if resolution not in rollups.RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(rollups.RESOLUTIONS)}")
+    res = rollups.RESOLUTIONS[resolution]
+    def epoch(value):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    end = epoch(until) if until is not None else int(time.time())
+    start = epoch(since) if since is not None else end - ANALYTICS_DEFAULT_BUCKETS * res
+    return res, start - start % res, end
+
+def _bucket_time(bucket):
+    return datetime.fromtimestamp(bucket, timezone.utc).isoformat()
+
+# Most matched keywords in each bucket
+@app.get("/analytics/keywords/top")
+def top_keywords(resolution: str = Query("hour"), since: Optional[datetime] = Query(None),
+                 until: Optional[datetime] = Query(None), limit: int = Query(10, ge=1, le=100),
+                 db: Session = Depends(get_db)):
+    res, start, end = _bucket_range(resolution, since, until)
+    rows = db.execute(text(
+        "SELECT bucket, hash, hits FROM ("
+        " SELECT bucket, hash, hits, ROW_NUMBER() OVER (PARTITION BY bucket ORDER BY hits DESC, hash) AS rank"
+        " FROM rollup_keywords WHERE res = :res AND bucket BETWEEN :start AND :end"
+        ") WHERE rank <= :limit ORDER BY bucket, rank"
+    ), {"res": res, "start": start, "end": end, "limit": limit}).fetchall()
+    buckets = {}
+    for bucket, hash_value, hits in rows:
+        entry = hash_index.get(hash_value)
+        buckets.setdefault(bucket, []).append(
+            {"hash": hash_value, "word": entry and entry.word, "group": entry and entry.group,
+             "category": entry and entry.category, "hits": hits})
+    return [{"bucket": _bucket_time(b), "keywords": k} for b, k in buckets.items()]
+
+# Device pairs that met most often over the range
+@app.get("/analytics/pairs/top")
+def top_pairs(resolution: str = Query("hour"), since: Optional[datetime] = Query(None),
+              until: Optional[datetime] = Query(None), limit: int = Query(20, ge=1, le=500),
+              db: Session = Depends(get_db)):
+    res, start, end = _bucket_range(resolution, since, until)
+    rows = db.execute(text(
+        "SELECT device_a, device_b, SUM(hits) AS hits FROM rollup_pairs"
+        " WHERE res = :res AND bucket BETWEEN :start AND :end"
+        " GROUP BY device_a, device_b ORDER BY hits DESC LIMIT :limit"
+    ), {"res": res, "start": start, "end": end, "limit": limit}).fetchall()
+    return [{"device_a": a, "device_b": b, "hits": hits} for a, b, hits in rows]
+
+# Hits per group/category over the range, and their share of all matches in it
+@app.get("/analytics/categories")
+def category_hit_rates(resolution: str = Query("hour"), since: Optional[datetime] = Query(None),
+                       until: Optional[datetime] = Query(None), db: Session = Depends(get_db)):
+    """hits: match events that named at least one keyword of the category, each event counted
+    once per category. rate: hits / all match events in the range (rollup_totals), so it is
+    the share of matches that hit the category and never above 1. Rates of different
+    categories can add up past 1 when a match names keywords from several of them.
+    """
+    res, start, end = _bucket_range(resolution, since, until)
+    params = {"res": res, "start": start, "end": end}
+    matches = db.execute(text(
+        "SELECT COALESCE(SUM(hits), 0) FROM rollup_totals WHERE res = :res AND bucket BETWEEN :start AND :end"
+    ), params).scalar()
+    rows = db.execute(text(
+        "SELECT r.group_id, g.name, r.category_id, c.name, r.hits FROM ("
+        " SELECT group_id, category_id, SUM(hits) AS hits FROM rollup_categories"
+        " WHERE res = :res AND bucket BETWEEN :start AND :end GROUP BY group_id, category_id"
+        ") r LEFT JOIN groups g ON g.id = r.group_id LEFT JOIN categories c ON c.id = r.category_id"
+        " ORDER BY r.hits DESC"
+    ), params).fetchall()
+    return {
+        "matches": matches,
+        "categories": [
+            {"group_id": gid, "group": group, "category_id": cid, "category": category, "hits": hits,
+             "rate": hits / matches if matches else 0.0}
+            for gid, group, cid, category, hits in rows
+        ],
+    }
+
+# Fleet registry. Gateways report the devices they hear; keywords_version is what the device
+# holds (send_keywords.py --backend reports it after a transfer). Served from memory.
+class DeviceHeartbeat(BaseModel):
+    device: str
+    keywords_version: Optional[int] = None
+
+@app.post("/devices/heartbeat")
+def device_heartbeat(beats: List[DeviceHeartbeat]):
+    now = time.time()
+    for beat in beats:
+        device_registry.seen(beat.device, "heartbeat", beat.keywords_version, now)
+    return {"accepted": len(beats)}
+
+@app.get("/devices")
+def list_devices():
+    now = time.time()
+    return [d.as_dict(now) for d in sorted(device_registry.devices(), key=lambda d: d.name)]
+
+@app.get("/devices/stale")
+def stale_devices(after_s: float = Query(STALE_AFTER_S, gt=0)):
+    now = time.time()
+    return [d.as_dict(now) for d in device_registry.stale(after_s, now)]
+
+@app.get("/devices/outdated")
+def outdated_devices():
+    now = time.time()
+    return [d.as_dict(now) for d in device_registry.outdated()]
+
+@app.get("/devices/{name}")
+def get_device(name: str):
+    device = device_registry.get(name)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Device not found.")
+    return device.as_dict(time.time())
+
+# Match prediction over the fleet's keyword sets (fleet_index). Device keyword sets are
+# the ones last generated for them: PUT below, or /device-payload?device=.
+@app.put("/devices/{name}/keywords")
+def set_device_keywords(name: str, hash_values: List[int], db: Session = Depends(get_db)):
+    found, unknown = hash_index.resolve(hash_values)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown hashes: {unknown[:20]}")
+    keywords = {str(h): entry.word for h, entry in found.items()}
+    version = keywords_version(device_keywords_payload(keywords, compress=False))
+    assign_device_keywords(db, name, list(found), version)
+    return {"device": name, "keywords": len(found), "keywords_version": version}
+
+@app.get("/devices/{name}/matches")
+def device_matches(name: str):
+    bitmap = fleet_index.match_bitmap(name)
+    if bitmap is None:
+        raise HTTPException(status_code=404, detail="Device has no keyword set.")
+    names = fleet_index.names(bitmap)
+    return {"device": name, "count": len(names), "matches": names}
+
+# Keywords the device does not hold, by how many more devices each would make it match
+@app.get("/devices/{name}/suggestions")
+def device_suggestions(name: str, limit: int = Query(10, ge=1, le=100)):
+    ranked = fleet_index.suggest(name, limit)
+    if ranked is None:
+        raise HTTPException(status_code=404, detail="Device has no keyword set.")
+    out = []
+    for hash_value, gain in ranked:
+        entry = hash_index.get(hash_value)
+        out.append({"hash": hash_value, "word": entry and entry.word, "group": entry and entry.group,
+                    "category": entry and entry.category, "new_matches": gain})
+    return out
+
+class MatchMatrixQuery(BaseModel):
+    devices: List[str]
+    columns: Optional[List[str]] = None   # default: the whole fleet
+    counts_only: bool = False
+
+# Rows of the match matrix for a batch of devices
+@app.post("/fleet/matches")
+def fleet_matches(query: MatchMatrixQuery):
+    if query.counts_only:
+        return fleet_index.match_counts(query.devices, query.columns)
+    rows = fleet_index.matches(query.devices, query.columns)
+    return {name: fleet_index.names(bitmap) for name, bitmap in rows.items()}
+
+# Batch intersection: for each hash list, the devices holding all of them (or any, with match=any)
+@app.post("/fleet/holders")
+def fleet_holders(hash_lists: List[List[int]], match: str = Query("all")):
+    if match == "all":
+        return fleet_index.holding_all(hash_lists)
+    if match == "any":
+        return fleet_index.holding_any(hash_lists)
+    raise HTTPException(status_code=400, detail="match must be 'all' or 'any'")
+
+# Fleet-wide: devices with the most potential matches, the number of matching pairs, and loners
+@app.get("/fleet/summary")
+def fleet_summary(limit: int = Query(20, ge=1, le=1000)):
+    degrees = fleet_index.degrees()
+    top = heapq.nlargest(limit, degrees.items(), key=lambda d: d[1])
+    return {
+        **fleet_index.stats(),
+        "matching_pairs": sum(degrees.values()) // 2,
+        "without_matches": sum(1 for n in degrees.values() if not n),
+        "top": [{"device": name, "matches": n} for name, n in top],
+    }
+
+# Pairwise keyword overlap (overlap.py) for event planning: the top-k attendees each one
+# shares the most keywords with. Give the selections, or device names to use their keyword
+# sets from the fleet index (all devices when the list is empty).
+MAX_OVERLAP_SELECTIONS = 20000
+
+class OverlapQuery(BaseModel):
+    selections: Optional[Dict[str, List[int]]] = None
+    devices: Optional[List[str]] = None
+    k: int = 10
+    min_shared: int = 1
+
+@app.post("/overlap")
+def keyword_overlap(query: OverlapQuery):
+    if query.selections is not None:
+        selections = query.selections
+    elif query.devices is not None:
+        names = query.devices or fleet_index.devices()
+        selections = {name: list(fleet_index.keywords(name) or ()) for name in names}
+    else:
+        raise HTTPException(status_code=400, detail="give selections or devices")
+    if len(selections) > MAX_OVERLAP_SELECTIONS:
+        raise HTTPException(status_code=413, detail=f"at most {MAX_OVERLAP_SELECTIONS} selections per call")
+    if not 1 <= query.k <= 100:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 100")
+    names = list(selections)
+    t0 = time.perf_counter()
+    bitsets, universe = overlap.encode([selections[name] for name in names])
+    top, pairs = overlap.top_k(bitsets, query.k, query.min_shared)
+    body = {
+        "selections": len(names),
+        "keywords": len(universe),
+        "pairs": pairs,
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000.0, 1),
+        "top": {name: [{"peer": names[j], "shared": n} for j, n in row] for name, row in zip(names, top)},
+    }
+    # large results; skips jsonable_encoder as /hashes/resolve does
+    return Response(content=json.dumps(body, separators=(",", ":")), media_type="application/json")
@@ -0,0 +1,106 @@
+"""
+Pairwise keyword overlap for many selections at once (event planning: who shares what).
+
+Each selection becomes a row of a packed bitset over the sorted universe of hashes that
+appear in any selection, as uint64 words. Intersection counts for a block of rows against
+every row are an AND and a popcount (np.bitwise_count) per word, summed per pair, so 10k
+selections over a few thousand hashes is a few seconds of vectorised work rather than 10^8
+Python set intersections. Blocks keep the temporaries near BLOCK_BYTES; only each block's
+top-K survives it.
+"""
+
+import numpy as np
+
+BLOCK_BYTES = 32 * 1024 * 1024
+# below this share of non-zero bytes, iter_counts() skips the zero ones
+SPARSE_BYTE_DENSITY = 0.25
+
+
+def encode(selections):
+    """(bitsets, universe) for a list of hash lists: bitsets[i] is selection i, packed into uint64."""
+    lengths = np.fromiter((len(s) for s in selections), dtype=np.int64, count=len(selections))
+    flat = np.fromiter((h for s in selections for h in s), dtype=np.int64, count=int(lengths.sum()))
+    universe, columns = np.unique(flat, return_inverse=True)
+    words = max(1, (len(universe) + 63) // 64)
+    bitsets = np.zeros((len(selections), words), dtype=np.uint64)
+    rows = np.repeat(np.arange(len(selections)), lengths)
+    bits = np.left_shift(np.uint64(1), (columns & 63).astype(np.uint64))
+    np.bitwise_or.at(bitsets, (rows, columns >> 6), bits)
+    return bitsets, universe
+
+
+def _count_dtype(bitsets):
+    """uint16 while no overlap can reach 65536 (a universe under that many hashes), else uint32."""
+    return np.uint16 if bitsets.shape[1] * 64 <= 0xFFFF else np.uint32
+
+
+def _block_rows(n, count_bytes=2):
+    # per block: the running counts plus, on the dense path, the AND result and its popcount
+    return max(1, min(n, BLOCK_BYTES // max(1, n * (10 + count_bytes))))
+
+
+def iter_counts(bitsets):
+    """Yield (start, counts) where counts[r, j] is the overlap of row start+r with row j.
+
+    Counts are _count_dtype(bitsets): uint16, or uint32 for universes of 65536 hashes and
+    more, so they never wrap. Each step takes one word column
+    against a transposed copy. When few bytes are non-zero, as with a few dozen keywords out
+    of thousands, it works on bytes and only pairs rows and columns whose byte is non-zero;
+    otherwise on whole 64-bit words, as contiguous (block x n) operations.
+    """
+    n = bitsets.shape[0]
+    dtype = _count_dtype(bitsets)
+    step = _block_rows(n, np.dtype(dtype).itemsize)
+    as_bytes = bitsets.view(np.uint8)
+    sparse = np.count_nonzero(as_bytes) <= SPARSE_BYTE_DENSITY * as_bytes.size
+    words = as_bytes if sparse else bitsets
+    columns = np.ascontiguousarray(words.T)
+    if sparse:
+        nonzero = [np.flatnonzero(column) for column in columns]
+        values = [column[idx] for column, idx in zip(columns, nonzero)]
+    else:
+        anded = np.empty((step, n), dtype=np.uint64)
+        popcount = np.empty((step, n), dtype=np.uint8)
+    for start in range(0, n, step):
+        block = words[start:start + step]
+        rows = block.shape[0]
+        counts = np.zeros((rows, n), dtype=dtype)
+        for w in range(words.shape[1]):
+            if sparse:
+                hit = np.flatnonzero(block[:, w])
+                if len(hit) and len(nonzero[w]):
+                    counts[hit[:, None], nonzero[w][None, :]] += np.bitwise_count(
+                        block[hit, w][:, None] & values[w][None, :])
+            else:
+                np.bitwise_and(block[:, w, None], columns[w][None, :], out=anded[:rows])
+                np.bitwise_count(anded[:rows], out=popcount[:rows])
+                counts += popcount[:rows]
+        yield start, counts
+
+
+def top_k(bitsets, k=10, min_shared=1):
+    """Per row, up to k (row, shared) pairs with the most shared keywords, best first.
+
+    Also returns the number of pairs (each counted once) sharing at least min_shared (>= 1).
+    """
+    n = bitsets.shape[0]
+    k = min(k, n - 1)
+    min_shared = max(1, min_shared)
+    result = [[] for _ in range(n)]
+    pairs = 0
+    if k <= 0:
+        return result, pairs
+    for start, counts in iter_counts(bitsets):
+        rows = np.arange(counts.shape[0])
+        counts[rows, start + rows] = 0  # a row does not match itself
+        pairs += int(np.count_nonzero(counts >= min_shared))
+        best = np.argpartition(counts, -k, axis=1)[:, -k:]
+        best_counts = np.take_along_axis(counts, best, axis=1)
+        order = np.argsort(-best_counts.astype(np.int64), axis=1, kind="stable")
+        best = np.take_along_axis(best, order, axis=1)
+        best_counts = np.take_along_axis(best_counts, order, axis=1)
+        for r in rows:
+            keep = best_counts[r] >= min_shared
+            result[start + r] = list(zip(best[r][keep].tolist(), best_counts[r][keep].tolist()))
+    # the matrix is symmetric, so every pair was counted from both ends
+    return result, pairs // 2
@@ -0,0 +1,156 @@
+"""
+Encounter analytics rollups, maintained incrementally from the `encounters` table.
+
+Each update() reads the match events added since the last one (a watermark on
+encounters.id), counts them per time bucket in memory and adds the counts to the rollup
+tables with INSERT ... ON CONFLICT DO UPDATE, in the same transaction as the new watermark.
+Every event is counted once, whichever path stored it (log_ingest.py or the bulk upload
+compactor in encounter_log.py, which calls update() after each round).
+
+    rollup_totals      (res, bucket)                           match events
+    rollup_keywords    (res, bucket, hash)                     match events with the hash
+    rollup_categories  (res, bucket, group_id, category_id)    match events with any hash of
+                                                               the group/category
+    rollup_pairs       (res, bucket, device_a, device_b)       encounters per pair of device
+                                                               names (peer_device()), a < b
+
+Counts are of events: a match naming two keywords of one category adds 1 to that category,
+so rollup_categories.hits / rollup_totals.hits is the share of matches that hit it (<= 1).
+
+res is the bucket width in seconds (RESOLUTIONS) and bucket its start, both UTC. Dashboards
+query these through the /analytics endpoints and never touch the raw events. Minute buckets
+are dropped after MINUTE_RETENTION_S; hour and day buckets are kept.
+
+Events from uploaded match logs carry keyword hashes. Serial-log matches carry the keyword
+words; a word is counted when it maps to exactly one hash (HashIndex.words()).
+"""
+
+import json
+import sqlite3
+import time
+from collections import Counter
+
+from hash_index import HASH_INDEX_QUERY, HashIndex
+from log_ingest import peer_device
+
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+MINUTE_RETENTION_S = 14 * 86400
+UPDATE_BATCH = 20000
+
+ROLLUP_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS rollup_totals (
+        res INTEGER NOT NULL, bucket INTEGER NOT NULL, hits INTEGER NOT NULL,
+        PRIMARY KEY (res, bucket)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS rollup_keywords (
+        res INTEGER NOT NULL, bucket INTEGER NOT NULL, hash INTEGER NOT NULL, hits INTEGER NOT NULL,
+        PRIMARY KEY (res, bucket, hash)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS rollup_categories (
+        res INTEGER NOT NULL, bucket INTEGER NOT NULL, group_id INTEGER NOT NULL, category_id INTEGER NOT NULL,
+        hits INTEGER NOT NULL,
+        PRIMARY KEY (res, bucket, group_id, category_id)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS rollup_pairs (
+        res INTEGER NOT NULL, bucket INTEGER NOT NULL, device_a TEXT NOT NULL, device_b TEXT NOT NULL,
+        hits INTEGER NOT NULL,
+        PRIMARY KEY (res, bucket, device_a, device_b)
+    ) WITHOUT ROWID""",
+    "CREATE TABLE IF NOT EXISTS rollup_state (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL)",
+)
+
+_UPSERT_TOTALS = ("INSERT INTO rollup_totals (res, bucket, hits) VALUES (?, ?, ?) "
+                  "ON CONFLICT (res, bucket) DO UPDATE SET hits = hits + excluded.hits")
+_UPSERT_KEYWORDS = ("INSERT INTO rollup_keywords (res, bucket, hash, hits) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (res, bucket, hash) DO UPDATE SET hits = hits + excluded.hits")
+_UPSERT_CATEGORIES = ("INSERT INTO rollup_categories (res, bucket, group_id, category_id, hits) VALUES (?, ?, ?, ?, ?) "
+                      "ON CONFLICT (res, bucket, group_id, category_id) DO UPDATE SET hits = hits + excluded.hits")
+_UPSERT_PAIRS = ("INSERT INTO rollup_pairs (res, bucket, device_a, device_b, hits) VALUES (?, ?, ?, ?, ?) "
+                 "ON CONFLICT (res, bucket, device_a, device_b) DO UPDATE SET hits = hits + excluded.hits")
+
+
+def ensure_schema(conn):
+    for statement in ROLLUP_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+
+
+def _dimensions(conn, index):
+    """{hash: (group_id, category_id)} and {word: hash}, from the API's index or the database."""
+    if index is None or not index.loaded:
+        index = HashIndex()
+        try:
+            index.load(conn.execute(HASH_INDEX_QUERY))
+        except sqlite3.OperationalError:  # keyword tables not created yet (log_ingest run before the API)
+            pass
+    return index.categories(), index.words()
+
+
+def update(conn, limit=UPDATE_BATCH, index=None):
+    """Fold up to `limit` new match events into the rollups. Returns how many were read.
+
+    index is a loaded HashIndex to take keyword groups and categories from; without one they
+    are read from the database.
+    """
+    row = conn.execute("SELECT last_id FROM rollup_state WHERE name = 'encounters'").fetchone()
+    last_id = row[0] if row else 0
+    events = conn.execute(
+        "SELECT id, device, ts, peer, payload FROM encounters WHERE id > ? AND kind = 'match' ORDER BY id LIMIT ?",
+        (last_id, limit)).fetchall()
+    if not events:
+        return 0
+    categories, words = _dimensions(conn, index)
+    totals = Counter()
+    keywords = Counter()
+    cats = Counter()
+    pairs = Counter()
+    for _, device, ts, peer, payload in events:
+        try:
+            values = json.loads(payload) if payload else []
+        except ValueError:
+            values = []
+        hashes = set()
+        for value in values:
+            if isinstance(value, int):
+                hashes.add(value)
+            elif value in words:
+                hashes.add(words[value])
+        hit_categories = {categories[h] for h in hashes if h in categories}
+        # peers are addresses and devices names: compare them as names, so A meeting B and B
+        # meeting A land on the same pair
+        peer = peer_device(peer)
+        pair = tuple(sorted((device, peer))) if peer and peer != device else None
+        t = int(ts)
+        for res in RESOLUTIONS.values():
+            bucket = t - t % res
+            totals[res, bucket] += 1
+            for h in hashes:
+                keywords[res, bucket, h] += 1
+            for category in hit_categories:
+                cats[(res, bucket) + category] += 1
+            if pair:
+                pairs[(res, bucket) + pair] += 1
+    with conn:
+        conn.executemany(_UPSERT_TOTALS, [k + (n,) for k, n in totals.items()])
+        conn.executemany(_UPSERT_KEYWORDS, [k + (n,) for k, n in keywords.items()])
+        conn.executemany(_UPSERT_CATEGORIES, [k + (n,) for k, n in cats.items()])
+        conn.executemany(_UPSERT_PAIRS, [k + (n,) for k, n in pairs.items()])
+        conn.execute("INSERT INTO rollup_state (name, last_id) VALUES ('encounters', ?) "
+                     "ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id", (events[-1][0],))
+    return len(events)
+
+
+def update_all(conn, limit=UPDATE_BATCH, index=None):
+    """Catch up completely, one transaction per batch, then prune old minute buckets."""
+    total = 0
+    while True:
+        n = update(conn, limit, index)
+        total += n
+        if n < limit:
+            break
+    if total:
+        cutoff = int(time.time()) - MINUTE_RETENTION_S
+        with conn:
+            for table in ("rollup_totals", "rollup_keywords", "rollup_categories", "rollup_pairs"):
+                conn.execute(f"DELETE FROM {table} WHERE res = ? AND bucket < ?", (RESOLUTIONS["minute"], cutoff))
+    return total
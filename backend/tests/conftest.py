@@ -0,0 +1,15 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# the backend modules import each other as top-level modules (uvicorn main_new:app)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture(scope="session")
+def main_new(tmp_path_factory):
+    # the API module creates its database and encounter log on import
+    os.environ["NEW_DATABASE_PATH"] = str(tmp_path_factory.mktemp("db") / "keywords.db")
+    return importlib.import_module("main_new")
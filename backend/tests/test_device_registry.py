@@ -0,0 +1,104 @@
+import sqlite3
+
+import pytest
+
+from device_registry import DeviceRegistry, keywords_version
+
+
+def _registry(tmp_path):
+    return DeviceRegistry(str(tmp_path / "db.sqlite"))
+
+
+def _rows(registry):
+    return registry._connection().execute(
+        "SELECT name, first_seen, last_seen, last_source, sightings FROM devices ORDER BY name").fetchall()
+
+
+def test_sightings_coalesce_into_one_row_per_device(tmp_path):
+    registry = _registry(tmp_path)
+    for i in range(100):
+        registry.seen("NIMI_DEV_0001", source="telemetry", now=1000.0 + i)
+    registry.seen("NIMI_DEV_0002", now=1050.0)
+    registry.seen("NIMI_DEV_0002", source="upload", now=1040.0)   # late report does not move last_seen back
+    assert _rows(registry) == []
+    assert registry.flush() == 2
+    assert _rows(registry) == [("NIMI_DEV_0001", 1000.0, 1099.0, "telemetry", 100),
+                               ("NIMI_DEV_0002", 1050.0, 1050.0, "upload", 2)]
+    assert registry.flush() == 0
+    assert registry.stats() == {"devices": 2, "dirty": 0, "sightings": 102, "flushes": 1, "rows_written": 2}
+
+
+def test_flush_overwrites_the_stored_row(tmp_path):
+    registry = _registry(tmp_path)
+    registry.seen("NIMI_DEV_0001", now=1000.0)
+    registry.flush()
+    registry.seen("NIMI_DEV_0001", now=2000.0)
+    assert registry.flush() == 1
+    assert _rows(registry) == [("NIMI_DEV_0001", 1000.0, 2000.0, None, 2)]
+
+
+class _FailingOnce:
+    """A connection whose first executemany() fails as a locked database would."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def executemany(self, sql, rows):
+        if not self.failed:
+            self.failed = True
+            raise sqlite3.OperationalError("database is locked")
+        return self._conn.executemany(sql, rows)
+
+
+def test_failed_flush_keeps_devices_dirty(tmp_path):
+    registry = _registry(tmp_path)
+    conn = registry._connection()
+    registry._conn = _FailingOnce(conn)
+    registry.seen("NIMI_DEV_0001", now=1000.0)
+    registry.seen("NIMI_DEV_0002", now=1000.0)
+    with pytest.raises(sqlite3.OperationalError):
+        registry.flush()
+    assert registry.stats()["dirty"] == 2
+    # sightings between the failure and the retry land in the same rows
+    registry.seen("NIMI_DEV_0001", now=1001.0)
+    assert registry.flush() == 2
+    assert [r[:3] for r in _rows(registry)] == [("NIMI_DEV_0001", 1000.0, 1001.0),
+                                                ("NIMI_DEV_0002", 1000.0, 1000.0)]
+
+
+def test_load_round_trips(tmp_path):
+    registry = _registry(tmp_path)
+    registry.seen("NIMI_DEV_0001", source="heartbeat", keywords_version=7, now=1000.0)
+    registry.set_target("NIMI_DEV_0001", 7, now=1001.0)
+    registry.stop()
+    again = _registry(tmp_path)
+    again.load()
+    device = again.get("NIMI_DEV_0001")
+    assert device.row() == ("NIMI_DEV_0001", 1000.0, 1000.0, "heartbeat", 1, 7, 1000.0, 7, 1001.0)
+    assert again.stats()["dirty"] == 0
+
+
+def test_stale_and_outdated(tmp_path):
+    registry = _registry(tmp_path)
+    version = keywords_version(b'{"7": "sail"}')
+    registry.seen("NIMI_DEV_0001", keywords_version=version, now=1000.0)
+    registry.seen("NIMI_DEV_0002", keywords_version=version, now=1900.0)
+    registry.seen("NIMI_DEV_0003", now=500.0)
+    registry.set_target("NIMI_DEV_0001", version, now=1000.0)
+    registry.set_target("NIMI_DEV_0002", version + 1, now=1000.0)
+    registry.set_target("NIMI_DEV_0004", version, now=1000.0)    # assigned, never seen
+    assert [d.name for d in registry.stale(after_s=600, now=2000.0)] == [
+        "NIMI_DEV_0004", "NIMI_DEV_0003", "NIMI_DEV_0001"]
+    assert [d.name for d in registry.outdated()] == ["NIMI_DEV_0002", "NIMI_DEV_0004"]
+    registry.seen("NIMI_DEV_0002", keywords_version=version + 1, now=2000.0)
+    assert [d.name for d in registry.outdated()] == ["NIMI_DEV_0004"]
@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+import encounter_log
+from encounter_log import FORMAT_NDJSON, EncounterLog, ndjson_to_rows
+
+
+def _lines(*objs):
+    return "\n".join(o if isinstance(o, str) else json.dumps(o) for o in objs).encode()
+
+
+def _log(tmp_path):
+    log = EncounterLog(str(tmp_path / "segments"), str(tmp_path / "db.sqlite"), rollups=False)
+    return log, log.connect()
+
+
+def test_ndjson_skips_lines_with_wrong_field_types():
+    payload = _lines(
+        {"ts": 1, "rssi": [1]},
+        {"ts": 2, "seq": {"a": 1}},
+        {"ts": 3, "peer": 5},
+        {"ts": 4, "kind": ["match"]},
+        {"ts": 5, "device": 7},
+        {"ts": 6, "ids": "abc"},
+        {"ts": 7, "ids": [[1]]},
+        {"ts": 8, "seq": 1 << 70},
+        {"ts": "NaN"},
+        "[1, 2]",
+        "not json",
+        {"ts": 9, "peer": "AA:BB:CC:DD:EE:FF", "ids": [1, "sail"], "rssi": -60, "seq": 3},
+    )
+    rows, skipped = ndjson_to_rows("NIMI_DEV_0001", payload)
+    assert skipped == 11
+    assert rows == [("NIMI_DEV_0001", 9.0, "match", "AA:BB:CC:DD:EE:FF", 2, '[1, "sail"]', -60, 3)]
+
+
+def test_malformed_line_does_not_block_later_segments(tmp_path):
+    log, conn = _log(tmp_path)
+    log.append("NIMI_DEV_0001", FORMAT_NDJSON, _lines({"ts": 1, "rssi": [1]}, {"ts": 2, "seq": 1}))
+    log.compact(conn)
+    log.append("NIMI_DEV_0001", FORMAT_NDJSON, _lines({"ts": 3, "seq": 2}))
+    log.compact(conn)
+    assert conn.execute("SELECT ts FROM encounters ORDER BY ts").fetchall() == [(2.0,), (3.0,)]
+    assert log.pending() == []
+    assert log.skipped == 1
+
+
+def test_rejected_segment_is_quarantined(tmp_path, monkeypatch):
+    log, conn = _log(tmp_path)
+    log.append("NIMI_DEV_0001", FORMAT_NDJSON, _lines({"ts": 1}))
+    # a row the database refuses, as a type the parser should have caught would be
+    monkeypatch.setattr(encounter_log, "ndjson_to_rows",
+                        lambda device, payload: ([(device, 1.0, "match", None, 0, "[]", [1], None)], 0))
+    log.compact(conn)
+    monkeypatch.undo()
+    log.append("NIMI_DEV_0001", FORMAT_NDJSON, _lines({"ts": 2}))
+    log.compact(conn)
+    assert conn.execute("SELECT ts FROM encounters").fetchall() == [(2.0,)]
+    assert log.pending() == []
+    assert log.quarantined == 1
+    assert [n for n in os.listdir(log.directory) if n.endswith(encounter_log.QUARANTINE_SUFFIX)]
+
+
+class _LockedOnce:
+    """A connection whose first executemany() fails as a locked database would."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def executemany(self, sql, rows):
+        if not self.failed:
+            self.failed = True
+            raise sqlite3.OperationalError("database is locked")
+        return self._conn.executemany(sql, rows)
+
+
+def test_skipped_lines_counted_once_when_a_segment_is_retried(tmp_path):
+    log, conn = _log(tmp_path)
+    log.append("NIMI_DEV_0001", FORMAT_NDJSON, _lines({"ts": 1, "rssi": [1]}, {"ts": 2}))
+    locked = _LockedOnce(conn)
+    with pytest.raises(sqlite3.OperationalError):
+        log.compact(locked)
+    assert log.skipped == 0
+    log.compact(locked)
+    assert log.skipped == 1
+    assert conn.execute("SELECT ts FROM encounters").fetchall() == [(2.0,)]
+
+
+def test_upload_counts_only_non_blank_lines(main_new):
+    from fastapi.testclient import TestClient
+    with TestClient(main_new.app) as client:
+        body = _lines({"ts": 1}, "", "  ", {"ts": 2}) + b"\n\n"
+        r = client.post("/encounters/bulk?device=NIMI_DEV_0001", content=body,
+                        headers={"Content-Type": "application/x-ndjson"})
+    assert r.status_code == 202
+    assert r.json() == {"accepted": 2, "bytes": len(body)}
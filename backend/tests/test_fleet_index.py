@@ -0,0 +1,78 @@
+import random
+import threading
+
+from fleet_index import FleetIndex
+
+
+def _fleet(rng, devices=60, universe=40, keywords=4):
+    hashes = list(range(1000, 1000 + universe))
+    return {"D%02d" % i: set(rng.sample(hashes, keywords)) for i in range(devices)}, hashes
+
+
+def _expected_matches(sets, name):
+    return sorted(other for other, s in sets.items() if other != name and s & sets[name])
+
+
+def _check(index, sets):
+    for name in sets:
+        assert sorted(index.names(index.match_bitmap(name))) == _expected_matches(sets, name)
+    assert index.degrees() == {name: len(_expected_matches(sets, name)) for name in sets}
+
+
+def test_queries_agree_with_brute_force():
+    rng = random.Random(3)
+    sets, hashes = _fleet(rng)
+    index = FleetIndex()
+    index.load((name, h) for name, s in sets.items() for h in s)
+    _check(index, sets)
+    a, b = hashes[:2]
+    assert sorted(index.holding_all([[a, b]])[0]) == sorted(n for n, s in sets.items() if {a, b} <= s)
+    assert sorted(index.holding_any([[a, b]])[0]) == sorted(n for n, s in sets.items() if {a, b} & s)
+    assert index.match_counts(["D00", "nobody"]) == {"D00": len(_expected_matches(sets, "D00"))}
+
+
+def test_degrees_follow_updates():
+    rng = random.Random(4)
+    sets, hashes = _fleet(rng)
+    index = FleetIndex()
+    index.load((name, h) for name, s in sets.items() for h in s)
+    for i in range(200):
+        name = rng.choice(list(sets) + ["NEW%d" % i])
+        sets[name] = set(rng.sample(hashes, rng.randrange(0, 6)))
+        index.set_device(name, sets[name])
+    _check(index, sets)
+
+
+def test_suggest_ranks_by_new_matches():
+    index = FleetIndex()
+    index.load([("A", 1), ("B", 1), ("C", 2), ("D", 2), ("E", 2), ("F", 3)])
+    # A already matches B; hash 2 adds C, D and E, hash 3 adds F
+    assert index.suggest("A") == [(2, 3), (3, 1)]
+
+
+def test_readers_run_while_writers_update():
+    rng = random.Random(5)
+    sets, hashes = _fleet(rng, devices=200, universe=30)
+    index = FleetIndex()
+    index.load((name, h) for name, s in sets.items() for h in s)
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        try:
+            while not stop.is_set():
+                index.degrees()
+                index.suggest("D00")
+                index.match_counts(["D01", "NEW5"])
+        except Exception as e:  # a container changed under a reader
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for t in readers:
+        t.start()
+    for i in range(2000):
+        index.set_device(rng.choice(list(sets)) if i % 2 else "NEW%d" % i, rng.sample(hashes, 3))
+    stop.set()
+    for t in readers:
+        t.join()
+    assert not errors
@@ -0,0 +1,82 @@
+from hash_index import Entry, HashIndex
+
+
+def _index():
+    index = HashIndex()
+    index.load([
+        (7, 1, "sail", 10, "G", 20, "C"),
+        (8, 2, "reef", 10, "G", 20, "C"),
+        (9, 1, "sail", 11, "H", 21, "D"),   # the same keyword under another group
+        (5, 3, None, None, None, None, None),  # a hash whose keyword was deleted
+    ])
+    return index
+
+
+def test_resolve_splits_known_and_unknown_in_input_order():
+    index = _index()
+    found, unknown = index.resolve([8, 404, 7, 8, 405])
+    assert list(found) == [8, 7]
+    assert found[7] == Entry(7, 1, "sail", 10, "G", 20, "C")
+    assert unknown == [404, 405]
+    assert index.resolve([]) == ({}, [])
+
+
+def test_hash_for_link_and_keyword():
+    index = _index()
+    assert index.hash_for(1, 11, 21) == 9
+    assert index.hash_for(1) == 7          # the first link loaded for the keyword
+    assert index.hash_for(1, 10, 21) is None
+    assert index.hash_for(99) is None
+
+
+def test_add_swaps_in_new_dicts():
+    index = _index()
+    before = index._by_hash
+    found, _ = index.resolve([7])
+    index.add(11, 4, "kite", 10, "G", 20, "C")
+    # readers holding the old dict keep a consistent view
+    assert 11 not in before
+    assert index.get(11).word == "kite"
+    assert index.hash_for(4) == 11
+    assert index.hash_for(4, 10, 20) == 11
+    assert len(index) == 5
+    assert found[7] is index.get(7)
+
+
+def test_add_keeps_the_first_hash_for_a_keyword():
+    index = _index()
+    index.add(12, 2, "reef", 11, "H", 21, "D")
+    assert index.hash_for(2) == 8
+    assert index.hash_for(2, 11, 21) == 12
+
+
+def test_load_replaces_everything():
+    index = _index()
+    assert not HashIndex().loaded and index.loaded
+    index.load([(8, 2, "reef", 10, "G", 20, "C")])
+    assert len(index) == 1
+    assert index.resolve([7, 8])[1] == [7]
+    assert index.hash_for(1) is None
+
+
+def test_words_and_categories():
+    index = _index()
+    # "sail" maps to two hashes, so it cannot name one
+    assert index.words() == {"reef": 8}
+    assert index.categories() == {7: (10, 20), 8: (10, 20), 9: (11, 21)}
+
+
+def test_resolve_endpoint(main_new):
+    from fastapi.testclient import TestClient
+    with TestClient(main_new.app) as client:
+        # after startup, which loads the index from the database
+        main_new.hash_index.add(4000000001, 901, "kite", 902, "G", 903, "C")
+        r = client.post("/hashes/resolve", json=[4000000001, 4000000002])
+        assert r.status_code == 200
+        assert r.json() == {
+            "keywords": {"4000000001": {"word": "kite", "keyword_id": 901, "group": "G", "group_id": 902,
+                                        "category": "C", "category_id": 903}},
+            "unknown": [4000000002],
+        }
+        r = client.post("/hashes/resolve", json=[1] * (main_new.MAX_RESOLVE_HASHES + 1))
+        assert r.status_code == 413
@@ -0,0 +1,63 @@
+import json
+
+import log_ingest
+from log_ingest import KIND_MATCH, KIND_SCAN, KIND_TRANSFER, EncounterWriter, Source, parse_line, peer_device
+
+
+def test_match_line_with_peer():
+    line = "[MATCH] Matches found: ['sail', \"it's\", 'a, b'] from AA:BB:CC:DD:3A:7F"
+    kind, peer, count, payload = parse_line(line)
+    assert (kind, peer, count) == (KIND_MATCH, "AA:BB:CC:DD:3A:7F", 3)
+    assert json.loads(payload) == ["sail", "it's", "a, b"]
+    assert peer_device(peer) == "NIMI_DEV_3A7F"
+
+
+def test_match_line_from_older_firmware_has_no_peer():
+    assert parse_line("[MATCH] Matches found: ['sail']") == (KIND_MATCH, None, 1, '["sail"]')
+    # " from " inside a keyword is not an address
+    assert parse_line("[MATCH] Matches found: ['away from home']") == (KIND_MATCH, None, 1, '["away from home"]')
+
+
+def test_scan_lines_new_and_old_format():
+    assert parse_line("[SCAN] Scanned 12 numbers, ours: [3, 17]") == (KIND_SCAN, None, 12, "[3, 17]")
+    assert parse_line("[SCAN] Scanned 4 numbers, ours: []") == (KIND_SCAN, None, 4, "[]")
+    assert parse_line("[SCAN] Scanned numbers are: [5, 6, 7]") == (KIND_SCAN, None, 3, "[5, 6, 7]")
+    assert parse_line("[SCAN] Scanned something else") is None
+
+
+def test_transfer_and_other_lines():
+    assert parse_line("[TRANSFER] MTU exchanged: 247") == (KIND_TRANSFER, None, None, "MTU exchanged: 247")
+    assert parse_line("[BOOT] starting") is None
+    assert parse_line("") is None
+    assert parse_line(" [MATCH] Matches found: ['sail']") is None
+
+
+class _Rows:
+    def __init__(self):
+        self.rows = []
+
+    def put(self, row):
+        self.rows.append(row)
+
+
+def test_source_splits_blocks_and_takes_the_advertised_name():
+    writer = _Rows()
+    source = Source("COM3", writer)
+    tail = source.handle_block("[MATCH] Matches found: ['a']\r\nAdvertising as: NIMI_DEV_3A7F (")
+    assert tail == "Advertising as: NIMI_DEV_3A7F ("
+    tail = source.handle_block(tail + "public)\r\n[TRANSFER] x\r\n[SCAN] Scan")
+    assert tail == "[SCAN] Scan"
+    assert source.lines == 3
+    assert [(r[0], r[2]) for r in writer.rows] == [("COM3", KIND_MATCH), ("NIMI_DEV_3A7F", KIND_TRANSFER)]
+
+
+def test_writer_stores_every_row(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    writer = EncounterWriter(path, batch_rows=7, commit_interval_s=0.01)
+    writer.start()
+    for i in range(50):
+        writer.put(("D", float(i), KIND_SCAN, None, 1, "[]"))
+    writer.stop()
+    assert writer.rows == 50
+    conn = log_ingest.connect(path)
+    assert conn.execute("SELECT COUNT(*), MIN(ts), MAX(ts) FROM encounters").fetchone() == (50, 0.0, 49.0)
@@ -0,0 +1,39 @@
+import numpy as np
+
+import overlap
+
+
+def test_top_k_hand_checked():
+    selections = [
+        [1, 2, 3, 4],   # 0: shares 3 with 1, 2 with 2, none with 3
+        [2, 3, 4, 5],   # 1: 3 with 0, 1 with 2
+        [1, 2, 9],      # 2: 2 with 0, 1 with 1
+        [7, 8],         # 3: nothing in common
+    ]
+    bitsets, universe = overlap.encode(selections)
+    assert universe.tolist() == [1, 2, 3, 4, 5, 7, 8, 9]
+    top, pairs = overlap.top_k(bitsets, k=2)
+    assert top == [[(1, 3), (2, 2)], [(0, 3), (2, 1)], [(0, 2), (1, 1)], []]
+    assert pairs == 3
+    top, pairs = overlap.top_k(bitsets, k=3, min_shared=2)
+    assert top == [[(1, 3), (2, 2)], [(0, 3)], [(0, 2)], []]
+    assert pairs == 2
+
+
+def test_dense_and_sparse_paths_agree(monkeypatch):
+    rng = np.random.default_rng(1)
+    selections = [rng.choice(300, size=rng.integers(1, 60), replace=False).tolist() for _ in range(80)]
+    bitsets, _ = overlap.encode(selections)
+    expected = np.array([[len(set(a) & set(b)) for b in selections] for a in selections])
+    for density in (0.0, 1.0):
+        monkeypatch.setattr(overlap, "SPARSE_BYTE_DENSITY", density)
+        got = np.vstack([counts for _, counts in overlap.iter_counts(bitsets)])
+        assert (got == expected).all()
+
+
+def test_counts_do_not_wrap_past_65535():
+    shared = list(range(70000))
+    bitsets, _ = overlap.encode([shared, shared + [70000], [1]])
+    top, _ = overlap.top_k(bitsets, k=1)
+    assert top[0] == [(1, 70000)]
+    assert [n for _, n in top[2]] == [1]
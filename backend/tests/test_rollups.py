@@ -0,0 +1,34 @@
+import struct
+
+import rollups
+from encounter_log import RECORD_FORMAT, records_to_rows
+from log_ingest import INSERT_RECORD, connect
+
+
+def _record(seq, mac):
+    return struct.pack(RECORD_FORMAT, 1000, seq, mac, 0, -60, 1, 1, 7, 0, 0, 0)
+
+
+def test_pair_is_the_same_from_both_ends(tmp_path):
+    conn = connect(str(tmp_path / "db.sqlite"))
+    rollups.ensure_schema(conn)
+    # NIMI_DEV_3A7F heard 0B:1C's address and NIMI_DEV_0B1C heard 3A:7F's
+    rows = records_to_rows("NIMI_DEV_3A7F", _record(1, bytes.fromhex("a0b1c2d30b1c")))
+    rows += records_to_rows("NIMI_DEV_0B1C", _record(1, bytes.fromhex("a0b1c2d33a7f")))
+    conn.executemany(INSERT_RECORD, rows)
+    conn.commit()
+    rollups.update(conn)
+    assert conn.execute("SELECT device_a, device_b, hits FROM rollup_pairs WHERE res = 86400").fetchall() == [
+        ("NIMI_DEV_0B1C", "NIMI_DEV_3A7F", 2)]
+
+
+def test_category_counted_once_per_match(tmp_path):
+    conn = connect(str(tmp_path / "db.sqlite"))
+    rollups.ensure_schema(conn)
+    index = rollups.HashIndex()
+    index.load([(7, 1, "sail", 1, "G", 1, "C"), (8, 2, "reef", 1, "G", 1, "C")])
+    conn.execute("INSERT INTO encounters (device, ts, kind, payload) VALUES ('D', 1000, 'match', '[7, 8]')")
+    conn.commit()
+    rollups.update(conn, index=index)
+    assert conn.execute("SELECT hits FROM rollup_totals WHERE res = 60").fetchall() == [(1,)]
+    assert conn.execute("SELECT hits FROM rollup_categories WHERE res = 60").fetchall() == [(1,)]
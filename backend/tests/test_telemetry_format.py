@@ -0,0 +1,23 @@
+import os
+import sys
+
+# the firmware's telemetry module runs on CPython too (tools/collect_telemetry.py imports it)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "micropython"))
+import telemetry  # noqa: E402
+
+
+def test_backend_decodes_every_firmware_field(main_new):
+    t = telemetry.Telemetry()
+    for i, field in enumerate(telemetry.TELEMETRY_FIELDS[2:]):
+        setattr(t, field, 1000 + i)
+    raw = t.pack()
+    assert len(raw) == telemetry.TELEMETRY_SIZE == 48
+    expected = telemetry.decode(raw)
+    del expected["reserved"]
+    assert main_new.decode_telemetry(raw) == expected
+    assert set(expected) == set(main_new.TELEMETRY_FIELDS) - {"reserved"}
+
+
+def test_every_firmware_version_is_known(main_new):
+    assert main_new.TELEMETRY_VERSION == telemetry.TELEMETRY_VERSION
+    assert main_new.TELEMETRY_FORMATS == telemetry._FORMATS
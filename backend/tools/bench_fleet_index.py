@@ -0,0 +1,62 @@
+"""
+Benchmark of the fleet index (fleet_index.py) at fleet scale: load, the whole-fleet queries
+behind /fleet/summary and /fleet/matches, per-device queries and keyword set updates, on
+random keyword sets. Prints each timing against TARGET_S, the sub-second goal for queries
+(load runs once at startup and is reported, not judged).
+
+    python tools/bench_fleet_index.py
+    python tools/bench_fleet_index.py --devices 100000 --keywords 20 --universe 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from fleet_index import FleetIndex  # noqa: E402
+
+TARGET_S = 1.0
+
+
+def timed(label, func, *args, judged=True):
+    t0 = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - t0
+    verdict = ("ok" if elapsed < TARGET_S else "SLOW") if judged else ""
+    print("%-36s %8.3f s  %s" % (label, elapsed, verdict))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the fleet keyword index")
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--keywords", type=int, default=20, help="keywords per device")
+    parser.add_argument("--universe", type=int, default=2000, help="distinct keyword hashes")
+    parser.add_argument("--updates", type=int, default=1000, help="keyword set changes to time")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    universe = [rng.getrandbits(32) for _ in range(args.universe)]
+    names = ["NIMI_DEV_%05X" % i for i in range(args.devices)]
+    rows = [(name, h) for name in names for h in rng.sample(universe, args.keywords)]
+
+    index = FleetIndex()
+    timed("load (startup, with degrees)", index.load, rows, judged=False)
+    timed("degrees (/fleet/summary)", index.degrees)
+    timed("match counts, whole fleet", index.match_counts, names)
+    timed("match rows, 1000 devices", index.matches, names[:1000])
+    timed("suggest, one device", index.suggest, names[0])
+    timed("holding_all, 1000 pairs", index.holding_all, [rng.sample(universe, 2) for _ in range(1000)])
+    updates = [(rng.choice(names), rng.sample(universe, args.keywords)) for _ in range(args.updates)]
+    t0 = time.perf_counter()
+    for name, hashes in updates:
+        index.set_device(name, hashes)
+    per_update = (time.perf_counter() - t0) / max(1, len(updates))
+    print("%-36s %8.3f s  %s" % ("set_device, each", per_update, "ok" if per_update < TARGET_S else "SLOW"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+try:
+    from micropython import const
+except ImportError:  # also imported by the simulator on CPython
+    def const(x):
+        return x
+
+# NIMI block, the first AD structure of every NIMI advert and scan response. In the primary
+# advert it lets a peer be matched from a single packet without a scan request (passive scanning).
+#
+#   offset 0    1     2-3             4         5          6...
+#          [len][0xFF][company_id LE][MAGIC][header][payload ...]
+#   then   [len][0x09][name]           active mode primary advert, after the block
+#
+# Bytes 1-4 plus the header's version nibble are the signature: is_nimi() tests them at fixed
+# offsets, so the IRQ handler drops phones, headsets and beacons without decoding anything.
+#
+# header: format version (high nibble) | kind (low nibble)
+#   KIND_IDS    payload = n x uint32 LE keyword IDs (the whole set fits)
+#   KIND_BLOOM  payload = Bloom filter over all IDs, m = 8 * len(payload) bits, BLOOM_K probes
+#
+# The IDs are already 32-bit hashes, so the probes are derived from the ID itself:
+#   bit_i = (lo16 + i * (hi16 | 1)) % m
+# A Bloom hit only says the peer probably holds the ID; confirm it over GATT when that matters.
+
+COMPANY_ID = const(0xFFFF)          # Bluetooth SIG "no company" value, reserved for testing
+MAGIC = const(0x4E)                 # "N", tells us apart from other 0xFFFF test devices
+FORMAT_VERSION = const(2)           # 1 had no magic byte and could sit anywhere in the packet
+KIND_IDS = const(0)
+KIND_BLOOM = const(1)
+BLOOM_K = const(3)
+
+AD_MAX = const(31)                  # legacy advertising payload
+BLOCK_OVERHEAD = const(6)           # len, type, company id, magic, header
+IDS_MAX = const(6)                  # (AD_MAX - BLOCK_OVERHEAD) // 4, the most a KIND_IDS block holds
+
+_CID_LO = const(COMPANY_ID & 0xFF)
+_CID_HI = const(COMPANY_ID >> 8)
+
+
+def is_nimi(adv_data):
+    """Fixed-offset signature test. Safe to call from the IRQ handler: no allocation."""
+    return (len(adv_data) > 5 and adv_data[1] == 0xFF and adv_data[2] == _CID_LO
+            and adv_data[3] == _CID_HI and adv_data[4] == MAGIC and adv_data[5] >> 4 == FORMAT_VERSION)
+
+
+def bloom_fill(numbers, nbytes):
+    bits = bytearray(nbytes)
+    m = nbytes * 8
+    if not m:
+        return bits  # no room at all: an empty filter, which matches nothing
+    for n in numbers:
+        h1 = n & 0xFFFF
+        h2 = (n >> 16) | 1
+        for i in range(BLOOM_K):
+            b = (h1 + i * h2) % m
+            bits[b >> 3] |= 1 << (b & 7)
+    return bits
+
+
+def bloom_test(bits, n):
+    m = len(bits) * 8
+    if not m:
+        return False
+    h1 = n & 0xFFFF
+    h2 = (n >> 16) | 1
+    for i in range(BLOOM_K):
+        b = (h1 + i * h2) % m
+        if not bits[b >> 3] & (1 << (b & 7)):
+            return False
+    return True
+
+
+def encode_block(numbers, room=AD_MAX):
+    """Return the NIMI AD structure for `numbers`, at most `room` bytes long."""
+    space = room - BLOCK_OVERHEAD
+    if space < 0:
+        raise ValueError("no room for the NIMI block")
+    if 4 * len(numbers) <= space:
+        kind = KIND_IDS
+        payload = bytearray()
+        for n in numbers:
+            payload.extend(n.to_bytes(4, "little"))
+    else:
+        kind = KIND_BLOOM
+        payload = bloom_fill(numbers, space)
+    header = (FORMAT_VERSION << 4) | kind
+    return bytes((len(payload) + 5, 0xFF, _CID_LO, _CID_HI, MAGIC, header)) + payload
+
+
+def find_block(adv_data):
+    """Return (kind, start, end) of the NIMI block payload in adv_data, or None."""
+    if not is_nimi(adv_data):
+        return None
+    return adv_data[5] & 0x0F, BLOCK_OVERHEAD, min(1 + adv_data[0], len(adv_data))
+
+
+def decode_ids(adv_data, found):
+    """The ID list of a KIND_IDS block, or None for any other kind."""
+    kind, start, end = found
+    if kind != KIND_IDS:
+        return None
+    return [int.from_bytes(adv_data[j:j + 4], "little") for j in range(start, end - 3, 4)]
+
+
+def block_matches(adv_data, found, numbers):
+    """
+    Return (matches, exact): which of `numbers` the peer's block holds. For KIND_BLOOM the
+    matches are candidates and exact is False.
+    """
+    kind, start, end = found
+    if kind == KIND_IDS:
+        ids = decode_ids(adv_data, found)
+        return [n for n in numbers if n in ids], True
+    if kind == KIND_BLOOM:
+        bits = adv_data[start:end]
+        return [n for n in numbers if bloom_test(bits, n)], False
+    return [], True
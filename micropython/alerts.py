@@ -0,0 +1,123 @@
+import time, machine, neopixel
+
+# Non-blocking LED/buzzer effects. A pattern is a tuple of steps, each
+#   (duration_ms, (r, g, b), tone_hz)        tone_hz 0 = buzzer silent
+# and the engine only changes outputs at step boundaries, so nothing here sleeps.
+# Drive it either with a hardware timer (AlertEngine(timer_id=...)) or by calling
+# tick() from a task; both go through the same step logic.
+
+LED_PIN = 2
+BUZZER_PIN = None        # the PeerScanner prototype used 15; on the C3, GPIO12-17 belong to the flash
+ALERT_TIMER_ID = 0
+BUZZER_DUTY = 20000      # duty_u16 while a tone plays
+
+OFF = (0, 0, 0)
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+AMBER = (255, 120, 0)
+
+# built once at import; play() only stores a reference
+MATCH = ((200, RED, 2000), (200, OFF, 0)) * 3
+TRANSFER_OK = ((300, GREEN, 0), (100, OFF, 0))
+ERROR = ((100, AMBER, 1000), (100, OFF, 0)) * 2
+
+
+class AlertEngine:
+    """
+    Plays one pattern at a time on a single NeoPixel and an optional PWM buzzer.
+    play() returns at once. A new pattern replaces the one playing unless that one
+    has a higher priority.
+    """
+
+    def __init__(self, led_pin=LED_PIN, buzzer_pin=BUZZER_PIN, timer_id=None):
+        self._np = neopixel.NeoPixel(machine.Pin(led_pin), 1) if led_pin is not None else None
+        self._pwm = None
+        if buzzer_pin is not None:
+            self._pwm = machine.PWM(machine.Pin(buzzer_pin), freq=1000, duty_u16=0)
+        self._timer = machine.Timer(timer_id) if timer_id is not None else None
+        self._pattern = None
+        self._index = 0
+        self._repeat = 0
+        self._priority = 0
+        self._due = 0
+        self._color = OFF
+        self._tone = 0
+        self.played = 0
+
+    @property
+    def active(self):
+        return self._pattern is not None
+
+    def play(self, pattern, repeat=1, priority=0):
+        if self._pattern is not None and priority < self._priority:
+            return False
+        self._pattern = pattern
+        self._index = 0
+        self._repeat = repeat
+        self._priority = priority
+        self.played += 1
+        self._enter(time.ticks_ms())
+        return True
+
+    def stop(self):
+        self._pattern = None
+        if self._timer is not None:
+            self._timer.deinit()
+        self._output(OFF, 0)
+
+    def tick(self, now_ms):
+        """Advance past every step that has ended. Returns ms until the next step, or -1 when idle."""
+        while self._pattern is not None:
+            left = time.ticks_diff(self._due, now_ms)
+            if left > 0:
+                return left
+            self._index += 1
+            if self._index >= len(self._pattern):
+                self._repeat -= 1
+                if self._repeat <= 0:
+                    self.stop()
+                    return -1
+                self._index = 0
+            self._enter(self._due)
+        return -1
+
+    def _enter(self, start_ms):
+        duration, color, tone = self._pattern[self._index]
+        self._due = time.ticks_add(start_ms, duration)
+        self._output(color, tone)
+        if self._timer is not None:
+            self._timer.init(mode=machine.Timer.ONE_SHOT, period=max(1, duration), callback=self._on_timer)
+
+    def _on_timer(self, _):
+        # soft timer callback on the ESP32 port, so writing the NeoPixel here is allowed
+        left = self.tick(time.ticks_ms())
+        if left > 0:
+            # fired a little early: wait out the rest of the step
+            self._timer.init(mode=machine.Timer.ONE_SHOT, period=left, callback=self._on_timer)
+
+    def _output(self, color, tone):
+        # only touch the hardware when something changes
+        if color != self._color and self._np is not None:
+            self._np[0] = color
+            self._np.write()
+        self._color = color
+        if tone != self._tone and self._pwm is not None:
+            if tone:
+                self._pwm.freq(tone)
+                self._pwm.duty_u16(BUZZER_DUTY)
+            else:
+                self._pwm.duty_u16(0)
+        self._tone = tone
+
+
+_shared = None
+
+
+def shared_engine(led_pin=LED_PIN, buzzer_pin=BUZZER_PIN):
+    """The timer-driven engine on ALERT_TIMER_ID. Everything that alerts goes through this one:
+    a second engine would fight it for the LED, and its Timer.init() would take the timer over.
+    The pins only count on the first call, which builds it."""
+    global _shared
+    if _shared is None:
+        _shared = AlertEngine(led_pin, buzzer_pin, timer_id=ALERT_TIMER_ID)
+    return _shared
@@ -0,0 +1,253 @@
+import struct
+try:
+    from micropython import const
+except ImportError:  # imported by the host-side sender on CPython
+    def const(x):
+        return x
+try:
+    from binascii import crc32
+except ImportError:
+    from ubinascii import crc32
+try:
+    from time import ticks_diff
+except ImportError:
+    def ticks_diff(a, b):
+        return a - b
+
+# Chunked keyword transfer protocol, shared by the firmware and tools/send_keywords.py.
+#
+# Host -> device, written to KEYWORDS_UUID (little-endian):
+#   START  op(1)=0x01 version(1) flags(1) total_len(4) crc32(4) chunk_size(2)
+#   DATA   op(1)=0x02 seq(2) len(2) payload(len)        offset = seq * chunk_size
+#   END    op(1)=0x03                                   verify and commit
+#   ABORT  op(1)=0x04
+# Every frame carries its own length, so frames the stack appended together can be split again.
+#
+# Device -> host, on STATUS_UUID (read + notify):
+#   op(1)=0x10 state(1) next_missing_seq(2) received_bytes(4) mtu(2)
+#
+# If the link drops, the host sends the same START again: the device keeps the partial
+# buffer for RESUME_WINDOW_MS and the status tells the host which chunk to continue from.
+
+PROTOCOL_VERSION = const(1)
+
+OP_START = const(0x01)
+OP_DATA = const(0x02)
+OP_END = const(0x03)
+OP_ABORT = const(0x04)
+OP_STATUS = const(0x10)
+
+# START flags
+FLAG_COMPRESSED = const(0x01)     # payload is zlib-wrapped deflate, window 2**DEFLATE_WBITS
+
+# Small window so the device can inflate with a 512-byte history buffer
+DEFLATE_WBITS = const(9)
+
+STATE_IDLE = const(0)
+STATE_RECEIVING = const(1)
+STATE_COMPLETE = const(2)
+STATE_MISSING = const(3)
+STATE_SUSPENDED = const(4)
+STATE_ERR_CRC = const(5)
+STATE_ERR_SIZE = const(6)
+STATE_ERR_FORMAT = const(7)
+
+START_FORMAT = "<BBBIIH"
+START_SIZE = const(13)
+DATA_HEADER_FORMAT = "<BHH"
+DATA_HEADER_SIZE = const(5)
+STATUS_FORMAT = "<BBHIH"
+STATUS_SIZE = const(10)
+
+ATT_MTU_MIN = const(23)           # every link starts here; a write carries MTU - 3 bytes
+MIN_CHUNK = const(15)             # ATT_MTU_MIN - 3 - DATA_HEADER_SIZE: one DATA frame per write at any MTU
+TIMEOUT_MS = const(5000)          # no frame for this long -> suspend, waiting for a resume
+RESUME_WINDOW_MS = const(60000)   # after this, a suspended transfer is discarded
+
+
+def is_transfer_frame(raw):
+    return len(raw) > 0 and OP_START <= raw[0] <= OP_ABORT
+
+
+# Host-side frame builders
+def encode_start(total_len, crc, chunk_size, flags=0):
+    return struct.pack(START_FORMAT, OP_START, PROTOCOL_VERSION, flags, total_len, crc, chunk_size)
+
+
+def encode_data(seq, payload):
+    return struct.pack(DATA_HEADER_FORMAT, OP_DATA, seq, len(payload)) + bytes(payload)
+
+
+def encode_end():
+    return bytes((OP_END,))
+
+
+def encode_abort():
+    return bytes((OP_ABORT,))
+
+
+def chunk_size_for(mtu):
+    """The largest DATA payload that fits one write at this ATT MTU."""
+    return max(ATT_MTU_MIN, mtu) - 3 - DATA_HEADER_SIZE
+
+
+def decode_status(raw):
+    """Return (state, next_missing_seq, received_bytes, mtu)."""
+    op, state, next_missing, received, mtu = struct.unpack(STATUS_FORMAT, bytes(raw[:STATUS_SIZE]))
+    return state, next_missing, received, mtu
+
+
+class TransferReceiver:
+    """
+    Reassembles DATA frames into a preallocated buffer by sequence number, tracks which
+    chunks arrived in a bitmap, and verifies the CRC32 on END. No allocation per chunk.
+    """
+
+    def __init__(self, capacity=8192):
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._mv = memoryview(self._buf)
+        self._bitmap = bytearray(capacity // MIN_CHUNK // 8 + 1)
+        self._status = bytearray(STATUS_SIZE)
+        self.mtu = ATT_MTU_MIN
+        self.bad_frames = 0
+        self.reset()
+
+    def reset(self):
+        self.state = STATE_IDLE
+        self.flags = 0
+        self.total = 0
+        self.crc = 0
+        self.chunk_size = 0
+        self.chunks = 0
+        self.received = 0
+        self._last_ms = 0
+        for i in range(len(self._bitmap)):
+            self._bitmap[i] = 0
+
+    @property
+    def active(self):
+        return self.state == STATE_RECEIVING or self.state == STATE_MISSING or self.state == STATE_SUSPENDED
+
+    def _has(self, seq):
+        return self._bitmap[seq >> 3] & (1 << (seq & 7))
+
+    def next_missing(self):
+        for seq in range(self.chunks):
+            if not self._has(seq):
+                return seq
+        return self.chunks
+
+    def payload(self):
+        return self._mv[:self.total]
+
+    def status(self):
+        """Pack the current status into a reused buffer for gatts_write/notify."""
+        next_missing = self.next_missing() if self.active else 0
+        struct.pack_into(STATUS_FORMAT, self._status, 0, OP_STATUS, self.state,
+                         next_missing, self.received, self.mtu)
+        return self._status
+
+    def feed(self, raw, now_ms):
+        """
+        Parse one or more concatenated frames. Returns True when the state changed in a way
+        the host should hear about (start/resume, complete, missing chunks, errors).
+        """
+        mv = memoryview(raw)
+        n = len(mv)
+        i = 0
+        notify = False
+        while i < n:
+            op = mv[i]
+            if op == OP_DATA:
+                if i + DATA_HEADER_SIZE > n:
+                    self.bad_frames += 1
+                    break
+                _, seq, length = struct.unpack_from(DATA_HEADER_FORMAT, mv, i)
+                i += DATA_HEADER_SIZE
+                if i + length > n:
+                    # cut short by a full stack buffer; the missing chunk is re-sent later
+                    self.bad_frames += 1
+                    break
+                self._on_data(seq, mv[i:i + length], length)
+                i += length
+            elif op == OP_START:
+                if i + START_SIZE > n:
+                    self.bad_frames += 1
+                    break
+                self._on_start(struct.unpack_from(START_FORMAT, mv, i))
+                i += START_SIZE
+                notify = True
+            elif op == OP_END:
+                self._on_end()
+                i += 1
+                notify = True
+            elif op == OP_ABORT:
+                self.reset()
+                i += 1
+                notify = True
+            else:
+                self.state = STATE_ERR_FORMAT
+                return True
+        self._last_ms = now_ms
+        return notify
+
+    def _on_start(self, fields):
+        _, version, flags, total, crc, chunk_size = fields
+        if self.active and total == self.total and crc == self.crc and chunk_size == self.chunk_size:
+            # same transfer as before the link dropped - keep what we already have
+            self.state = STATE_RECEIVING
+            return
+        self.reset()
+        if version != PROTOCOL_VERSION or chunk_size < MIN_CHUNK:
+            self.state = STATE_ERR_FORMAT
+            return
+        if total > self.capacity:
+            self.state = STATE_ERR_SIZE
+            return
+        self.flags = flags
+        self.total = total
+        self.crc = crc
+        self.chunk_size = chunk_size
+        self.chunks = (total + chunk_size - 1) // chunk_size
+        self.state = STATE_RECEIVING
+
+    def _on_data(self, seq, data, length):
+        if not self.active or seq >= self.chunks:
+            self.bad_frames += 1
+            return
+        off = seq * self.chunk_size
+        if length > self.chunk_size or off + length > self.total:
+            self.bad_frames += 1
+            return
+        if self._has(seq):
+            return  # duplicate after a resume
+        self._mv[off:off + length] = data
+        self._bitmap[seq >> 3] |= 1 << (seq & 7)
+        self.received += length
+        if self.state != STATE_RECEIVING:
+            self.state = STATE_RECEIVING
+
+    def _on_end(self):
+        if not self.active:
+            return
+        if self.next_missing() < self.chunks:
+            self.state = STATE_MISSING
+        elif crc32(self._mv[:self.total]) & 0xFFFFFFFF != self.crc:
+            self.state = STATE_ERR_CRC
+        else:
+            self.state = STATE_COMPLETE
+
+    def check_timeout(self, now_ms):
+        """Suspend a stalled transfer, and drop it once the resume window has passed."""
+        if not self.active:
+            return False
+        idle = ticks_diff(now_ms, self._last_ms)
+        if idle > RESUME_WINDOW_MS:
+            print("[TRANSFER] Resume window expired, discarding partial transfer")
+            self.reset()
+            return True
+        if idle > TIMEOUT_MS and self.state != STATE_SUSPENDED:
+            self.state = STATE_SUSPENDED
+            return True
+        return False
@@ -1,17 +1,41 @@
-import bluetooth, ubinascii, struct, time, machine, neopixel, ujson
-import json
+import bluetooth, ubinascii, struct, time, ujson
+import json, io, os
+import micropython
 from micropython import const
+from ble_transfer import TransferReceiver, is_transfer_frame, STATE_COMPLETE, FLAG_COMPRESSED, DEFLATE_WBITS, ATT_MTU_MIN
+from scheduling import ScanScheduler, AdvScheduler
+from telemetry import Telemetry
+from match_log import MatchLog, LogStream, MATCH_LOG_FILE, LOG_CMD_DOWNLOAD, LOG_CMD_CLEAR
+from adv_format import encode_block, find_block, decode_ids, is_nimi, AD_MAX, BLOCK_OVERHEAD, IDS_MAX, KIND_IDS, KIND_BLOOM
+from fastpath import find_ad, match_ids, bloom_matches
+from array import array
+try:
+    import deflate  # MicroPython >= 1.21
+except ImportError:
+    deflate = None
 
 # filenames
 KEYWORDS_FILE = "keywords.json"
+KEYWORDS_FILE_Z = "keywords.z"      # deflate-compressed copy, preferred when present
+
+# Upper bound for an inflated keyword payload
+INFLATE_MAX = const(16384)
 
 
 # UUIDs and flags
 SERVICE_UUID = bluetooth.UUID("a07498ca-ad5b-474e-940d-16f1fbe7e8cd")
 KEYWORDS_UUID = bluetooth.UUID("b07498ca-ad5b-474e-940d-16f1fbe7e8cd")
+PEER_IDS_UUID = bluetooth.UUID("c07498ca-ad5b-474e-940d-16f1fbe7e8cd")   # read-only, full packed ID list
+STATUS_UUID = bluetooth.UUID("d07498ca-ad5b-474e-940d-16f1fbe7e8cd")     # transfer status, read + notify
+TELEMETRY_UUID = bluetooth.UUID("e07498ca-ad5b-474e-940d-16f1fbe7e8cd")  # read-only, see telemetry.py
+MATCH_LOG_UUID = bluetooth.UUID("f07498ca-ad5b-474e-940d-16f1fbe7e8cd")  # write a command, log streams back (match_log.py)
 
 _FLAG_WRITE = const(0x08)
+_FLAG_WRITE_NO_RESPONSE = const(0x04)
 _FLAG_READ  = const(0x02)
+_FLAG_NOTIFY = const(0x10)
+
+_PREFERRED_MTU = const(247)
 
 
 # BLE IRQ aliases for readability - check these are right???????????????????????????
@@ -20,9 +44,60 @@ IRQ_SCAN_DONE = const(6)
 IRQ_CENTRAL_CONNECT = const(1)    # bluetooth.IRQ_CENTRAL_CONNECT
 IRQ_CENTRAL_DISCONNECT = const(2) # bluetooth.IRQ_CENTRAL_DISCONNECT
 IRQ_GATTS_WRITE = const(3)       # bluetooth.IRQ_GATTS_WRITE ????????????????????????????????
+IRQ_PERIPHERAL_CONNECT = const(7)
+IRQ_PERIPHERAL_DISCONNECT = const(8)
+IRQ_GATTC_CHARACTERISTIC_RESULT = const(11)
+IRQ_GATTC_CHARACTERISTIC_DONE = const(12)
+IRQ_GATTC_READ_RESULT = const(15)
+IRQ_GATTC_READ_DONE = const(16)
+IRQ_MTU_EXCHANGED = const(21)
+
+# A scan response holds at most 6 packed IDs after the NIMI signature; peers with more publish
+# the full list on PEER_IDS_UUID
+SR_MAX_IDS = IDS_MAX
+_PEER_QUEUE_MAX = const(4)
+
+# Peers remembered in BLEPeripheral.seen, each with a digest of its last payload and match result
+_SEEN_MAX = const(128)
+_SEEN_TTL_S = const(300)        # entries not refreshed for this long are dropped first
+
+# Per-peer RSSI smoothing: EWMA with alpha = 1/2**_RSSI_SHIFT, kept in dBm * 16 (Q4) so it stays integer
+_RSSI_SHIFT = const(2)
+
+# Event ring buffer layout (one fixed-size slot per IRQ event)
+RING_SLOTS = const(64)          # must be a power of two
+RING_CONTROL_SLOTS = const(8)   # kept for connection/write/scan-done/MTU events: scan floods never take them
+_SLOT_SIZE = const(48)
+_S_EVENT = const(0)
+_S_ADDR_TYPE = const(1)
+_S_ADV_TYPE = const(2)
+_S_RSSI = const(3)
+_S_LEN = const(4)
+_S_ADDR = const(5)              # 6 bytes
+_S_HANDLE = const(11)           # conn_handle, 2 bytes little-endian
+_S_ATTR = const(13)             # attr_handle, 2 bytes little-endian
+_S_DATA = const(16)             # up to 32 bytes of adv data
+_SLOT_DATA_MAX = const(32)
+
+# GATT writes are buffered by the BLE stack (appended) until the main loop reads them.
+# Sized for several full-MTU WRITE_NO_RESPONSE frames arriving between two drains.
+_WRITE_BUFFER_SIZE = const(2048)
+
+# match log notifications sent per service() pass while a download is running
+_LOG_NOTIFY_BURST = const(4)
+_LEGACY_EOF = b"<EOF>"
 
 # Open the keywords.json file to start the process
 def load_keywords():
+    if deflate:
+        try:
+            # stream straight from flash through the decompressor into the JSON parser
+            with open(KEYWORDS_FILE_Z, "rb") as f:
+                return ujson.load(deflate.DeflateIO(f, deflate.ZLIB, DEFLATE_WBITS))
+        except OSError:
+            pass  # no compressed store, fall back to plain JSON
+        except Exception as e:
+            print("Failed to load keywords.z:", e)
     try:
         with open(KEYWORDS_FILE, "r") as f:
             keywords = ujson.load(f)
@@ -31,6 +106,26 @@ def load_keywords():
         keywords = {}
     return keywords
 
+def inflate_into(data, out):
+    """
+    Decompress a zlib/deflate payload into the preallocated bytearray `out`, a chunk at a time.
+    Returns the number of bytes written; raises ValueError if it would not fit.
+    """
+    if deflate is None:
+        raise ValueError("deflate module not available")
+    stream = deflate.DeflateIO(io.BytesIO(data), deflate.ZLIB, DEFLATE_WBITS)
+    mv = memoryview(out)
+    n = 0
+    while True:
+        if n == len(out):
+            if stream.read(1):
+                raise ValueError("inflated payload larger than %d bytes" % len(out))
+            return n
+        got = stream.readinto(mv[n:])
+        if not got:
+            return n
+        n += got
+
 # Create a device name with the last 4 letters from the MAC name
 def device_name(ble):
     mac = ubinascii.hexlify(ble.config('mac')[1]).decode().upper()
@@ -74,43 +169,28 @@ def advertising_payload(name=None, manufacturer_data=None, services=None):
     return bytes(adv_data), bytes(sr_data)
 
 
+def addr_text(addr):
+    """AA:BB:CC:DD:EE:FF for a 6-byte address."""
+    return ":".join(f"{b:02X}" for b in bytes(addr))
+
+
 def decode_name(adv_data):
     """Extract the first complete/short name field from adv_data (bytes) or None."""
-    i = 0
-    while i + 1 < len(adv_data):
-        length = adv_data[i]
-        if length == 0:
-            break
-        ad_type = adv_data[i + 1]
-        if ad_type in (0x09, 0x08):  # complete or short local name
-            start = i + 2
-            end = start + length - 1
-            try:
-                return adv_data[start:end].decode().strip() # stripping any trailing whitespace here fixes name invalid error - check it doesnt break if we have more than name in packet
-            except Exception:
-                return None
-        i += 1 + length
-    return None
+    i = find_ad(adv_data, len(adv_data), 0x09, 0x08)  # complete or short local name
+    if i < 0:
+        return None
+    start = i + 2
+    end = start + adv_data[i] - 1
+    try:
+        return adv_data[start:end].decode().strip() # stripping any trailing whitespace here fixes name invalid error - check it doesnt break if we have more than name in packet
+    except Exception:
+        return None
 
 def decode_manufacturer(adv_data):
-
+    """Return the IDs of a NIMI scan response (a KIND_IDS block, see adv_format) as a list of ints, or None."""
     adv_data = bytes(adv_data)
-
-    """Return manufacturer data as a list of 4-byte little-endian integers (first AD type 0xFF) or None."""
-    i = 0
-    while i + 1 < len(adv_data):
-        length = adv_data[i]
-        if length == 0:
-            break
-        ad_type = adv_data[i + 1]
-        if ad_type == 0xFF:
-            start = i + 2
-            end = start + length - 1
-            mdata = adv_data[start:end]
-            # Convert to array of 4-byte little-endian ints
-            return [int.from_bytes(mdata[j:j+4], 'little') for j in range(0, len(mdata), 4) if len(mdata[j:j+4]) == 4]
-        i += 1 + length
-    return None
+    found = find_block(adv_data)
+    return decode_ids(adv_data, found) if found else None
 
 def pack_numbers(numbers):
     """
@@ -120,101 +200,445 @@ def pack_numbers(numbers):
     """
     if not numbers:  # empty list
         return b''
-    return b''.join(struct.pack('<I', n) for n in numbers)
-
-def blink_neopixel(pin_num=2, color=(255, 0, 0), blink_time=0.1, duration=5):
-    pin = machine.Pin(pin_num)
-    np = neopixel.NeoPixel(pin, 1)
-    end_time = time.time() + duration
-    while time.time() < end_time:
-        np[0] = color      # On
-        np.write()
-        time.sleep(blink_time)
-        np[0] = (0, 0, 0)  # Off
-        np.write()
-        time.sleep(blink_time)
+    return struct.pack('<%dI' % len(numbers), *numbers)
 
-class BLEPeripheral:
+class EventRing:
+    """
+    Preallocated ring of fixed-size slots for BLE IRQ events.
+    The IRQ handler only copies the essential bytes in with put_*(); the main loop
+    drains the slots later with peek()/pop(). Nothing here allocates after __init__.
+    Scan results stop at `control` free slots, so a scan flood only ever drops scan results.
+    """
+
+    def __init__(self, slots=RING_SLOTS, control=RING_CONTROL_SLOTS):
+        self._mask = slots - 1
+        self._scan_limit = slots - control
+        self._buf = bytearray(slots * _SLOT_SIZE)
+        self._mv = memoryview(self._buf)
+        self._head = 0   # next slot to write (IRQ side)
+        self._tail = 0   # next slot to read (main loop side)
+        self.dropped = 0      # events lost because the ring was full
+        self.control_dropped = 0  # of which not scan results (the reserved slots ran out too)
+        self.truncated = 0    # adv payloads longer than a slot
+        self.high_water = 0   # most slots ever in use at once
+        self.on_put = None    # optional IRQ-safe callback run after each queued event
+
+    def __len__(self):
+        return (self._head - self._tail) & 0xFFFF
+
+    def _reserve(self, event, limit):
+        used = (self._head - self._tail) & 0xFFFF
+        if used >= limit:
+            self.dropped += 1
+            if event != IRQ_SCAN_RESULT:
+                self.control_dropped += 1
+            return -1
+        if used + 1 > self.high_water:
+            self.high_water = used + 1
+        off = (self._head & self._mask) * _SLOT_SIZE
+        self._buf[off + _S_EVENT] = event
+        return off
+
+    def _commit(self):
+        self._head = (self._head + 1) & 0xFFFF
+        if self.on_put is not None:
+            self.on_put()
+
+    def put_scan(self, event, addr_type, addr, adv_type, rssi, adv_data):
+        off = self._reserve(event, self._scan_limit)
+        if off < 0:
+            return False
+        buf = self._buf
+        buf[off + _S_ADDR_TYPE] = addr_type
+        buf[off + _S_ADV_TYPE] = adv_type
+        buf[off + _S_RSSI] = rssi & 0xFF
+        self._mv[off + _S_ADDR:off + _S_ADDR + 6] = addr
+        n = len(adv_data)
+        if n > _SLOT_DATA_MAX:
+            n = _SLOT_DATA_MAX
+            self.truncated += 1
+        buf[off + _S_LEN] = n
+        self._mv[off + _S_DATA:off + _S_DATA + n] = adv_data[:n] if n < len(adv_data) else adv_data
+        self._commit()
+        return True
+
+    def put_handles(self, event, conn_handle, attr_handle=0, addr=None):
+        off = self._reserve(event, self._mask + 1)
+        if off < 0:
+            return False
+        buf = self._buf
+        if addr is not None:
+            self._mv[off + _S_ADDR:off + _S_ADDR + 6] = addr
+        buf[off + _S_HANDLE] = conn_handle & 0xFF
+        buf[off + _S_HANDLE + 1] = conn_handle >> 8
+        buf[off + _S_ATTR] = attr_handle & 0xFF
+        buf[off + _S_ATTR + 1] = attr_handle >> 8
+        buf[off + _S_LEN] = 0
+        self._commit()
+        return True
+
+    def peek(self):
+        """Return the buffer offset of the oldest unread slot, or -1 when empty."""
+        if self._head == self._tail:
+            return -1
+        return (self._tail & self._mask) * _SLOT_SIZE
+
+    def pop(self):
+        self._tail = (self._tail + 1) & 0xFFFF
+
+    # slot accessors (off comes from peek())
+    def event(self, off):
+        return self._buf[off + _S_EVENT]
+
+    def addr_type(self, off):
+        return self._buf[off + _S_ADDR_TYPE]
+
+    def adv_type(self, off):
+        return self._buf[off + _S_ADV_TYPE]
+
+    def rssi(self, off):
+        r = self._buf[off + _S_RSSI]
+        return r - 256 if r > 127 else r
+
+    def addr(self, off):
+        return self._mv[off + _S_ADDR:off + _S_ADDR + 6]
+
+    def data(self, off):
+        return self._mv[off + _S_DATA:off + _S_DATA + self._buf[off + _S_LEN]]
+
+    def conn_handle(self, off):
+        return self._buf[off + _S_HANDLE] | (self._buf[off + _S_HANDLE + 1] << 8)
+
+    def attr_handle(self, off):
+        return self._buf[off + _S_ATTR] | (self._buf[off + _S_ATTR + 1] << 8)
 
-    seen = {}  # class-level dictionary
 
-    def __init__(self, ble, name="NIMI_DEV_0000", keywords=None):
+class BLEPeripheral:
+
+    def __init__(self, ble, name="NIMI_DEV_0000", keywords=None, schedule_drain=False, passive=False,
+                 match_log=MATCH_LOG_FILE):
         self._ble = ble
-        self._ble.irq(self._irq)
         self.name = name
-        self._receive_buffer = ""
+        # passive: match from the NIMI block in the primary advert, never send scan requests
+        self.passive = passive
+        self.seen = {}  # per-instance, so several peripherals can share one process (simulator)
+        self._receive_buffer = bytearray()   # legacy "<EOF>"-terminated JSON uploads
+        self._rx = TransferReceiver()
+        self._inflate_buf = None            # allocated on the first compressed transfer
+        self._last_scan_count = 0
+        self._last_match_ids = []
+        self._last_exact = True
         self.ignore_list = {}
         self.IGNORE_DURATION = 3  # seconds - !! make this longer in practice !!
-        self.MAX_DISTANCE = 60
-        self.MIN_DISTANCE = 0
-
+        # proximity gate on the smoothed RSSI: peers enter at PROXIMITY_RSSI dBm and leave once they
+        # drop PROXIMITY_HYSTERESIS dB below it. None disables the gate.
+        self.PROXIMITY_RSSI = -75
+        self.PROXIMITY_HYSTERESIS = 6
+
+        self._ids_handle = None
+        self._keywords_version = 0
+        self._adv_cache_version = -1
+        self._adv_cache = None
         self._update_keywords(keywords)
 
-        self._connections = set()
+        self._connections = {}      # conn_handle -> ATT MTU of that link
 
-        # register GATT service + characteristic (read/write)
-        keywords_char = (KEYWORDS_UUID, _FLAG_READ | _FLAG_WRITE)
-        service = (SERVICE_UUID, (keywords_char,))
+        # register GATT service + characteristics (keywords read/write, peer IDs read-only, transfer status,
+        # telemetry read-only, match log download)
+        keywords_char = (KEYWORDS_UUID, _FLAG_READ | _FLAG_WRITE | _FLAG_WRITE_NO_RESPONSE)
+        ids_char = (PEER_IDS_UUID, _FLAG_READ)
+        status_char = (STATUS_UUID, _FLAG_READ | _FLAG_NOTIFY)
+        telemetry_char = (TELEMETRY_UUID, _FLAG_READ)
+        log_char = (MATCH_LOG_UUID, _FLAG_WRITE | _FLAG_NOTIFY)
+        service = (SERVICE_UUID, (keywords_char, ids_char, status_char, telemetry_char, log_char))
         handles = self._ble.gatts_register_services((service,))
         # handles is a tuple of services; each service entry is a tuple of handles for its characteristics.
         # handles[0] -> tuple of char handles for service 0; the first char's handle is handles[0][0]
         self._keywords_handle = handles[0][0]
+        self._ids_handle = handles[0][1]
+        self._status_handle = handles[0][2]
+        self._telemetry_handle = handles[0][3]
+        self._log_handle = handles[0][4]
+        self.telemetry = Telemetry(time.ticks_ms())
+        # every reported match is also recorded on flash; None keeps them in print() only
+        self.match_log = MatchLog(match_log) if match_log else None
+        self._log_request = None    # conn handle that wrote a match log command
+        self._log_stream = None     # LogStream of the download in progress
+        # let the stack append successive writes so none are lost before the main loop reads them
+        self._ble.gatts_set_buffer(self._keywords_handle, _WRITE_BUFFER_SIZE, True)
+        self._publish_ids()
+        try:
+            # larger ATT MTU -> fewer, bigger transfer chunks once a central negotiates it
+            self._ble.config(mtu=_PREFERRED_MTU)
+        except Exception:
+            pass
+
+        # deferred work, picked up by service() or by the asyncio runtime tasks
+        self.adv_pending = False
+        self.write_pending = False
+        self.scanning = False
+        self.foreign = 0   # non-NIMI adverts dropped in the IRQ handler
+        self.memo_hits = 0  # peer packets answered from the per-peer match memo
+        self.gated = 0      # peer packets skipped because the peer is outside the proximity gate
+        self._scan_done_expected = 0
+        self.scan_scheduler = ScanScheduler()
+        self.adv_scheduler = AdvScheduler()
+        self.on_match = None       # optional callback(values), called outside the IRQ
+        self.central = None        # optional object with on_irq(event, data) for central-role events
+        self.peer_reads = False    # queue peers whose scan response may be truncated
+        self.peer_requests = []    # (addr_type, addr bytes) waiting for a full ID read
+
+        # IRQ events are queued here and handled later by process_events()
+        self.events = EventRing()
+        self._schedule_drain = schedule_drain
+        self._drain_pending = False
+        self._drain_ref = self._scheduled_drain  # bound once, so the IRQ does not allocate
+        self._ble.irq(self._irq)
 
         # ready to advertise & scan (user must call advertise() and start_scan())
-        self._adv_interval_ms = 500_000
 
     # set the internal keywords (full JSON dictionary) and numbers (list of the indexes only)
     def _update_keywords(self, keywords):
         # Store the keywords as a JSON array and the numbers (for matches) as a python list
         self.keywords = keywords or {} # e.g. {"1432244": "Keyword1", "6543244": "Keyword2"}
         self.numbers = [int(k) for k in self.keywords.keys()] if self.keywords else []
+        self._id_array = array("I", self.numbers)  # same IDs, laid out for fastpath.match_ids
+        # bump the version so the cached advertising payload gets rebuilt
+        self._keywords_version += 1
+        self._publish_ids()
 
+    # expose the full packed ID list to peers that connect to read it
+    def _publish_ids(self):
+        if self._ids_handle is not None:
+            self._ble.gatts_write(self._ids_handle, pack_numbers(self.numbers))
 
+    # IRQ entry point: times the handler for telemetry
     def _irq(self, event, data):
+        t0 = time.ticks_us()
+        self._handle_irq(event, data)
+        self.telemetry.irq_done(time.ticks_diff(time.ticks_us(), t0))
 
-        #print('[DEBUG] IRQ handler called with event #:', event)
+    # IRQ handler: copy the essential bytes into the ring and return as fast as possible
+    def _handle_irq(self, event, data):
 
         if event == IRQ_SCAN_RESULT:
             addr_type, addr, adv_type, rssi, adv_data = data
-            self._handle_scan_result(addr_type, addr, adv_type, rssi, adv_data)
+            self.telemetry.scan()
+            if not is_nimi(adv_data):
+                # phones, headsets, beacons: dropped on a few byte compares, before any copy
+                self.foreign += 1
+                return
+            self.events.put_scan(event, addr_type, addr, adv_type, rssi, adv_data)
 
-        elif event == IRQ_CENTRAL_CONNECT:
+        elif event == IRQ_CENTRAL_CONNECT or event == IRQ_CENTRAL_DISCONNECT:
             conn_handle, addr_type, addr = data
-            self._connections.add(conn_handle)
-            print("[TRANSFER] Central connected:", bytes(addr))
+            self.events.put_handles(event, conn_handle, 0, addr)
+
+        elif event == IRQ_GATTS_WRITE:
+            conn_handle, attr_handle = data
+            self.events.put_handles(event, conn_handle, attr_handle)
+
+        elif event == IRQ_SCAN_DONE:
+            self.events.put_handles(event, 0)
+
+        elif event == IRQ_MTU_EXCHANGED:
+            conn_handle, mtu = data
+            self.events.put_handles(event, conn_handle, mtu)
+
+        elif self.central is not None:
+            # central-role events are rare; hand them straight to the connection helper
+            self.central.on_irq(event, data)
+            return
+
+        else:
+            return
+
+        if self._schedule_drain and not self._drain_pending:
+            self._drain_pending = True
+            try:
+                micropython.schedule(self._drain_ref, 0)
+            except RuntimeError:
+                # schedule queue full - the main loop will drain instead
+                self._drain_pending = False
+
+    def _scheduled_drain(self, _):
+        self._drain_pending = False
+        self.process_events()
+
+    # Drain queued IRQ events in a batch. Call this from the main loop (or let
+    # schedule_drain=True do it via micropython.schedule). Returns the number handled.
+    def process_events(self, limit=16):
+        ring = self.events
+        handled = 0
+        while handled < limit:
+            off = ring.peek()
+            if off < 0:
+                break
+            try:
+                self._dispatch(ring, off)
+            except Exception as e:
+                print("[EVENT] handler error:", e)
+            ring.pop()
+            handled += 1
+        return handled
+
+    def _dispatch(self, ring, off):
+        event = ring.event(off)
+
+        if event == IRQ_SCAN_RESULT:
+            self._handle_scan_result(ring.addr_type(off), ring.addr(off), ring.adv_type(off),
+                                     ring.rssi(off), ring.data(off))
+
+        elif event == IRQ_CENTRAL_CONNECT:
+            self._connections[ring.conn_handle(off)] = ATT_MTU_MIN
+            print("[TRANSFER] Central connected:", bytes(ring.addr(off)))
 
         elif event == IRQ_CENTRAL_DISCONNECT:
-            conn_handle, addr_type, addr = data
-            self._connections.discard(conn_handle)
+            conn_handle = ring.conn_handle(off)
+            self._connections.pop(conn_handle, None)
+            self._rx.mtu = ATT_MTU_MIN
+            if self._log_stream and self._log_stream.conn_handle == conn_handle:
+                self._log_stream.close()
+                self._log_stream = None
             print("[TRANSFER] Central disconnected")
             # restart advertising after disconnect
-            self.advertise()
+            self.adv_pending = True
 
         elif event == IRQ_GATTS_WRITE:
             print("[TRANSFER] GATTS WRITE")
-            conn_handle, attr_handle = data
-            if attr_handle == self._keywords_handle:
-                raw = self._ble.gatts_read(attr_handle)
-                self._on_keywords_write(raw)
+            if ring.attr_handle(off) == self._keywords_handle:
+                self.write_pending = True
+                # the status reports the MTU of the link the transfer comes in on
+                self._rx.mtu = self._connections.get(ring.conn_handle(off), ATT_MTU_MIN)
+            elif ring.attr_handle(off) == self._log_handle:
+                self._log_request = ring.conn_handle(off)
+
+        elif event == IRQ_SCAN_DONE:
+            if self._scan_done_expected:
+                # our own stop (e.g. a duty-cycle change), not the scan ending by itself
+                self._scan_done_expected -= 1
+            else:
+                self.scanning = False
+
+        elif event == IRQ_MTU_EXCHANGED:
+            conn_handle, mtu = ring.conn_handle(off), ring.attr_handle(off)
+            if conn_handle in self._connections:  # not one of our own peer reads
+                self._connections[conn_handle] = mtu
+                self._rx.mtu = mtu
+            print("[TRANSFER] MTU exchanged:", mtu)
+
+    # Slow follow-up work (flash writes, re-advertising). The plain main loop calls
+    # service() after draining; the asyncio runtime calls the two halves from its own tasks.
+    def service(self):
+        self.service_writes()
+        self.service_advertising()
+        self.service_scan()
+        self.service_telemetry()
+        self.service_log()
+
+    # flush the match log when its RAM block is due, and run a GATT download a few frames at a time
+    def service_log(self):
+        log = self.match_log
+        if log is None:
+            return
+        log.service(time.ticks_ms())
+        if self._log_request is not None:
+            conn_handle, self._log_request = self._log_request, None
+            cmd = self._ble.gatts_read(self._log_handle)
+            if cmd and self._log_stream is not None:
+                # a new command ends the download in progress, so it never reads a cleared log
+                self._log_stream.close()
+                self._log_stream = None
+            if cmd and cmd[0] == LOG_CMD_DOWNLOAD:
+                self._log_stream = LogStream(log, conn_handle, self._connections.get(conn_handle, ATT_MTU_MIN))
+                print("[LOG] Download started")
+            elif cmd and cmd[0] == LOG_CMD_CLEAR:
+                log.clear()
+                print("[LOG] Cleared")
+        stream = self._log_stream
+        if stream is None:
+            return
+        for _ in range(_LOG_NOTIFY_BURST):
+            try:
+                self._ble.gatts_notify(stream.conn_handle, self._log_handle, stream.frame())
+            except OSError:
+                return  # the stack is out of buffers; the same frame goes again next pass
+            stream.sent()
+            if stream.done:
+                self._log_stream = None
+                print("[LOG] Download done,", stream.total, "bytes")
+                return
+
+    @property
+    def log_streaming(self):
+        return self._log_stream is not None or self._log_request is not None
+
+    # refresh the telemetry characteristic once per sampling period
+    def service_telemetry(self, force=False):
+        tel = self.telemetry
+        if tel.sample(time.ticks_ms(), self.events.dropped, force):
+            self._ble.gatts_write(self._telemetry_handle, tel.pack())
+            return True
+        return False
+
+    # apply the adaptive scan duty cycle when the scheduler picks a new level
+    def service_scan(self):
+        if self.scanning and self.scan_scheduler.update(time.ticks_ms()):
+            self.stop_scan()
+            self.start_scan()
+
+    def service_writes(self):
+        if self._rx.check_timeout(time.ticks_ms()):
+            self._send_status()
+        if not self.write_pending:
+            return
+        self.write_pending = False
+        # returns everything appended since the last read, then clears it
+        raw = self._ble.gatts_read(self._keywords_handle)
+        if raw:
+            self._on_keywords_write(raw)
+
+    def service_advertising(self):
+        # restart after a disconnect, or when the scheduler picks a new interval
+        if self.adv_scheduler.update(time.ticks_ms()):
+            self.adv_pending = True
+        if self.adv_pending:
+            self.adv_pending = False
+            self.advertise()
 
     def _handle_scan_result(self, addr_type, addr, adv_type, rssi, adv_data):
-        
+        if self.passive:
+            self._handle_passive_result(addr_type, addr, rssi, bytes(adv_data))
+            return
+
+        # only packets carrying the NIMI signature get this far (see _irq)
         adv_data_ba = bytes(adv_data)
-        name = decode_name(adv_data_ba)
-        addr_str = ":".join(f"{b:02X}" for b in bytes(addr))
-        entry = self.seen.get(addr_str)
+        key = bytes(addr)  # seen is keyed by the raw address; the text form is only for names
+        entry = self.seen.get(key)
         now = time.time()
         
         # advertising packet
-        if adv_type == 0x00 and name and name.startswith("NIMI_DEV"):
+        if adv_type == 0x00:
             # This is a regular NIMI_DEV advertising packet
+            self.scan_scheduler.note_nimi()
+            self.telemetry.nimi += 1
+            adv = self.adv_scheduler
             if entry is None:
                 # first time seeing it, add it to the NIMI devices list, set ignore to false for new entries
-                entry = {"name": name, "resp": None, "timestamp": now, "ignore": False}
-                self.seen[addr_str] = entry
-                #print(f"[SCAN] New NIMI_DEV device added: {addr_str}")
+                name = decode_name(adv_data_ba) or addr_text(key)
+                entry = self._new_entry(key, name, now)
+                self._track_rssi(entry, rssi)
+                self.scan_scheduler.note_new_peer()
+                adv.note_new_peer()
+                adv.note_peer()
+                #print(f"[SCAN] New NIMI_DEV device added: {addr_text(key)}")
                 return
             else:
+                if entry["epoch"] != adv.epoch:
+                    # count each peer once per scheduler period
+                    entry["epoch"] = adv.epoch
+                    adv.note_peer()
+                self._track_rssi(entry, rssi)
                 # Previously seen, set ignore flag based on age of the entry (set to true when recent, false otherwise). 
                 interval = now - entry['timestamp']
                 entry['ignore'] = True if interval <= self.IGNORE_DURATION else False
@@ -222,16 +646,27 @@ class BLEPeripheral:
 
         # scan response packet (immediately follows advertising packet)
         if adv_type == 0x04 and entry:
-            # Skip any entries with ignore = True
-            if entry['ignore'] == False: 
+            # Skip any entries with ignore = True, and peers outside the proximity gate
+            if not entry["near"]:
+                self.gated += 1
+            elif entry['ignore'] == False: 
                 #entry["resp"] = adv_data_ba
-                #print(f"[SCAN] Scan response received for {entry["name"]} at {addr_str}, resp_data: {adv_data_ba}")
+                #print(f"[SCAN] Scan response received for {entry["name"]} at {addr_text(key)}, resp_data: {adv_data_ba}")
                 #print(f"[SCAN] ACTIONABLE, Ignore is:", entry['ignore'] )
                 
-                # Further actions here
-                matches = self._check_for_matches(adv_data)
-                if matches:      
-                    print("[MATCH] Matches found:", matches) 
+                # Further actions here, only when the payload (or our keywords) changed since last time;
+                # otherwise the result is the memoized one and its alert has already been raised
+                if self._payload_changed(entry, adv_data_ba):
+                    matches = self._check_for_matches(adv_data)
+                    entry["matches"] = matches
+                    if matches and (self._last_exact or not self.peer_reads):
+                        self._report_match(matches, addr_type, addr, entry, self._last_match_ids, self._last_exact)
+                    elif matches:
+                        # Bloom hit (a passive peer's scan response): confirm against its full ID list
+                        self._queue_peer_read(addr_type, addr)
+                    if self.peer_reads and self._last_scan_count >= SR_MAX_IDS:
+                        # the scan response was full, so the peer may hold more IDs than it advertises
+                        self._queue_peer_read(addr_type, addr)
 
 
                 # RESETS: 
@@ -239,85 +674,317 @@ class BLEPeripheral:
                 entry['ignore'] = True
                 entry['resp'] = None
                 entry['timestamp'] = now
-                self.seen[addr_str] = entry
+                self.seen[key] = entry
             #else:
                 # it was recently processed and should be ignored 
                 # print(f"[SCAN] IGNORE, Recently processed..Ignore is:", entry['ignore'] )
 
 
+    # Passive mode: one advertising packet carries the peer's IDs (or a Bloom filter of them),
+    # so there is no scan response to pair with. Same ignore window as the active path.
+    def _handle_passive_result(self, addr_type, addr, rssi, adv_data):
+        found = find_block(adv_data)
+        if found is None:
+            return
+        key = bytes(addr)
+        entry = self.seen.get(key)
+        now = time.time()
+        self.scan_scheduler.note_nimi()
+        self.telemetry.nimi += 1
+        adv = self.adv_scheduler
+        if entry is None:
+            entry = self._new_entry(key, decode_name(adv_data) or addr_text(key), now)
+            self._track_rssi(entry, rssi)
+            self.scan_scheduler.note_new_peer()
+            adv.note_new_peer()
+            adv.note_peer()
+        else:
+            if entry["epoch"] != adv.epoch:
+                entry["epoch"] = adv.epoch
+                adv.note_peer()
+            self._track_rssi(entry, rssi)
+            if now - entry["timestamp"] <= self.IGNORE_DURATION:
+                return
+        if not entry["near"]:
+            self.gated += 1
+            return
+        entry["timestamp"] = now
+        if not self._payload_changed(entry, adv_data):
+            return
+
+        numbers, exact = self._block_matches(adv_data, found)
+        matches = self._match_numbers(numbers)
+        entry["matches"] = matches
+        if not matches:
+            return
+        if exact or not self.peer_reads:
+            self._report_match(matches, addr_type, addr, entry, numbers, exact)
+        else:
+            # Bloom hit: confirm against the peer's full ID list before alerting
+            self._queue_peer_read(addr_type, addr)
+
+    def _new_entry(self, key, name, now):
+        if len(self.seen) >= _SEEN_MAX:
+            self._prune_seen(now)
+        entry = {"name": name, "resp": None, "timestamp": now, "ignore": False, "epoch": self.adv_scheduler.epoch,
+                 "digest": None, "kwv": -1, "matches": None, "rssi": None, "near": False}
+        self.seen[key] = entry
+        return entry
+
+    def _track_rssi(self, entry, rssi):
+        q = rssi << 4
+        s = entry["rssi"]
+        s = q if s is None else s + ((q - s) >> _RSSI_SHIFT)
+        entry["rssi"] = s
+        gate = self.PROXIMITY_RSSI
+        if gate is None:
+            entry["near"] = True
+        elif entry["near"]:
+            if s < (gate - self.PROXIMITY_HYSTERESIS) << 4:
+                entry["near"] = False
+        elif s >= gate << 4:
+            entry["near"] = True
+
+    # Keep the per-peer cache bounded: drop stale entries, else the least recently refreshed one,
+    # preferring peers without a match (forgetting a match would raise its alert again)
+    def _prune_seen(self, now):
+        seen = self.seen
+        for key in [k for k, e in seen.items() if now - e["timestamp"] > _SEEN_TTL_S]:
+            del seen[key]
+        if len(seen) >= _SEEN_MAX:
+            victim = None
+            best = None
+            for k, e in seen.items():
+                rank = (1 if e["matches"] else 0, e["timestamp"])
+                if best is None or rank < best:
+                    victim, best = k, rank
+            del seen[victim]
+
+    # Memo check: a crc32 of the peer's payload, tied to our keyword version. Returns False when
+    # both are unchanged, i.e. the stored match result still holds.
+    def _payload_changed(self, entry, payload):
+        digest = ubinascii.crc32(payload)
+        if digest == entry["digest"] and entry["kwv"] == self._keywords_version:
+            self.memo_hits += 1
+            return False
+        entry["digest"] = digest
+        entry["kwv"] = self._keywords_version
+        return True
+
     # input is a list of scanned keyword indexes. Compare the to internal list and return overlaps as a list
     def _check_for_matches(self, adv_data):
+        adv_data = bytes(adv_data)
+        found = find_block(adv_data)
+        self._last_scan_count = 0
+        self._last_exact = True
+        if found is None:
+            self._last_match_ids = []
+            return []
+        if found[0] == KIND_IDS:
+            self._last_scan_count = (found[2] - found[1]) // 4
+        numbers, self._last_exact = self._block_matches(adv_data, found)
+        self._last_match_ids = numbers
+        print(f"[SCAN] Scanned {self._last_scan_count} numbers, ours:", numbers)
+        return self._match_numbers(numbers)
+
+    # Same answer as adv_format.block_matches, from the fastpath loops (native code where the port has it)
+    def _block_matches(self, adv_data, found):
+        kind, start, end = found
+        if kind == KIND_IDS:
+            mask = match_ids(adv_data, end, self._id_array, len(self._id_array))
+            numbers = []
+            j = start
+            while mask:
+                if mask & 1:
+                    numbers.append(int.from_bytes(adv_data[j:j + 4], "little"))
+                mask >>= 1
+                j += 4
+            return numbers, True
+        if kind == KIND_BLOOM:
+            return bloom_matches(adv_data[start:end], self.numbers), False
+        return [], True
+
+    def _match_numbers(self, scanned_numbers):
         values = []
-        scanned_numbers = decode_manufacturer(adv_data)
-        print(f"[SCAN] Scanned numbers are:", scanned_numbers )
         if scanned_numbers:
             ints = list(scanned_numbers)
             matches = [n for n in ints if n in self.numbers]
             if matches:
                 values = [self.keywords[str(k)] for k in matches if str(k) in self.keywords]
         return values
+
+    def _queue_peer_read(self, addr_type, addr):
+        addr = bytes(addr)
+        for _, queued in self.peer_requests:
+            if queued == addr:
+                return
+        if len(self.peer_requests) < _PEER_QUEUE_MAX:
+            self.peer_requests.append((addr_type, addr))
+
+    # Called with the raw PEER_IDS value read from a peer over a central connection
+    def handle_peer_ids(self, addr, raw, addr_type=0):
+        entry = self.seen.get(bytes(addr))
+        if not raw:
+            # the read failed: forget the digest so the next packet from this peer is evaluated again
+            if entry:
+                entry["digest"] = None
+            return []
+        raw = bytes(raw)
+        numbers = [int.from_bytes(raw[j:j+4], 'little') for j in range(0, len(raw) - 3, 4)]
+        matches = self._match_numbers(numbers)
+        if matches:
+            self._report_match(matches, addr_type, addr, entry, [n for n in numbers if n in self.numbers])
+        return matches
+
+    def _report_match(self, matches, addr_type, addr, entry, ids, exact=True):
+        print("[MATCH] Matches found:", matches, "from", addr_text(addr))
+        self.telemetry.matches += 1
+        if self.match_log is not None:
+            rssi = entry["rssi"] >> 4 if entry and entry["rssi"] is not None else 0
+            self.match_log.append(time.ticks_ms(), int(time.time()), addr, addr_type, rssi, ids, exact)
+        if self.on_match:
+            self.on_match(matches)
        
 
     def _on_keywords_write(self, raw):
-        # raw is bytes written by the client. Expect JSON string representing a list of ints.
+        # raw is every byte written since the last read: protocol frames, or legacy JSON text ending in <EOF>
+        if self._rx.active or (not self._receive_buffer and is_transfer_frame(raw)):
+            if self._rx.feed(raw, time.ticks_ms()):
+                if self._rx.state == STATE_COMPLETE:
+                    self._apply_keywords(self._rx.payload(), self._rx.flags & FLAG_COMPRESSED)
+                self._send_status()
+                print("[TRANSFER] State:", self._rx.state, "received:", self._rx.received, "of", self._rx.total)
+                if self._rx.state == STATE_COMPLETE:
+                    self._rx.reset()
+            return
+
+        # legacy path: only search the newly appended tail for the marker
+        start = len(self._receive_buffer) - len(_LEGACY_EOF)
+        self._receive_buffer.extend(raw)
+        print("[TRANSFER] Received keywords JSON:", raw)
+        if len(self._receive_buffer) > self._rx.capacity:
+            print("[TRANSFER] Legacy upload too large, discarded")
+            self._receive_buffer = bytearray()
+            return
+        start = start if start > 0 else 0
+        end = self._receive_buffer.find(_LEGACY_EOF, start)
+        if end < 0:
+            end = self._receive_buffer.find(b"<eof>", start)
+        if end >= 0:
+            data = self._receive_buffer[:end]
+            self._receive_buffer = bytearray()  # reset for next transfer
+            self._apply_keywords(data)
+
+    # Validate, store and start advertising a complete keywords payload (JSON, or deflated JSON)
+    def _apply_keywords(self, data, compressed=False):
         try:
-            s = raw.decode() if isinstance(raw, (bytes, bytearray)) else raw
-            self._receive_buffer += s
-            print("[TRANSFER] Received keywords JSON:", s)
-            if "<EOF>" in self._receive_buffer or "<eof>" in self._receive_buffer:
-                # Remove <EOF> marker (case-insensitive)
-                s_clean = self._receive_buffer.replace("<EOF>", "").replace("<eof>", "").strip()
-                # write the manufacturer data to JSON file locally
-                with open("keywords.json", "w") as f:
-                    json.dump(json.loads(s_clean), f)
-                print("[TRANSFER] Saved keywords to keywords.json:", s_clean)
-
-                # renew the advertising package
-                self.keywords = json.loads(s_clean)
-                self.update_advertising_data()
-                self._receive_buffer = ""  # reset for next transfer
-
+            if compressed:
+                if self._inflate_buf is None:
+                    self._inflate_buf = bytearray(INFLATE_MAX)
+                n = inflate_into(data, self._inflate_buf)
+                keywords = json.loads(bytes(self._inflate_buf[:n]))
+                # keep the compressed form on flash; load_keywords() prefers it
+                with open(KEYWORDS_FILE_Z, "wb") as f:
+                    f.write(data)
+                self._remove_file(KEYWORDS_FILE)
+                print("[TRANSFER] Saved keywords to keywords.z:", len(data), "bytes, inflated", n)
+            else:
+                data = bytes(data).strip()
+                keywords = json.loads(data)
+                # write the validated JSON to flash as received
+                with open(KEYWORDS_FILE, "wb") as f:
+                    f.write(data)
+                self._remove_file(KEYWORDS_FILE_Z)
+                print("[TRANSFER] Saved keywords to keywords.json:", len(data), "bytes")
+
+            # renew the advertising package
+            self.update_advertising_data(keywords)
         except Exception as e:
             print("Failed to parse keywords JSON:", e)
 
-    def _make_adv_payload(self):
-        # manufacturer_data must be bytes and must keep whole adv packet < 31 bytes.
-        # We'll pack the keywords as 4 bytes. Trim if too long.
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
-        m = pack_numbers(self.numbers)
-        
-        # ensure manufacturer_data not too long (conservative)
-        if m and len(m) > 100:
-            m = m[:100]
-        
-        # returns two variables: advertising data and scan response data
-        return advertising_payload(name=self.name, manufacturer_data=m)
+    def _send_status(self):
+        status = self._rx.status()
+        self._ble.gatts_write(self._status_handle, status)
+        for conn_handle in self._connections:
+            try:
+                self._ble.gatts_notify(conn_handle, self._status_handle)
+            except Exception:
+                pass
+
+    def _make_adv_payload(self):
+        # Built once per keyword set: returns the cached (adv_data, sr_data) until the keywords change
+        if self._adv_cache_version == self._keywords_version:
+            return self._adv_cache
+
+        # Both packets start with the NIMI block (adv_format) so peers can fast-reject everything else.
+        # The scan response is limited to 31 bytes: up to SR_MAX_IDS IDs, peers read the rest from PEER_IDS_UUID
+        sr_data = encode_block(self.numbers[:SR_MAX_IDS])
+
+        # two variables: advertising data and scan response data
+        adv_data = advertising_payload(name=self.name)[0]
+        if self.passive:
+            # the whole packet is the NIMI block; the name moves to the scan response, behind a block
+            # in whatever room it leaves (IDs or a Bloom filter) so active scanners can match us too
+            name_data, adv_data = adv_data, encode_block(self.numbers, AD_MAX)
+            room = AD_MAX - len(name_data)
+            sr_data = encode_block(self.numbers, room) + name_data if room >= BLOCK_OVERHEAD else sr_data
+        else:
+            # the block goes first, in whatever room the name leaves, so passive scanners can match us too
+            room = AD_MAX - len(adv_data)
+            if room < BLOCK_OVERHEAD:
+                adv_data, room = b"", AD_MAX  # name too long to share the packet
+            adv_data = encode_block(self.numbers, room) + adv_data
+        self._adv_cache = (adv_data, sr_data)
+        self._adv_cache_version = self._keywords_version
+        print("Advertising as:", self.name, "payload len:", len(self._adv_cache[0]))
+        print("[ DEBUG ] Payload is ", self._adv_cache[0])
+        print("[ DEBUG ] Service response data is ", self._adv_cache[1])
+        return self._adv_cache
 
     def advertise(self):
         adv_data, sr_data =  self._make_adv_payload()
-        # DEBUG - save the advertising package
-        #self.adv_payload = adv_data
-        #self.sr_data = sr_data
-        # duration_ms=0 (or None) usually means continuous advertising until stopped
-        self._ble.gap_advertise(self._adv_interval_ms, adv_data=adv_data, resp_data=sr_data)
-        print("Advertising as:", self.name, "payload len:", len(adv_data))
-        print("[ DEBUG ] Payload is ", adv_data)
-        print("[ DEBUG ] Service response data is ", sr_data)
-
-    # Called after new keywords are downloaded
-    def update_advertising_data(self):
+        # advertises continuously until stopped; the interval comes from the adaptive scheduler
+        self._ble.gap_advertise(self.adv_scheduler.interval_us, adv_data=adv_data, resp_data=sr_data)
+        if not self.telemetry.boot_adv_ms:
+            self.telemetry.boot_adv_ms = time.ticks_ms()
+            print("[BOOT] First advert %d ms after reset" % self.telemetry.boot_adv_ms)
+
+    # Called after new keywords are downloaded. Pass the new keywords when they are already
+    # in memory; otherwise the current set is re-advertised without touching flash.
+    def update_advertising_data(self, keywords=None):
         # stop then restart to update adv payload
         try:
             self._ble.gap_advertise(None)  # stop advertising
-            # updated keywords before readvertising   
-            self._update_keywords(load_keywords()) # load from keyword.json
         except Exception:
             pass
+        if keywords is not None:
+            self._update_keywords(keywords)
+            # new keywords: advertise fast for a while so peers pick them up
+            self.adv_scheduler.burst()
+            self.adv_scheduler.update(time.ticks_ms())
         self.advertise()
 
+    def stop_scan(self):
+        if self.scanning:
+            self._scan_done_expected += 1
+        self._ble.gap_scan(None)
+        self.scanning = False
+
     def start_scan(self, duration_ms=0):
         # duration_ms=0 -> continuous, else duration in ms
-        # scan_window & scan_interval left default, but micropython API may vary by port.
-        self._ble.gap_scan(duration_ms or 0, 50000, 50000, True)
-        print("Started scan (duration_ms=%s)" % (duration_ms or "default"))
+        # interval/window come from the adaptive scheduler (full duty until it has seen the room)
+        sched = self.scan_scheduler
+        self._ble.gap_scan(duration_ms or 0, sched.interval_us, sched.window_us, not self.passive)
+        self.scanning = True
+        if not self.telemetry.boot_scan_ms:
+            self.telemetry.boot_scan_ms = time.ticks_ms()
+            print("[BOOT] First scan %d ms after reset" % self.telemetry.boot_scan_ms)
+        print("Started scan (duration_ms=%s, interval_us=%d, window_us=%d)" % (
+            duration_ms or "default", sched.interval_us, sched.window_us))
 
@@ -0,0 +1,69 @@
+import sys
+try:
+    import select
+except ImportError:
+    import uselect as select
+import ubinascii
+from telemetry import decode, TELEMETRY_FIELDS
+
+# Serial console commands, polled without blocking from the main loop or a runtime task.
+#   tel        print the telemetry record as "TEL <hex>" (for tools/collect_telemetry.py) and readable
+#   log        dump the match log as "LOG <hex>" lines and a final "LOG END <bytes>" (tools/download_log.py)
+#   log clear  erase the match log
+#   help       list commands
+
+_LINE_MAX = 64
+
+
+class Console:
+
+    def __init__(self, device, stream=sys.stdin):
+        self.device = device
+        self._stream = stream
+        self._poll = select.poll()
+        self._poll.register(stream, select.POLLIN)
+        self._line = ""
+
+    def poll(self):
+        """Handle any complete command lines waiting on the console. Never blocks."""
+        while self._poll.poll(0):
+            ch = self._stream.read(1)
+            if not ch:
+                break
+            if ch == "\r" or ch == "\n":
+                line, self._line = self._line.strip(), ""
+                if line:
+                    self.handle(line)
+            elif len(self._line) < _LINE_MAX:
+                self._line += ch
+
+    def handle(self, line):
+        if line == "tel":
+            self.dump_telemetry()
+        elif line == "log":
+            self.dump_log()
+        elif line == "log clear":
+            if self.device.match_log is not None:
+                self.device.match_log.clear()
+            print("LOG CLEARED")
+        elif line == "help":
+            print("commands: tel, log, log clear, help")
+        else:
+            print("unknown command:", line)
+
+    def dump_telemetry(self):
+        device = self.device
+        device.service_telemetry(force=True)
+        raw = device.telemetry.pack()
+        print("TEL", ubinascii.hexlify(raw).decode())
+        values = decode(raw)
+        print(" ".join("%s=%d" % (name, values[name]) for name in TELEMETRY_FIELDS[2:]))
+
+    def dump_log(self):
+        log = self.device.match_log
+        total = 0
+        if log is not None:
+            for chunk in log.chunks():
+                print("LOG", ubinascii.hexlify(chunk).decode())
+                total += len(chunk)
+        print("LOG END", total)
@@ -0,0 +1,73 @@
+from adv_format import BLOOM_K, BLOCK_OVERHEAD
+
+# Inner loops of the scan path, run for every NIMI packet we hear. These are the plain
+# Python versions; on ports built with the native emitter fastpath_native replaces them with
+# @micropython.viper / @micropython.native copies that give the same results.
+#
+#   find_ad(buf, n, t1, t2)        offset of the first AD structure of type t1 or t2, or -1
+#   match_ids(buf, end, ids, nids) bitmask of the KIND_IDS entries in buf[BLOCK_OVERHEAD:end]
+#                                  that are among ids[:nids] (bit k = k-th ID in the block)
+#   bloom_matches(bits, numbers)   the numbers a KIND_BLOOM filter reports as present
+#
+# ids is an array("I"), so the viper version can read it as a ptr32. Four arguments at most:
+# that is all a viper function takes.
+
+
+def find_ad_py(buf, n, t1, t2):
+    i = 0
+    while i + 1 < n:
+        length = buf[i]
+        if length == 0:
+            break
+        t = buf[i + 1]
+        if t == t1 or t == t2:
+            return i
+        i += 1 + length
+    return -1
+
+
+def match_ids_py(buf, end, ids, nids):
+    mask = 0
+    bit = 1
+    i = BLOCK_OVERHEAD
+    while i + 4 <= end:
+        v = buf[i] | (buf[i + 1] << 8) | (buf[i + 2] << 16) | (buf[i + 3] << 24)
+        j = 0
+        while j < nids:
+            if ids[j] == v:
+                mask |= bit
+                break
+            j += 1
+        bit <<= 1
+        i += 4
+    return mask
+
+
+def bloom_matches_py(bits, numbers):
+    out = []
+    m = len(bits) * 8
+    if not m:
+        return out
+    for n in numbers:
+        h1 = n & 0xFFFF
+        h2 = (n >> 16) | 1
+        for i in range(BLOOM_K):
+            b = (h1 + i * h2) % m
+            if not bits[b >> 3] & (1 << (b & 7)):
+                break
+        else:
+            out.append(n)
+    return out
+
+
+find_ad = find_ad_py
+match_ids = match_ids_py
+bloom_matches = bloom_matches_py
+EMITTER = "python"
+
+try:
+    # SyntaxError: port built without the native emitter; ValueError: .mpy for another arch
+    from fastpath_native import find_ad, match_ids, bloom_matches
+    EMITTER = "viper"
+except (ImportError, SyntaxError, ValueError):
+    pass
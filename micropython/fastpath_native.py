@@ -0,0 +1,63 @@
+import micropython
+from micropython import const
+from adv_format import BLOOM_K
+
+# Machine-code copies of the loops in fastpath.py; import fastpath, not this module. The
+# bodies must stay line for line with the *_py versions there: sim/fastpath_check.py and
+# tools/bench_fastpath.py compare the two.
+#
+# Viper ints are 32-bit machine words, so an ID read from the block may come out negative;
+# it is only ever compared for equality with a ptr32 load, which has the same bit pattern.
+
+_BLOCK_OVERHEAD = const(6)  # adv_format.BLOCK_OVERHEAD; viper needs it as a literal
+
+
+@micropython.viper
+def find_ad(buf: ptr8, n: int, t1: int, t2: int) -> int:
+    i = 0
+    while i + 1 < n:
+        length = buf[i]
+        if length == 0:
+            break
+        t = buf[i + 1]
+        if t == t1 or t == t2:
+            return i
+        i += 1 + length
+    return -1
+
+
+@micropython.viper
+def match_ids(buf: ptr8, end: int, ids: ptr32, nids: int) -> int:
+    mask = 0
+    bit = 1
+    i = _BLOCK_OVERHEAD
+    while i + 4 <= end:
+        v = buf[i] | (buf[i + 1] << 8) | (buf[i + 2] << 16) | (buf[i + 3] << 24)
+        j = 0
+        while j < nids:
+            if ids[j] == v:
+                mask |= bit
+                break
+            j += 1
+        bit <<= 1
+        i += 4
+    return mask
+
+
+# IDs are full 32-bit values (bigger than a small int), so this one stays native, not viper
+@micropython.native
+def bloom_matches(bits, numbers):
+    out = []
+    m = len(bits) * 8
+    if not m:
+        return out
+    for n in numbers:
+        h1 = n & 0xFFFF
+        h2 = (n >> 16) | 1
+        for i in range(BLOOM_K):
+            b = (h1 + i * h2) % m
+            if not bits[b >> 3] & (1 << (b & 7)):
+                break
+        else:
+            out.append(n)
+    return out
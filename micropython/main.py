@@ -1,5 +1,10 @@
 import bluetooth, time, os
 from ble_utils import BLEPeripheral, device_name, load_keywords
+from alerts import MATCH, shared_engine
+from console import Console
+
+# match from the primary advert only (no scan requests); see adv_format.py
+PASSIVE_SCAN = False
 
 try:
     keywords = load_keywords()
@@ -8,15 +13,38 @@ try:
         ble = bluetooth.BLE()
         ble.active(True)
         device_name = device_name(ble)
-        device = BLEPeripheral(ble, name=device_name, keywords=keywords)
+        device = BLEPeripheral(ble, name=device_name, keywords=keywords, passive=PASSIVE_SCAN)
+
+        # get on the air before loading anything else; the [BOOT] lines report how long it took
         device.advertise()
         device.start_scan()
 
+        try:
+            import runtime  # needs asyncio; without it we fall back to the plain loop below
+        except ImportError:
+            runtime = None
+        if runtime:
+            runtime.run(device)
+
+        # without the runtime, alerts step themselves from a hardware timer
+        engine = shared_engine()
+        device.on_match = lambda matches: engine.play(MATCH)
+
+        console = Console(device)  # "tel" on the serial console dumps telemetry
+        dropped = 0
         while True:
-            time.sleep_ms(100)  # Your main loop
+            # handle the IRQ events queued since the last pass, in batches
+            while device.process_events():
+                pass
+            device.service()
+            console.poll()
+            if device.events.dropped != dropped:
+                dropped = device.events.dropped
+                print("[EVENT] Ring overflow, dropped so far:", dropped)
+            time.sleep_ms(20)
     else:
         print("No keywords found in keywords.json.")
 
 except Exception as e:
     print("Error loading keywords.json:", e)
-    # Optionally, exit or skip further execution
\ No newline at end of file
+    # Optionally, exit or skip further execution
@@ -0,0 +1,223 @@
+import os
+import struct
+try:
+    from micropython import const
+except ImportError:  # imported by the host-side download tool on CPython
+    def const(x):
+        return x
+try:
+    from time import ticks_diff
+except ImportError:
+    def ticks_diff(a, b):
+        return a - b
+
+# Append-only match log on flash. One fixed 32-byte little-endian record per reported match:
+#
+#   time_s(4) seq(2) addr(6) addr_type(1) rssi(1, signed) n_ids(1) flags(1) ids(4 x 4)
+#
+# time_s is time.time() on the device, seconds since 2000-01-01 unless the RTC has been set
+# (mpremote rtc --set). seq counts records and carries on across reboots; ids holds the first
+# RECORD_IDS matched IDs, zero-padded, with FLAG_MORE set when there were more.
+#
+# Records collect in a RAM block and reach flash one block at a time (when it fills, or
+# FLUSH_MS after its first record), so a busy room costs one small append per block rather
+# than a write per match. At max_bytes the file is renamed to <path>.1, replacing the previous
+# one: the log never takes more than twice max_bytes of flash, plus whatever is appended while
+# a download is running (rotation waits for it, see chunks()).
+
+RECORD_FORMAT = "<IH6sBbBB4I"
+RECORD_SIZE = const(32)
+RECORD_IDS = const(4)
+FLAG_EXACT = const(0x01)    # IDs confirmed (ID list or GATT read); otherwise Bloom candidates
+FLAG_MORE = const(0x02)     # more matched IDs than the record holds
+
+MATCH_LOG_FILE = "matches.log"
+LOG_MAX_BYTES = const(32768)
+BUFFER_RECORDS = const(16)  # one 512-byte block
+FLUSH_MS = const(30000)
+
+_ZERO_IDS = (0, 0, 0, 0)
+
+
+class MatchLog:
+
+    def __init__(self, path=MATCH_LOG_FILE, max_bytes=LOG_MAX_BYTES, flush_ms=FLUSH_MS):
+        self.path = path
+        self.old_path = path + ".1"
+        self.max_bytes = max_bytes
+        self.flush_ms = flush_ms
+        self._buf = bytearray(BUFFER_RECORDS * RECORD_SIZE)
+        self._mv = memoryview(self._buf)
+        self._n = 0                 # records waiting in the RAM block
+        self._first_ms = 0          # ticks_ms of the oldest of them
+        self.size = 0               # bytes in the current file
+        self.seq = 0                # seq of the next record
+        self.records = 0            # appended since boot
+        self.flushes = 0
+        self.lost = 0               # records dropped by a failed flash write
+        self.readers = 0            # chunks() generators open; rotation waits for them
+        self._resume()
+
+    def _resume(self):
+        # pick up size and seq from the file a previous boot left behind
+        try:
+            self.size = os.stat(self.path)[6]
+        except OSError:
+            return
+        self.size -= self.size % RECORD_SIZE
+        if self.size:
+            with open(self.path, "rb") as f:
+                f.seek(self.size - RECORD_SIZE)
+                last = f.read(RECORD_SIZE)
+            if len(last) == RECORD_SIZE:
+                self.seq = (struct.unpack_from("<H", last, 4)[0] + 1) & 0xFFFF
+
+    def __len__(self):
+        return self._n
+
+    def append(self, now_ms, time_s, addr, addr_type, rssi, ids, exact=True):
+        """Queue one record. Only touches flash when the RAM block fills up."""
+        n_ids = len(ids)
+        flags = FLAG_EXACT if exact else 0
+        if n_ids > RECORD_IDS:
+            n_ids = RECORD_IDS
+            flags |= FLAG_MORE
+        padded = tuple(ids[:n_ids]) + _ZERO_IDS[n_ids:]
+        if rssi < -128:
+            rssi = -128
+        struct.pack_into(RECORD_FORMAT, self._buf, self._n * RECORD_SIZE, time_s & 0xFFFFFFFF, self.seq,
+                         bytes(addr), addr_type, rssi, n_ids, flags, *padded)
+        if not self._n:
+            self._first_ms = now_ms
+        self._n += 1
+        self.seq = (self.seq + 1) & 0xFFFF
+        self.records += 1
+        if self._n == BUFFER_RECORDS:
+            self.flush()
+
+    def service(self, now_ms):
+        """Flush a partly filled block once it has waited flush_ms. Returns True if it wrote."""
+        if self._n and ticks_diff(now_ms, self._first_ms) >= self.flush_ms:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        n = self._n
+        if not n:
+            return
+        self._n = 0
+        length = n * RECORD_SIZE
+        try:
+            if self.size + length > self.max_bytes and not self.readers:
+                self.rotate()
+            with open(self.path, "ab") as f:
+                f.write(self._mv[:length])
+            self.size += length
+            self.flushes += 1
+        except OSError as e:
+            self.lost += n
+            print("[LOG] Flush failed, %d records lost:" % n, e)
+
+    def rotate(self):
+        try:
+            os.remove(self.old_path)
+        except OSError:
+            pass
+        try:
+            os.rename(self.path, self.old_path)
+        except OSError:
+            pass
+        self.size = 0
+
+    def clear(self):
+        self._n = 0
+        for path in (self.old_path, self.path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.size = 0
+
+    def chunks(self, size=8 * RECORD_SIZE):
+        """
+        Yield the log as it stood when the first piece was asked for, oldest first, in pieces of
+        at most `size` bytes. Flushes first. Until the generator finishes or is closed the log
+        does not rotate, so records appended meanwhile are left for the next download and no
+        file is renamed under it.
+        """
+        self.flush()
+        files = []
+        for path in (self.old_path, self.path):
+            try:
+                files.append((path, os.stat(path)[6]))
+            except OSError:
+                pass
+        self.readers += 1
+        try:
+            buf = bytearray(size)
+            mv = memoryview(buf)
+            for path, left in files:
+                try:
+                    f = open(path, "rb")
+                except OSError:
+                    continue
+                with f:
+                    while left > 0:
+                        n = f.readinto(mv[:min(size, left)])
+                        if not n:
+                            break
+                        left -= n
+                        yield bytes(buf[:n])
+        finally:
+            self.readers -= 1
+
+
+def decode(raw):
+    """Unpack a run of records (as downloaded) into a list of dicts; a partial tail is ignored."""
+    out = []
+    for off in range(0, len(raw) - RECORD_SIZE + 1, RECORD_SIZE):
+        time_s, seq, addr, addr_type, rssi, n_ids, flags, *ids = struct.unpack_from(RECORD_FORMAT, raw, off)
+        out.append({"time_s": time_s, "seq": seq, "addr": addr, "addr_type": addr_type, "rssi": rssi,
+                    "ids": ids[:n_ids], "exact": bool(flags & FLAG_EXACT), "more": bool(flags & FLAG_MORE)})
+    return out
+
+
+# GATT download: write LOG_CMD_DOWNLOAD to MATCH_LOG_UUID and the log comes back as
+# notifications [LOG_FRAME_DATA][bytes ...], oldest first, then one [LOG_FRAME_END][total u32].
+# Data frames are cut at ATT MTU - 4 bytes, so records can straddle two frames.
+LOG_CMD_DOWNLOAD = const(0x01)
+LOG_CMD_CLEAR = const(0x02)
+LOG_FRAME_DATA = const(0x01)
+LOG_FRAME_END = const(0x02)
+
+
+class LogStream:
+    """One download in progress. The caller sends frame() and calls sent() once it went out."""
+
+    def __init__(self, log, conn_handle, mtu):
+        self.conn_handle = conn_handle
+        self.total = 0
+        self.done = False
+        self._chunks = log.chunks(mtu - 4)  # 3 bytes of ATT header, 1 of frame type
+        self._frame = None
+
+    def frame(self):
+        if self._frame is None:
+            try:
+                chunk = next(self._chunks)
+                self.total += len(chunk)
+                self._frame = bytes((LOG_FRAME_DATA,)) + chunk
+            except StopIteration:
+                self._frame = struct.pack("<BI", LOG_FRAME_END, self.total)
+        return self._frame
+
+    def sent(self):
+        if self._frame[0] == LOG_FRAME_END:
+            self.done = True
+        self._frame = None
+
+    def close(self):
+        """Abandon the download, letting the log rotate again."""
+        self._chunks.close()
+        self.done = True
@@ -0,0 +1,248 @@
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+import time
+import alerts
+from console import Console
+from ble_utils import (
+    PEER_IDS_UUID,
+    IRQ_PERIPHERAL_CONNECT,
+    IRQ_PERIPHERAL_DISCONNECT,
+    IRQ_GATTC_CHARACTERISTIC_RESULT,
+    IRQ_GATTC_CHARACTERISTIC_DONE,
+    IRQ_GATTC_READ_RESULT,
+    IRQ_GATTC_READ_DONE,
+)
+
+# Cooperative runtime for the device: each job (IRQ draining, scanning, advertising,
+# GATT writes, peer connections, LED) is its own task, so a slow connect or flash
+# write never stalls the others. Start it with run(device).
+
+CONNECT_TIMEOUT_MS = 3000
+DISCOVER_TIMEOUT_MS = 2000
+READ_TIMEOUT_MS = 2000
+SCAN_RESTART_MS = 500
+CONSOLE_POLL_MS = 200
+LOG_IDLE_MS = 1000      # match log flush check and command pickup
+LOG_STREAM_MS = 20      # between notification bursts while a download runs
+
+
+class PeerLink:
+    """
+    Central-role helper: connect to a peer, read its PEER_IDS characteristic and disconnect.
+    IRQ events only record handles and set a flag; the async methods wait with timeouts
+    instead of busy-waiting in the IRQ handler.
+    """
+
+    def __init__(self, ble):
+        self._ble = ble
+        self._flag = asyncio.ThreadSafeFlag()
+        self._reset()
+
+    def _reset(self):
+        self.conn_handle = None
+        self.value_handle = None
+        self.value = None
+        self._discovered = False
+        self._read_done = False
+
+    def on_irq(self, event, data):
+        if event == IRQ_PERIPHERAL_CONNECT:
+            self.conn_handle = data[0]
+        elif event == IRQ_PERIPHERAL_DISCONNECT:
+            if data[0] == self.conn_handle:
+                self.conn_handle = None
+        elif event == IRQ_GATTC_CHARACTERISTIC_RESULT:
+            conn_handle, def_handle, value_handle, properties, uuid = data
+            if uuid == PEER_IDS_UUID:
+                self.value_handle = value_handle
+        elif event == IRQ_GATTC_CHARACTERISTIC_DONE:
+            self._discovered = True
+        elif event == IRQ_GATTC_READ_RESULT:
+            conn_handle, value_handle, char_data = data
+            self.value = bytes(char_data)  # the stack reuses this buffer, so copy it
+        elif event == IRQ_GATTC_READ_DONE:
+            self._read_done = True
+        else:
+            return
+        self._flag.set()
+
+    async def _until(self, cond, timeout_ms):
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while not cond():
+            left = time.ticks_diff(deadline, time.ticks_ms())
+            if left <= 0:
+                return False
+            try:
+                await asyncio.wait_for_ms(self._flag.wait(), left)
+            except asyncio.TimeoutError:
+                return cond()
+        return True
+
+    async def read_ids(self, addr_type, addr):
+        """Return the peer's packed ID list, or None if any step times out."""
+        self._reset()
+        self._ble.gap_connect(addr_type, addr)
+        if not await self._until(lambda: self.conn_handle is not None, CONNECT_TIMEOUT_MS):
+            try:
+                self._ble.gap_connect(None)  # cancel the pending connect
+            except Exception:
+                pass
+            return None
+        try:
+            self._ble.gattc_discover_characteristics(self.conn_handle, 1, 0xFFFF)
+            await self._until(lambda: self._discovered, DISCOVER_TIMEOUT_MS)
+            if self.value_handle is not None and self.conn_handle is not None:
+                self._ble.gattc_read(self.conn_handle, self.value_handle)
+                await self._until(lambda: self._read_done, READ_TIMEOUT_MS)
+            return self.value
+        finally:
+            if self.conn_handle is not None:
+                try:
+                    self._ble.gap_disconnect(self.conn_handle)
+                except Exception:
+                    pass
+                await self._until(lambda: self.conn_handle is None, CONNECT_TIMEOUT_MS)
+
+
+class Runtime:
+
+    def __init__(self, device, led_pin=alerts.LED_PIN, buzzer_pin=alerts.BUZZER_PIN):
+        self.device = device
+        self._irq_flag = asyncio.ThreadSafeFlag()
+        self._adv_event = asyncio.Event()
+        self._write_event = asyncio.Event()
+        self._scan_event = asyncio.Event()
+        self._peer_event = asyncio.Event()
+        self._match_event = asyncio.Event()
+        # the one engine on the LED (and the alert timer), shared with anything else that alerts
+        self.alerts = alerts.shared_engine(led_pin, buzzer_pin)
+        self._link = PeerLink(device._ble)
+
+        device.central = self._link
+        device.peer_reads = True
+        device.on_match = self._on_match
+        # wake the event task from the IRQ once something is queued
+        device.events.on_put = self._irq_flag.set
+
+    def _on_match(self, matches):
+        self._match_event.set()
+
+    async def events_task(self):
+        device = self.device
+        while True:
+            await self._irq_flag.wait()
+            # drain in small batches so other tasks get a turn between them
+            while device.process_events():
+                await asyncio.sleep_ms(0)
+            if device.write_pending:
+                self._write_event.set()
+            if device.adv_pending:
+                self._adv_event.set()
+            if not device.scanning:
+                self._scan_event.set()
+            if device.peer_requests:
+                self._peer_event.set()
+
+    async def gatt_task(self):
+        while True:
+            await self._write_event.wait()
+            self._write_event.clear()
+            self.device.service_writes()
+
+    async def advertise_task(self):
+        device = self.device
+        while True:
+            try:
+                await asyncio.wait_for_ms(self._adv_event.wait(), device.adv_scheduler.period_ms)
+            except asyncio.TimeoutError:
+                pass  # periodic interval check
+            self._adv_event.clear()
+            device.service_advertising()
+
+    async def scan_task(self):
+        device = self.device
+        while True:
+            try:
+                await asyncio.wait_for_ms(self._scan_event.wait(), device.scan_scheduler.period_ms)
+            except asyncio.TimeoutError:
+                # periodic duty-cycle check
+                device.service_scan()
+                continue
+            self._scan_event.clear()
+            # give a connect in progress time to finish before restarting the scan
+            await asyncio.sleep_ms(SCAN_RESTART_MS)
+            if not device.scanning and not self._link.conn_handle:
+                try:
+                    device.start_scan()
+                except OSError as e:
+                    print("[SCAN] Restart failed:", e)
+                    self._scan_event.set()
+
+    async def peer_task(self):
+        device = self.device
+        while True:
+            await self._peer_event.wait()
+            self._peer_event.clear()
+            while device.peer_requests:
+                addr_type, addr = device.peer_requests.pop(0)
+                # most ports cannot connect while scanning; the scan task restarts it afterwards
+                if device.scanning:
+                    device.stop_scan()
+                try:
+                    raw = await self._link.read_ids(addr_type, addr)
+                    device.handle_peer_ids(addr, raw, addr_type)
+                except OSError as e:
+                    print("[PEER] Read failed:", e)
+                self._scan_event.set()
+
+    async def alert_task(self):
+        # play() returns at once; the engine's timer steps the pattern
+        while True:
+            await self._match_event.wait()
+            self._match_event.clear()
+            self.alerts.play(alerts.MATCH)
+
+    async def telemetry_task(self):
+        device = self.device
+        while True:
+            await asyncio.sleep_ms(device.telemetry.period_ms)
+            device.service_telemetry()
+
+    async def log_task(self):
+        device = self.device
+        while True:
+            await asyncio.sleep_ms(LOG_STREAM_MS if device.log_streaming else LOG_IDLE_MS)
+            device.service_log()
+
+    async def console_task(self):
+        console = Console(self.device)
+        while True:
+            console.poll()
+            await asyncio.sleep_ms(CONSOLE_POLL_MS)
+
+    async def main(self):
+        # main.py normally has both running already, straight after boot
+        if not self.device.telemetry.boot_adv_ms:
+            self.device.advertise()
+        if not self.device.scanning:
+            self.device.start_scan()
+        asyncio.create_task(self.events_task())
+        asyncio.create_task(self.gatt_task())
+        asyncio.create_task(self.advertise_task())
+        asyncio.create_task(self.scan_task())
+        asyncio.create_task(self.peer_task())
+        asyncio.create_task(self.alert_task())
+        asyncio.create_task(self.telemetry_task())
+        asyncio.create_task(self.log_task())
+        asyncio.create_task(self.console_task())
+        while True:
+            await asyncio.sleep_ms(1000)
+
+
+def run(device):
+    try:
+        asyncio.run(Runtime(device).main())
+    finally:
+        asyncio.new_event_loop()
@@ -0,0 +1,188 @@
+try:
+    from micropython import const
+except ImportError:
+    def const(x):
+        return x
+try:
+    from time import ticks_diff
+except ImportError:
+    def ticks_diff(a, b):
+        return a - b
+
+# Radio schedulers: decide how hard to scan and how often to advertise, driven by what
+# the scan handler reports. Both are plain state machines; the owner calls update(now_ms) from the main loop or a
+# task and restarts the radio when it returns True.
+
+# (interval_us, window_us), from idle to full duty
+SCAN_LEVELS = (
+    (1280000, 30000),   # nobody around: ~2 % duty
+    (640000, 60000),    # known peers only: ~9 %
+    (320000, 160000),   # occasional newcomers: 50 %
+    (50000, 50000),     # arrivals in progress: 100 %
+)
+SCAN_LEVEL_MAX = const(3)
+
+SCAN_PERIOD_MS = const(2000)     # how often the sighting counts are evaluated
+SCAN_BURST_NEW = const(2)        # new peers per period that jump straight to full duty
+SCAN_IDLE_PERIODS = const(3)     # empty periods before each step down towards idle
+
+
+class ScanScheduler:
+    """
+    Adaptive scan duty cycle. The scan handler calls note_nimi() for every NIMI_DEV advert
+    and note_new_peer() the first time it sees a device. Newcomers push the duty up at once;
+    it decays one level at a time while the room is quiet, down to ~2 % when nobody is there.
+    """
+
+    def __init__(self, level=SCAN_LEVEL_MAX, period_ms=SCAN_PERIOD_MS):
+        self.level = level
+        self.period_ms = period_ms
+        self._new = 0
+        self._nimi = 0
+        self._rate = 0        # smoothed new peers per period, fixed point x16
+        self._empty = 0
+        self._last_ms = None
+        self.changes = 0
+
+    @property
+    def interval_us(self):
+        return SCAN_LEVELS[self.level][0]
+
+    @property
+    def window_us(self):
+        return SCAN_LEVELS[self.level][1]
+
+    def note_nimi(self):
+        self._nimi += 1
+
+    def note_new_peer(self):
+        self._new += 1
+        if self._new >= SCAN_BURST_NEW and self.level < SCAN_LEVEL_MAX:
+            # do not wait for the end of the period when a group walks in
+            self._last_ms = None
+
+    def update(self, now_ms):
+        """Re-evaluate at most once per period. Returns True if the scan parameters changed."""
+        if self._last_ms is not None and ticks_diff(now_ms, self._last_ms) < self.period_ms:
+            return False
+        self._last_ms = now_ms
+        new, nimi = self._new, self._nimi
+        self._new = self._nimi = 0
+        self._rate += ((new << 4) - self._rate) >> 1
+
+        level = self.level
+        if new >= SCAN_BURST_NEW:
+            level = SCAN_LEVEL_MAX
+        elif new or self._rate >= 8:
+            level = max(level, SCAN_LEVEL_MAX - 1)
+        elif nimi:
+            # familiar peers only: ease off, but keep listening for arrivals
+            self._empty = 0
+            if level > 1:
+                level -= 1
+        else:
+            self._empty += 1
+            if self._empty >= SCAN_IDLE_PERIODS and level > 0:
+                self._empty = 0
+                level -= 1
+
+        if new or nimi:
+            self._empty = 0
+        if level != self.level:
+            self.level = level
+            self.changes += 1
+            return True
+        return False
+
+
+# advertising intervals (us); gap_advertise rounds to 0.625 ms units
+ADV_FAST_US = 100000      # burst: after boot, a keyword change or new arrivals
+ADV_NORMAL_US = 500000
+ADV_SLOW_US = 1000000     # stable or crowded room
+ADV_DELAY_MEAN_US = 5000  # the controller adds a random 0-10 ms advDelay to every event
+
+ADV_PERIOD_MS = const(2000)
+ADV_BURST_MS = const(20000)      # how long a fast burst lasts
+ADV_STABLE_PERIODS = const(5)    # periods without newcomers before backing off
+ADV_CROWD_PEERS = const(15)      # distinct peers heard in one period that count as crowded
+
+
+class AdvScheduler:
+    """
+    Adaptive advertising interval. Starts in a fast burst so a freshly booted device is
+    found quickly, falls back to the normal interval, and backs off to the slow one once
+    nobody new has shown up for a while or the room is crowded (where extra adverts only
+    add collisions). burst() restarts the fast phase, e.g. after new keywords.
+
+    The scan handler calls note_peer() once per distinct peer per period (see epoch) and
+    note_new_peer() for first sightings. The controller does not report advertising events,
+    so `adverts` is an estimate from the time spent at each interval.
+    """
+
+    def __init__(self, period_ms=ADV_PERIOD_MS):
+        self.period_ms = period_ms
+        self.interval_us = ADV_FAST_US
+        self.epoch = 0
+        self.adverts = 0
+        self.bursts = 0
+        self.changes = 0
+        self._peers = 0
+        self._new = 0
+        self._stable = 0
+        self._burst = True
+        self._force = False
+        self._burst_until = None
+        self._last_ms = None
+        self._air_us = 0
+
+    def burst(self):
+        # takes effect on the next update() instead of waiting out the period
+        self._burst = True
+        self._force = True
+
+    def note_peer(self):
+        self._peers += 1
+
+    def note_new_peer(self):
+        self._new += 1
+
+    def update(self, now_ms):
+        """Re-evaluate at most once per period. Returns True if the interval changed."""
+        last = self._last_ms
+        if last is not None:
+            elapsed = ticks_diff(now_ms, last)
+            if elapsed < self.period_ms and not self._force:
+                return False
+            self._air_us += elapsed * 1000
+            step = self.interval_us + ADV_DELAY_MEAN_US
+            self.adverts += self._air_us // step
+            self._air_us %= step
+        self._last_ms = now_ms
+        self._force = False
+        self.epoch = (self.epoch + 1) & 0xFF
+        peers, new = self._peers, self._new
+        self._peers = self._new = 0
+
+        crowded = peers >= ADV_CROWD_PEERS
+        if new and not crowded:
+            self._burst = True
+        if self._burst:
+            self._burst = False
+            self._burst_until = now_ms
+            self.bursts += 1
+        self._stable = 0 if new else self._stable + 1
+
+        if self._burst_until is not None and ticks_diff(now_ms, self._burst_until) < ADV_BURST_MS:
+            interval = ADV_FAST_US
+        elif crowded or self._stable >= ADV_STABLE_PERIODS:
+            self._burst_until = None
+            interval = ADV_SLOW_US
+        else:
+            self._burst_until = None
+            interval = ADV_NORMAL_US
+
+        if interval != self.interval_us:
+            self.interval_us = interval
+            self.changes += 1
+            return True
+        return False
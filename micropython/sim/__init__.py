@@ -0,0 +1,197 @@
+"""
+Host-side BLE simulator: runs the unmodified firmware (ble_utils.BLEPeripheral) on CPython.
+
+    from sim import Medium, Fleet
+    medium = Medium(area_m=20, seed=1)
+    fleet = Fleet(medium, devices=50)
+    fleet.start()
+    medium.run_for(10_000_000)   # 10 simulated seconds
+    print(fleet.stats())
+
+See sim/run.py for the command-line load test.
+"""
+
+import importlib
+import os
+import random
+import sys
+import tempfile
+import time as _time
+
+from .medium import Medium, SimBLE, SimClock
+from .modules import install
+
+FIRMWARE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# firmware modules whose clock and print() are redirected into the simulation
+FIRMWARE_MODULES = ("ble_transfer", "scheduling", "telemetry", "alerts", "match_log", "ble_utils")
+
+
+class LogSink:
+    """Replaces print() in the firmware modules and counts lines by their [TAG] prefix."""
+
+    def __init__(self, echo=False):
+        self.echo = echo
+        self.counts = {}
+
+    def __call__(self, *args, **kwargs):
+        first = str(args[0]) if args else ""
+        tag = first.split("]", 1)[0] + "]" if first.startswith("[") else "other"
+        self.counts[tag] = self.counts.get(tag, 0) + 1
+        if self.echo:
+            print(*args, **kwargs)
+
+
+def load_firmware(medium, echo=False):
+    """
+    Install the stand-in modules for `medium`, import the firmware modules and point
+    their clock at the medium's simulated time. Returns the ble_utils module.
+    """
+    install(medium)
+    if FIRMWARE_DIR not in sys.path:
+        sys.path.insert(0, FIRMWARE_DIR)
+    sink = LogSink(echo)
+    for name in FIRMWARE_MODULES:
+        mod = importlib.import_module(name)
+        mod.print = sink
+        if hasattr(mod, "time"):
+            mod.time = medium.clock
+        if hasattr(mod, "ticks_diff"):
+            mod.ticks_diff = medium.clock.ticks_diff
+    ble_utils = sys.modules["ble_utils"]
+    medium.log = sink
+    return ble_utils
+
+
+def random_keywords(rng, universe, count):
+    """A {str(id): word} keyword dict drawn from a shared universe of IDs."""
+    return {str(i): "kw%d" % i for i in rng.sample(universe, count)}
+
+
+class VirtualDevice:
+
+    def __init__(self, medium, ble_utils, keywords, passive=False, match_log=None):
+        self.radio = medium.create_radio()
+        self.radio.active(True)
+        name = ble_utils.device_name(self.radio)
+        self.peripheral = ble_utils.BLEPeripheral(self.radio, name=name, keywords=keywords, passive=passive,
+                                                  match_log=match_log)
+        self.peripheral.on_match = self._on_match
+        self.passive = passive
+        self.matches = 0
+        self.matched_peers = set()     # addresses of the peers a match was reported for
+        self.first_match_us = None
+        self.loop_seconds = 0.0
+        self.loops = 0
+        self._medium = medium
+        report = self.peripheral._report_match
+
+        def _report_match(matches, addr_type, addr, *args):
+            self.matched_peers.add(bytes(addr))
+            report(matches, addr_type, addr, *args)
+        self.peripheral._report_match = _report_match
+
+    def _on_match(self, values):
+        self.matches += 1
+        if self.first_match_us is None:
+            self.first_match_us = self._medium.clock.now_us
+
+    def main_loop_pass(self):
+        """One pass of main.py's polling loop."""
+        t0 = _time.perf_counter()
+        p = self.peripheral
+        while p.process_events():
+            pass
+        p.service()
+        self.loop_seconds += _time.perf_counter() - t0
+        self.loops += 1
+
+
+# what a phone or headset typically puts on air: flags, a vendor manufacturer block, a name
+FOREIGN_ADV = bytes((2, 0x01, 0x06, 10, 0xFF, 0x4C, 0x00, 0x10, 0x05, 0x01, 0x18, 0x2F, 0x9A, 0x11,
+                     8, 0x09)) + b"Phone 7"
+FOREIGN_INTERVAL_US = 100000
+
+
+class Fleet:
+    """N virtual devices sharing one medium, each with a random keyword set.
+
+    mixed alternates active and passive devices (passive is then ignored), to check that the
+    two modes match each other.
+    """
+
+    def __init__(self, medium, devices=10, keywords_per_device=5, universe_size=100,
+                 loop_ms=20, echo=False, seed=None, passive=False, foreign=0, mixed=False):
+        self.medium = medium
+        self.loop_ms = loop_ms
+        rng = random.Random(seed)
+        universe = [rng.getrandbits(32) for _ in range(universe_size)]
+        self.ble_utils = load_firmware(medium, echo)
+        # each device's match log goes to its own file here, removed with the fleet
+        self._log_dir = tempfile.TemporaryDirectory(prefix="nimi-sim-")
+        self.devices = [VirtualDevice(medium, self.ble_utils, random_keywords(rng, universe, keywords_per_device),
+                                      i % 2 == 1 if mixed else passive,
+                                      os.path.join(self._log_dir.name, "matches%d.log" % i))
+                        for i in range(devices)]
+        # non-NIMI advertisers sharing the room
+        self.foreign = [medium.create_radio() for _ in range(foreign)]
+
+    def start(self, boot_spread_ms=1000):
+        """Power the devices on at random times within boot_spread_ms, like people walking in."""
+        for dev in self.devices:
+            self.medium.after(self.medium.rng.randrange(boot_spread_ms * 1000 + 1), self._boot, dev)
+        for radio in self.foreign:
+            radio.active(True)
+            radio.gap_advertise(FOREIGN_INTERVAL_US, adv_data=FOREIGN_ADV, resp_data=FOREIGN_ADV[3:14])
+
+    def _boot(self, dev):
+        dev.peripheral.advertise()
+        dev.peripheral.start_scan()
+        self.medium.every(self.loop_ms * 1000, dev.main_loop_pass)
+
+    def stats(self):
+        devs = self.devices
+        n = len(devs)
+        irqs = sum(d.radio.irq_count for d in devs)
+        irq_s = sum(d.radio.irq_seconds for d in devs)
+        return {
+            "devices": n,
+            "sim_seconds": self.medium.clock.now_us / 1e6,
+            "adv_events": self.medium.packets_sent,
+            "packets_delivered": self.medium.packets_delivered,
+            "irqs": irqs,
+            "irq_mean_us": irq_s / irqs * 1e6 if irqs else 0.0,
+            "irq_max_us": max(d.radio.irq_max_seconds for d in devs) * 1e6 if devs else 0.0,
+            "loop_seconds": sum(d.loop_seconds for d in devs),
+            "matches": sum(d.matches for d in devs),
+            "devices_matched": sum(1 for d in devs if d.first_match_us is not None),
+            "ring_dropped": sum(d.peripheral.events.dropped for d in devs),
+            "ring_control_dropped": sum(d.peripheral.events.control_dropped for d in devs),
+            "ring_high_water": max(d.peripheral.events.high_water for d in devs) if devs else 0,
+            "gated": sum(d.peripheral.gated for d in devs),
+            "memo_hits": sum(d.peripheral.memo_hits for d in devs),
+            "foreign_dropped": sum(d.peripheral.foreign for d in devs),
+            "seen_entries": sum(len(d.peripheral.seen) for d in devs),
+            "log_records": sum(d.peripheral.match_log.records for d in devs),
+            "log_flushes": sum(d.peripheral.match_log.flushes for d in devs),
+            "log_bytes": sum(d.peripheral.match_log.size for d in devs),
+            "adv_interval_ms": sum(d.peripheral.adv_scheduler.interval_us for d in devs) / 1000.0 / n if devs else 0.0,
+            "adverts_estimated": sum(d.peripheral.adv_scheduler.adverts for d in devs),
+            "scan_duty": sum(d.peripheral.scan_scheduler.window_us / float(d.peripheral.scan_scheduler.interval_us)
+                             for d in devs) / n if devs else 0.0,
+            "log_lines": dict(self.medium.log.counts),
+            "mode_matches": self.mode_matches(),
+        }
+
+    def mode_matches(self):
+        """{(scanner passive, peer passive): devices a reported match went to}, per pair of modes."""
+        by_addr = {d.radio.mac: d for d in self.devices}
+        counts = {(a, b): 0 for a in (False, True) for b in (False, True)}
+        for d in self.devices:
+            for addr in d.matched_peers:
+                peer = by_addr.get(addr)
+                if peer is not None:
+                    counts[d.passive, peer.passive] += 1
+        return counts
+
+
+__all__ = ["Medium", "SimBLE", "SimClock", "Fleet", "VirtualDevice", "load_firmware", "install", "random_keywords"]
@@ -0,0 +1,223 @@
+"""
+Monte Carlo model of discovery latency: how long until a device first reports a match
+with a peer, for given advertising/scan parameters and crowd sizes.
+
+Unlike sim.run this does not execute the firmware; it models the radio at packet level
+(three advertising channels, scan window/interval, advDelay, ALOHA-style collisions,
+SCAN_REQ contention between scanners, the scanner being deaf while it transmits) and
+replays the ignore logic of BLEPeripheral._handle_scan_result, including the one-second
+resolution of time.time() on the ESP32 port.
+
+Run from the micropython/ directory, comma-separated values are swept:
+    python -m sim.discovery
+    python -m sim.discovery --devices 2,20,100,300 --adv-interval-ms 100,250,500
+    python -m sim.discovery --scan-interval-ms 100 --scan-window-ms 30,60,100 --csv
+"""
+
+import argparse
+import itertools
+import math
+import random
+
+# firmware defaults (ble_utils.BLEPeripheral)
+ADV_INTERVAL_MS = 500          # scheduling.ADV_NORMAL_US; the adaptive scheduler also uses 100 ms and 1000 ms
+SCAN_INTERVAL_MS = 50          # scheduling.SCAN_LEVELS at full duty
+SCAN_WINDOW_MS = 50
+IGNORE_S = 3                   # IGNORE_DURATION
+CLOCK_RESOLUTION_S = 1         # time.time() ticks in whole seconds
+
+ADV_DELAY_MAX_US = 10000
+T_IFS_US = 150
+CHANNELS = 3
+
+
+def airtime_us(payload_len):
+    """LE 1M PHY: preamble(1) + access address(4) + header(2) + AdvA(6) + CRC(3) + payload, 8 us per byte."""
+    return (16 + payload_len) * 8
+
+
+SCAN_REQ_US = airtime_us(6)    # ScanA + AdvA
+
+
+class Params:
+
+    def __init__(self, devices=10, adv_interval_ms=ADV_INTERVAL_MS, scan_interval_ms=SCAN_INTERVAL_MS,
+                 scan_window_ms=SCAN_WINDOW_MS, ignore_s=IGNORE_S, clock_resolution_s=CLOCK_RESOLUTION_S,
+                 adv_len=31, sr_len=30, active=True, loss=0.0, horizon_s=60.0):
+        self.devices = devices
+        self.adv_interval_us = int(adv_interval_ms * 1000)
+        self.scan_interval_us = int(scan_interval_ms * 1000)
+        self.scan_window_us = min(int(scan_window_ms * 1000), self.scan_interval_us)
+        self.ignore_s = ignore_s
+        self.clock_resolution_s = clock_resolution_s
+        self.adv_us = airtime_us(adv_len)
+        self.sr_us = airtime_us(sr_len) if active else 0
+        self.active = active
+        self.loss = loss
+        self.horizon_us = int(horizon_s * 1e6)
+
+        # channel spacing inside one advertising event: ADV, then room for SCAN_REQ/SCAN_RSP
+        self.channel_gap_us = self.adv_us + T_IFS_US + (SCAN_REQ_US + T_IFS_US + self.sr_us if active else 0)
+        period = self.adv_interval_us + ADV_DELAY_MAX_US / 2.0
+        others = max(0, devices - 2)
+        duty = self.scan_window_us / float(self.scan_interval_us)
+        # expected number of other scanners that hear a given advert (they sit on 1 of 3 channels)
+        self.contenders = others * duty / CHANNELS
+        # probability some scanner answers a given advert packet, so a SCAN_REQ/RSP follows it
+        answered = 1.0 - math.exp(-(devices - 1) * duty / CHANNELS) if active else 0.0
+        # mean on-air time per advert packet, including the exchange it triggers
+        mean_packet_us = self.adv_us + answered * (SCAN_REQ_US + self.sr_us)
+        # packets per microsecond on one channel from everybody else
+        self.rate = others / period
+        self.mean_packet_us = mean_packet_us
+        # fraction of time a channel is busy, and the observer's own deaf time while it advertises
+        self.channel_load = self.rate * mean_packet_us
+        self.deaf = CHANNELS * self.channel_gap_us / period
+
+    def survives(self, rng, packet_us):
+        """Pure-ALOHA survival of one packet against other devices' traffic on its channel."""
+        if self.loss and rng.random() < self.loss:
+            return False
+        return rng.random() < math.exp(-self.rate * (packet_us + self.mean_packet_us))
+
+
+def first_match_us(p, rng):
+    """Time from power-on until the observer reports a match with one peer, or None past the horizon."""
+    scan_phase = rng.randrange(p.scan_interval_us)
+    first_channel = rng.randrange(CHANNELS)
+    t = rng.randrange(p.adv_interval_us + ADV_DELAY_MAX_US)
+    res = p.clock_resolution_s
+    entry_ts = None
+    ignore = False
+
+    def clock(t_us):
+        s = t_us / 1e6
+        return math.floor(s / res) * res if res else s
+
+    while t < p.horizon_us:
+        for ch in range(CHANNELS):
+            tx = t + ch * p.channel_gap_us
+            slot, offset = divmod(tx + scan_phase, p.scan_interval_us)
+            if offset >= p.scan_window_us or (first_channel + slot) % CHANNELS != ch:
+                continue
+            if rng.random() < p.deaf or not p.survives(rng, p.adv_us):
+                continue
+            # advertising packet: the first branch of _handle_scan_result
+            now = clock(tx)
+            if entry_ts is None:
+                entry_ts = now
+                ignore = False
+            else:
+                ignore = now - entry_ts <= p.ignore_s
+            if not p.active:
+                # passive mode: the NIMI block in this advert is enough to match (adv_format)
+                return tx + p.adv_us
+            # SCAN_REQ: every listening scanner wants this response; random backoff decides who sends
+            k = _poisson(rng, p.contenders)
+            backoff = max(1, k + 1)
+            if rng.randrange(backoff) != 0:
+                continue
+            if any(rng.randrange(backoff) == 0 for _ in range(k)):
+                continue  # two requests collided
+            rsp = tx + p.adv_us + T_IFS_US + SCAN_REQ_US + T_IFS_US
+            if (rsp + scan_phase) % p.scan_interval_us >= p.scan_window_us:
+                continue
+            if not p.survives(rng, SCAN_REQ_US) or not p.survives(rng, p.sr_us):
+                continue
+            # scan response: the second branch
+            if not ignore:
+                return rsp
+            break
+        t += p.adv_interval_us + rng.randrange(ADV_DELAY_MAX_US)
+    return None
+
+
+def _poisson(rng, lam):
+    if lam <= 0:
+        return 0
+    if lam > 30:
+        return max(0, int(round(rng.gauss(lam, math.sqrt(lam)))))
+    limit, k, prod = math.exp(-lam), 0, rng.random()
+    while prod > limit:
+        k += 1
+        prod *= rng.random()
+    return k
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    i = min(len(sorted_values) - 1, max(0, int(math.ceil(q * len(sorted_values))) - 1))
+    return sorted_values[i]
+
+
+def run(params, trials=2000, seed=1):
+    """Return summary statistics of time-to-first-match (seconds) over `trials` observer/peer pairs."""
+    rng = random.Random(seed)
+    times = []
+    missed = 0
+    for _ in range(trials):
+        t = first_match_us(params, rng)
+        if t is None:
+            missed += 1
+        else:
+            times.append(t / 1e6)
+    times.sort()
+    return {
+        "matched": len(times) / float(trials),
+        "mean": sum(times) / len(times) if times else float("nan"),
+        "p50": percentile(times, 0.50),
+        "p90": percentile(times, 0.90),
+        "p99": percentile(times, 0.99),
+        "channel_load": params.channel_load,
+        "adv_per_s": 1e6 / (params.adv_interval_us + ADV_DELAY_MAX_US / 2.0),
+        "scan_duty": params.scan_window_us / float(params.scan_interval_us),
+    }
+
+
+def _floats(text):
+    return [float(v) for v in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Discovery latency Monte Carlo for NIMI advertising/scan parameters")
+    parser.add_argument("--devices", default="2,10,50,100,300", help="devices in range (including the observer)")
+    parser.add_argument("--adv-interval-ms", default=str(ADV_INTERVAL_MS))
+    parser.add_argument("--scan-interval-ms", default=str(SCAN_INTERVAL_MS))
+    parser.add_argument("--scan-window-ms", default=str(SCAN_WINDOW_MS))
+    parser.add_argument("--ignore-s", default=str(IGNORE_S))
+    parser.add_argument("--clock-resolution-s", type=float, default=CLOCK_RESOLUTION_S,
+                        help="time.time() resolution used by the ignore logic (0 = exact)")
+    parser.add_argument("--passive", action="store_true",
+                        help="model passive mode: 31-byte adverts matched on their own, no scan responses")
+    parser.add_argument("--loss", type=float, default=0.0, help="extra per-packet loss probability")
+    parser.add_argument("--horizon-s", type=float, default=60.0)
+    parser.add_argument("--trials", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--csv", action="store_true")
+    args = parser.parse_args(argv)
+
+    header = ("devices", "adv_ms", "scan_int_ms", "scan_win_ms", "ignore_s", "matched",
+              "mean_s", "p50_s", "p90_s", "p99_s", "chan_load", "adv_per_s", "scan_duty")
+    if args.csv:
+        print(",".join(header))
+    else:
+        print("%7s %7s %11s %11s %8s %7s %7s %7s %7s %7s %9s %9s %9s" % header)
+
+    sweep = itertools.product(_floats(args.devices), _floats(args.adv_interval_ms), _floats(args.scan_interval_ms),
+                              _floats(args.scan_window_ms), _floats(args.ignore_s))
+    for devices, adv, scan_int, scan_win, ignore in sweep:
+        params = Params(devices=int(devices), adv_interval_ms=adv, scan_interval_ms=scan_int,
+                        scan_window_ms=scan_win, ignore_s=ignore, clock_resolution_s=args.clock_resolution_s,
+                        active=not args.passive, loss=args.loss, horizon_s=args.horizon_s)
+        r = run(params, args.trials, args.seed)
+        row = (int(devices), adv, scan_int, min(scan_win, scan_int), ignore, r["matched"], r["mean"],
+               r["p50"], r["p90"], r["p99"], r["channel_load"], r["adv_per_s"], r["scan_duty"])
+        if args.csv:
+            print(",".join(str(v) for v in row))
+        else:
+            print("%7d %7g %11g %11g %8g %7.3f %7.2f %7.2f %7.2f %7.2f %9.3f %9.2f %9.2f" % row)
+
+
+if __name__ == "__main__":
+    main()
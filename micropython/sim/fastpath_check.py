@@ -0,0 +1,117 @@
+"""
+Check that the native/viper hot paths (fastpath_native) and their plain Python fallbacks
+(fastpath.*_py) give the same answers, against adv_format as the reference.
+
+CPython runs the viper bodies as ordinary Python (see sim.modules), so this checks the
+logic of both copies, not the emitter; tools/bench_fastpath.py repeats the comparison on
+the board itself. With --fleet it also runs the same simulated room twice, once on each
+path, and compares what every device matched.
+
+Run from the micropython/ directory:
+    python -m sim.fastpath_check
+    python -m sim.fastpath_check --trials 20000 --fleet 30
+"""
+
+import argparse
+import random
+import sys
+from array import array
+
+from . import Fleet, Medium, install, FIRMWARE_DIR
+
+
+def random_packet(rng, adv_format):
+    """A NIMI packet as the firmware builds it, or random junk, plus the IDs it carries."""
+    kind = rng.randrange(4)
+    numbers = [rng.getrandbits(32) for _ in range(rng.randrange(0, 12))]
+    if kind == 0:
+        return bytes(rng.getrandbits(8) for _ in range(rng.randrange(0, 32))), numbers
+    room = rng.choice((adv_format.AD_MAX, rng.randrange(adv_format.BLOCK_OVERHEAD, adv_format.AD_MAX + 1)))
+    block = adv_format.encode_block(numbers if kind != 1 else numbers[:adv_format.IDS_MAX], room)
+    name = b"NIMI_DEV_%04X" % rng.getrandbits(16)
+    rest = adv_format.AD_MAX - len(block)
+    tail = bytes((len(name[:rest - 2]) + 1, rng.choice((0x08, 0x09)))) + name[:rest - 2] if rest > 2 else b""
+    return block + tail, numbers
+
+
+def check_functions(trials, seed):
+    install(None)
+    if FIRMWARE_DIR not in sys.path:
+        sys.path.insert(0, FIRMWARE_DIR)
+    import adv_format
+    import fastpath
+    import fastpath_native
+
+    rng = random.Random(seed)
+    universe = [rng.getrandbits(32) for _ in range(64)]
+    checked = {"find_ad": 0, "match_ids": 0, "bloom_matches": 0}
+    for _ in range(trials):
+        buf, numbers = random_packet(rng, adv_format)
+        ours = rng.sample(universe, rng.randrange(0, 20)) + rng.sample(numbers, rng.randrange(0, len(numbers) + 1))
+        ids = array("I", ours)
+
+        for t1, t2 in ((0x09, 0x08), (0xFF, 0xFF), (0x01, 0x01)):
+            a = fastpath.find_ad_py(buf, len(buf), t1, t2)
+            b = fastpath_native.find_ad(buf, len(buf), t1, t2)
+            assert a == b, (buf.hex(), t1, t2, a, b)
+            checked["find_ad"] += 1
+
+        found = adv_format.find_block(buf)
+        if found is None:
+            continue
+        kind, start, end = found
+        expected, _ = adv_format.block_matches(buf, found, ours)
+        if kind == adv_format.KIND_IDS:
+            a = fastpath.match_ids_py(buf, end, ids, len(ids))
+            b = fastpath_native.match_ids(buf, end, ids, len(ids))
+            assert a == b, (buf.hex(), ours, a, b)
+            peer = adv_format.decode_ids(buf, found)
+            got = [peer[k] for k in range(len(peer)) if a >> k & 1]
+            assert sorted(set(got)) == sorted(set(expected)), (buf.hex(), ours, got, expected)
+            checked["match_ids"] += 1
+        elif kind == adv_format.KIND_BLOOM:
+            bits = buf[start:end]
+            a = fastpath.bloom_matches_py(bits, ours)
+            b = fastpath_native.bloom_matches(bits, ours)
+            assert a == b == expected, (buf.hex(), ours, a, b, expected)
+            checked["bloom_matches"] += 1
+    return checked
+
+
+def run_fleet(devices, seconds, seed, passive, use_native):
+    import fastpath
+    import fastpath_native
+    source = fastpath_native if use_native else fastpath
+    suffix = "" if use_native else "_py"
+    medium = Medium(area_m=15, seed=seed)
+    fleet = Fleet(medium, devices=devices, seed=seed, passive=passive)
+    ble_utils = fleet.ble_utils
+    for name in ("find_ad", "match_ids", "bloom_matches"):
+        setattr(ble_utils, name, getattr(source, name + suffix))
+    fleet.start()
+    medium.run_for(seconds * 1e6)
+    return [(d.matches, d.first_match_us, sorted(d.peripheral.seen)) for d in fleet.devices]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the native and Python hot paths")
+    parser.add_argument("--trials", type=int, default=5000, help="random packets to compare")
+    parser.add_argument("--fleet", type=int, default=0, help="also compare a simulated room of this many devices")
+    parser.add_argument("--seconds", type=float, default=10.0, help="simulated seconds for --fleet")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    checked = check_functions(args.trials, args.seed)
+    print("functions          identical on %s" % ", ".join("%s x%d" % kv for kv in checked.items()))
+    if args.fleet:
+        for passive in (False, True):
+            native = run_fleet(args.fleet, args.seconds, args.seed, passive, True)
+            python = run_fleet(args.fleet, args.seconds, args.seed, passive, False)
+            assert native == python, "fleet results differ between the native and Python paths"
+            print("fleet (%s)    identical: %d devices, %d matches" % (
+                "passive" if passive else "active ", len(native), sum(m for m, _, _ in native)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,492 @@
+"""
+Simulated clock, radio medium and bluetooth.BLE radios.
+
+The medium is a discrete-event scheduler in simulated microseconds. Each radio's
+advertising events are delivered as IRQ_SCAN_RESULT (and, for active scanners, the
+scan response) to every scanner in range that is listening at that moment.
+Connections, GATT reads/writes/notifies and MTU exchange are delivered between radios
+with the same IRQ codes and tuples the MicroPython port uses.
+"""
+
+import heapq
+import math
+import random
+import time as _time
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF = _TICKS_PERIOD // 2
+
+# IRQ codes (match MicroPython's bluetooth module)
+_IRQ_CENTRAL_CONNECT = 1
+_IRQ_CENTRAL_DISCONNECT = 2
+_IRQ_GATTS_WRITE = 3
+_IRQ_SCAN_RESULT = 5
+_IRQ_SCAN_DONE = 6
+_IRQ_PERIPHERAL_CONNECT = 7
+_IRQ_PERIPHERAL_DISCONNECT = 8
+_IRQ_GATTC_SERVICE_DONE = 10
+_IRQ_GATTC_CHARACTERISTIC_RESULT = 11
+_IRQ_GATTC_CHARACTERISTIC_DONE = 12
+_IRQ_GATTC_READ_RESULT = 15
+_IRQ_GATTC_READ_DONE = 16
+_IRQ_GATTC_WRITE_DONE = 17
+_IRQ_GATTC_NOTIFY = 18
+_IRQ_MTU_EXCHANGED = 21
+
+_ADV_IND = 0x00
+_ADV_NONCONN_IND = 0x03
+_SCAN_RSP = 0x04
+
+ADV_DELAY_MAX_US = 10000      # advDelay, random 0-10 ms added to every advertising event
+SCAN_RSP_DELAY_US = 150       # T_IFS + SCAN_REQ before the response
+LINK_LATENCY_US = 7500        # one connection interval for GATT operations
+
+
+class SimClock:
+    """Simulated time, exposed to the firmware through a MicroPython-style time module."""
+
+    def __init__(self, start_us=0):
+        self.now_us = start_us
+
+    # MicroPython time API
+    def time(self):
+        return self.now_us // 1000000  # whole seconds, like the ESP32 port
+
+    def time_ns(self):
+        return self.now_us * 1000
+
+    def ticks_ms(self):
+        return (self.now_us // 1000) & _TICKS_MAX
+
+    def ticks_us(self):
+        return self.now_us & _TICKS_MAX
+
+    def ticks_cpu(self):
+        return self.now_us & _TICKS_MAX
+
+    @staticmethod
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & _TICKS_MAX
+
+    @staticmethod
+    def ticks_diff(a, b):
+        return ((a - b + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+    def sleep_ms(self, ms):
+        self.now_us += int(ms * 1000)
+
+    def sleep_us(self, us):
+        self.now_us += int(us)
+
+    def sleep(self, s):
+        self.now_us += int(s * 1000000)
+
+    def localtime(self, secs=None):
+        return _time.gmtime(self.time() if secs is None else secs)[:8]
+
+
+class Medium:
+    """
+    Shared radio medium. Radios are placed in a square room; RSSI follows a log-distance
+    path-loss model and packets below `sensitivity` dBm are not heard. `loss` is an extra
+    independent drop probability per packet.
+    """
+
+    def __init__(self, clock=None, area_m=10.0, tx_power=-59, path_loss_exp=2.0,
+                 sensitivity=-95, rssi_noise=2.0, loss=0.0, seed=None):
+        self.clock = clock or SimClock()
+        self.area_m = area_m
+        self.tx_power = tx_power
+        self.path_loss_exp = path_loss_exp
+        self.sensitivity = sensitivity
+        self.rssi_noise = rssi_noise
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.radios = []
+        self._queue = []
+        self._seq = 0
+        self._soon = []
+        self._timers = {}
+        self._next_timer = 1
+        self._neighbours = None
+        self.packets_sent = 0
+        self.packets_delivered = 0
+
+    # scheduling
+    def at(self, t_us, func, *args):
+        self._seq += 1
+        heapq.heappush(self._queue, (t_us, self._seq, func, args))
+
+    def after(self, delay_us, func, *args):
+        self.at(self.clock.now_us + int(delay_us), func, *args)
+
+    def call_soon(self, func, arg):
+        self._soon.append((func, arg))
+
+    def _run_soon(self):
+        while self._soon:
+            func, arg = self._soon.pop(0)
+            func(arg)
+
+    def add_timer(self, period_ms, periodic, callback):
+        handle = self._next_timer
+        self._next_timer += 1
+        self._timers[handle] = True
+
+        def fire():
+            if not self._timers.get(handle):
+                return
+            callback()
+            self._run_soon()
+            if periodic:
+                self.after(period_ms * 1000, fire)
+            else:
+                self._timers.pop(handle, None)
+
+        self.after(period_ms * 1000, fire)
+        return handle
+
+    def cancel_timer(self, handle):
+        self._timers.pop(handle, None)
+
+    def every(self, period_us, func, jitter_us=0):
+        """Call func() every period_us, starting at a random phase."""
+        def fire():
+            func()
+            self._run_soon()
+            self.after(period_us, fire)
+        self.after(self.rng.randrange(max(1, period_us + jitter_us)), fire)
+
+    def run_for(self, duration_us):
+        end = self.clock.now_us + int(duration_us)
+        queue = self._queue
+        while queue and queue[0][0] <= end:
+            t_us, _, func, args = heapq.heappop(queue)
+            self.clock.now_us = t_us
+            func(*args)
+        self.clock.now_us = end
+
+    # radios
+    def create_radio(self):
+        mac = bytes(self.rng.getrandbits(8) for _ in range(6))
+        x = self.rng.uniform(0, self.area_m)
+        y = self.rng.uniform(0, self.area_m)
+        radio = SimBLE(self, mac, (x, y))
+        self.radios.append(radio)
+        self._neighbours = None
+        return radio
+
+    def _rssi(self, a, b):
+        d = max(0.1, math.hypot(a.pos[0] - b.pos[0], a.pos[1] - b.pos[1]))
+        return self.tx_power - 10.0 * self.path_loss_exp * math.log10(d)
+
+    def neighbours(self, radio):
+        """Radios that can hear `radio`, with their mean RSSI (cached while nobody moves)."""
+        if self._neighbours is None:
+            self._neighbours = {}
+        n = self._neighbours.get(radio.mac)
+        if n is None:
+            n = [(other, self._rssi(radio, other)) for other in self.radios
+                 if other is not radio and self._rssi(radio, other) >= self.sensitivity]
+            self._neighbours[radio.mac] = n
+        return n
+
+    def move(self, radio, pos):
+        radio.pos = pos
+        self._neighbours = None
+
+    def find(self, addr):
+        addr = bytes(addr)
+        for radio in self.radios:
+            if radio.mac == addr:
+                return radio
+        return None
+
+    def _heard(self, rssi):
+        if self.loss and self.rng.random() < self.loss:
+            return None
+        r = int(round(rssi + self.rng.gauss(0, self.rssi_noise))) if self.rssi_noise else int(rssi)
+        return r if r >= self.sensitivity else None
+
+    def _advertising_event(self, radio, token):
+        if radio._adv_token != token or not radio._active:
+            return
+        self.packets_sent += 1
+        now = self.clock.now_us
+        adv_type = _ADV_IND if radio._adv_connectable else _ADV_NONCONN_IND
+        # built once per event: every scanner gets views of the same bytes
+        mac = memoryview(radio.mac)
+        adv_data = memoryview(radio._adv_data)
+        resp_data = memoryview(radio._resp_data) if radio._resp_data is not None and radio._adv_connectable else None
+        heard = self._heard
+        delivered = 0
+        for scanner, mean_rssi in self.neighbours(radio):
+            # scanner.listening(now), inlined: this loop runs once per radio pair per advert
+            if not scanner._scanning or (now - scanner._scan_start) % scanner._scan_interval >= scanner._scan_window:
+                continue
+            rssi = heard(mean_rssi)
+            if rssi is None:
+                continue
+            delivered += 1
+            scanner._deliver(_IRQ_SCAN_RESULT, (0, mac, adv_type, rssi, adv_data))
+            if resp_data is not None and scanner._scan_active:
+                rssi = heard(mean_rssi)
+                if rssi is not None and scanner.listening(now + SCAN_RSP_DELAY_US):
+                    delivered += 1
+                    scanner._deliver(_IRQ_SCAN_RESULT, (0, mac, _SCAN_RSP, rssi, resp_data))
+        self.packets_delivered += delivered
+        self._run_soon()
+        delay = radio._adv_interval_us + self.rng.randrange(ADV_DELAY_MAX_US)
+        self.after(delay, self._advertising_event, radio, token)
+
+
+class _Connection:
+
+    def __init__(self, handle, central, peripheral):
+        self.handle = handle
+        self.central = central
+        self.peripheral = peripheral
+        self.mtu = 23
+
+
+class SimBLE:
+    """The subset of MicroPython's bluetooth.BLE used by the firmware, on a simulated medium."""
+
+    def __init__(self, medium, mac, pos):
+        self.medium = medium
+        self.mac = mac
+        self.pos = pos
+        self._active = False
+        self._handler = None
+        self._mtu = 23
+        self._gap_name = b""
+        # GATT server
+        self._values = {}
+        self._append = {}
+        self._limits = {}
+        self._chars = []   # (def_handle, value_handle, properties, uuid)
+        # advertising
+        self._adv_token = 0
+        self._adv_interval_us = 0
+        self._adv_data = b""
+        self._resp_data = None
+        self._adv_connectable = True
+        # scanning
+        self._scanning = False
+        self._scan_start = 0
+        self._scan_interval = 1
+        self._scan_window = 1
+        self._scan_active = False
+        self._scan_token = 0
+        # connections, by handle
+        self._conns = {}
+        # load accounting for profiling
+        self.irq_count = 0
+        self.irq_seconds = 0.0
+        self.irq_max_seconds = 0.0
+
+    def _deliver(self, event, data):
+        if self._handler is None or not self._active:
+            return
+        t0 = _time.perf_counter()
+        self._handler(event, data)
+        dt = _time.perf_counter() - t0
+        self.irq_count += 1
+        self.irq_seconds += dt
+        if dt > self.irq_max_seconds:
+            self.irq_max_seconds = dt
+
+    def listening(self, now_us):
+        if not self._scanning:
+            return False
+        return (now_us - self._scan_start) % self._scan_interval < self._scan_window
+
+    # general
+    def active(self, state=None):
+        if state is None:
+            return self._active
+        self._active = bool(state)
+        if not self._active:
+            self._scanning = False
+            self._adv_token += 1
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if args:
+            key = args[0]
+            if key == "mac":
+                return (0, self.mac)
+            if key == "mtu":
+                return self._mtu
+            if key in ("gap_name", "name"):
+                return self._gap_name
+            raise ValueError("unknown config param")
+        for key, value in kwargs.items():
+            if key == "mtu":
+                self._mtu = value
+            elif key in ("gap_name", "name"):
+                self._gap_name = value
+        return None
+
+    def irq(self, handler):
+        self._handler = handler
+
+    # GATT server
+    def gatts_register_services(self, services):
+        handles = []
+        next_handle = 1
+        for uuid, chars in services:
+            next_handle += 1  # service declaration
+            svc = []
+            for char in chars:
+                char_uuid, flags = char[0], char[1]
+                def_handle = next_handle
+                value_handle = next_handle + 1
+                next_handle += 2
+                if flags & 0x0030:
+                    next_handle += 1  # CCCD
+                self._values[value_handle] = b""
+                self._chars.append((def_handle, value_handle, flags, char_uuid))
+                svc.append(value_handle)
+            handles.append(tuple(svc))
+        return tuple(handles)
+
+    def gatts_read(self, value_handle):
+        value = self._values.get(value_handle, b"")
+        if self._append.get(value_handle):
+            self._values[value_handle] = b""
+        return value
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self._values[value_handle] = bytes(data)
+        if send_update:
+            for conn in self._conns.values():
+                if conn.peripheral is self:
+                    self.gatts_notify(conn.handle, value_handle)
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        conn = self._conns.get(conn_handle)
+        if conn is None:
+            raise OSError(128)  # ENOTCONN
+        payload = bytes(self._values.get(value_handle, b"") if data is None else data)
+        payload = payload[:conn.mtu - 3]
+        self.medium.after(LINK_LATENCY_US, conn.central._deliver, _IRQ_GATTC_NOTIFY,
+                          (conn_handle, value_handle, memoryview(payload)))
+
+    def gatts_set_buffer(self, value_handle, length, append=False):
+        self._limits[value_handle] = length
+        self._append[value_handle] = append
+
+    # GAP
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None, connectable=True):
+        self._adv_token += 1
+        if interval_us is None:
+            return
+        self._adv_interval_us = max(20000, int(interval_us))
+        if adv_data is not None:
+            self._adv_data = bytes(adv_data)
+        if resp_data is not None:
+            self._resp_data = bytes(resp_data)
+        self._adv_connectable = connectable
+        self.medium.after(self.medium.rng.randrange(ADV_DELAY_MAX_US),
+                          self.medium._advertising_event, self, self._adv_token)
+
+    def gap_scan(self, duration_ms, interval_us=1280000, window_us=11250, active=False):
+        self._scan_token += 1
+        if duration_ms is None:
+            if self._scanning:
+                self._scanning = False
+                self.medium.after(1, self._deliver, _IRQ_SCAN_DONE, ())
+            return
+        self._scanning = True
+        self._scan_start = self.medium.clock.now_us
+        self._scan_interval = max(1, int(interval_us))
+        self._scan_window = min(int(window_us), self._scan_interval)
+        self._scan_active = bool(active)
+        if duration_ms:
+            self.medium.after(duration_ms * 1000, self._scan_done, self._scan_token)
+
+    def _scan_done(self, token):
+        if token == self._scan_token and self._scanning:
+            self._scanning = False
+            self._deliver(_IRQ_SCAN_DONE, ())
+            self.medium._run_soon()
+
+    def gap_connect(self, addr_type, addr=None, scan_duration_ms=2000, *args):
+        if addr_type is None:
+            return
+        peer = self.medium.find(addr)
+        if peer is None or not peer._active or not peer._adv_connectable or peer._adv_token == 0:
+            return  # nothing answers; the caller's timeout handles it
+        handle = len(self._conns) + len(peer._conns) + 1
+        while handle in self._conns or handle in peer._conns:
+            handle += 1
+        conn = _Connection(handle, self, peer)
+        self._conns[handle] = conn
+        peer._conns[handle] = conn
+        peer._adv_token += 1  # connectable advertising stops on connect
+        self.medium.after(LINK_LATENCY_US, peer._deliver, _IRQ_CENTRAL_CONNECT, (handle, 0, memoryview(self.mac)))
+        self.medium.after(LINK_LATENCY_US, self._deliver, _IRQ_PERIPHERAL_CONNECT, (handle, 0, memoryview(peer.mac)))
+
+    def gap_disconnect(self, conn_handle):
+        conn = self._conns.pop(conn_handle, None)
+        if conn is None:
+            return False
+        other = conn.peripheral if conn.central is self else conn.central
+        other._conns.pop(conn_handle, None)
+        c, p = conn.central, conn.peripheral
+        self.medium.after(LINK_LATENCY_US, p._deliver, _IRQ_CENTRAL_DISCONNECT, (conn_handle, 0, memoryview(c.mac)))
+        self.medium.after(LINK_LATENCY_US, c._deliver, _IRQ_PERIPHERAL_DISCONNECT, (conn_handle, 0, memoryview(p.mac)))
+        return True
+
+    # GATT client
+    def _peer(self, conn_handle):
+        conn = self._conns.get(conn_handle)
+        if conn is None or conn.central is not self:
+            raise OSError(128)
+        return conn, conn.peripheral
+
+    def gattc_discover_services(self, conn_handle, uuid=None):
+        self._peer(conn_handle)
+        self.medium.after(LINK_LATENCY_US, self._deliver, _IRQ_GATTC_SERVICE_DONE, (conn_handle, 0))
+
+    def gattc_discover_characteristics(self, conn_handle, start_handle, end_handle, uuid=None):
+        conn, peer = self._peer(conn_handle)
+        for def_handle, value_handle, flags, char_uuid in peer._chars:
+            if start_handle <= value_handle <= end_handle and (uuid is None or uuid == char_uuid):
+                self.medium.after(LINK_LATENCY_US, self._deliver, _IRQ_GATTC_CHARACTERISTIC_RESULT,
+                                  (conn_handle, def_handle, value_handle, flags, char_uuid))
+        self.medium.after(LINK_LATENCY_US + 1, self._deliver, _IRQ_GATTC_CHARACTERISTIC_DONE, (conn_handle, 0))
+
+    def gattc_read(self, conn_handle, value_handle):
+        conn, peer = self._peer(conn_handle)
+        value = bytes(peer._values.get(value_handle, b""))
+        self.medium.after(LINK_LATENCY_US, self._deliver, _IRQ_GATTC_READ_RESULT,
+                          (conn_handle, value_handle, memoryview(value)))
+        self.medium.after(LINK_LATENCY_US + 1, self._deliver, _IRQ_GATTC_READ_DONE, (conn_handle, value_handle, 0))
+
+    def gattc_write(self, conn_handle, value_handle, data, mode=0):
+        conn, peer = self._peer(conn_handle)
+        data = bytes(data)[:conn.mtu - 3]
+        self.medium.after(LINK_LATENCY_US, peer._remote_write, conn_handle, value_handle, data)
+        if mode == 1:
+            self.medium.after(LINK_LATENCY_US + 1, self._deliver, _IRQ_GATTC_WRITE_DONE, (conn_handle, value_handle, 0))
+
+    def gattc_exchange_mtu(self, conn_handle):
+        conn, peer = self._peer(conn_handle)
+        conn.mtu = min(self._mtu, peer._mtu)
+        self.medium.after(LINK_LATENCY_US, self._deliver, _IRQ_MTU_EXCHANGED, (conn_handle, conn.mtu))
+        self.medium.after(LINK_LATENCY_US, peer._deliver, _IRQ_MTU_EXCHANGED, (conn_handle, conn.mtu))
+
+    def _remote_write(self, conn_handle, value_handle, data):
+        if conn_handle not in self._conns:
+            return
+        if self._append.get(value_handle):
+            value = self._values.get(value_handle, b"") + data
+            limit = self._limits.get(value_handle)
+            self._values[value_handle] = value[:limit] if limit else value
+        else:
+            self._values[value_handle] = data
+        self._deliver(_IRQ_GATTS_WRITE, (conn_handle, value_handle))
+        self.medium._run_soon()
@@ -0,0 +1,215 @@
+"""
+CPython stand-ins for the MicroPython modules the firmware imports:
+bluetooth, machine, neopixel, micropython, ubinascii, ujson and deflate.
+
+install(medium) registers them in sys.modules so `import ble_utils` works unchanged;
+bluetooth.BLE() then returns a new radio attached to that medium.
+
+@micropython.native/viper are no-ops here, so fastpath_native runs as plain Python; the viper
+type names it uses in annotations (ptr8, ptr32, ...) are provided as builtins.
+"""
+
+import binascii
+import builtins
+import json
+import sys
+import types
+import zlib
+
+_medium = None
+
+
+def _module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+
+class UUID:
+    """bluetooth.UUID: compares by value like the real one."""
+
+    def __init__(self, value):
+        if isinstance(value, UUID):
+            value = value._value
+        self._value = value.lower() if isinstance(value, str) else value
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and other._value == self._value
+
+    def __hash__(self):
+        return hash(self._value)
+
+    def __repr__(self):
+        return "UUID(%r)" % (self._value,)
+
+
+def _ble():
+    if _medium is None:
+        raise RuntimeError("sim.install(medium) must be called before bluetooth.BLE()")
+    return _medium.create_radio()
+
+
+# micropython
+def _schedule(func, arg):
+    if _medium is None:
+        func(arg)
+    else:
+        _medium.call_soon(func, arg)
+
+
+def _identity(func):
+    return func
+
+
+class _ViperType:
+    """ptr8/ptr16/ptr32/uint: only ever seen in annotations."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+# machine
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._value = value or 0
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = v
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+
+class PWM:
+
+    def __init__(self, pin, freq=0, duty_u16=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty_u16
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        self._duty = 0
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self._handle = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self.deinit()
+        if freq > 0:
+            period = 1000 // freq
+        self._handle = _medium.add_timer(period, mode == Timer.PERIODIC, lambda: callback(self))
+
+    def deinit(self):
+        if self._handle is not None:
+            _medium.cancel_timer(self._handle)
+            self._handle = None
+
+
+class NeoPixel:
+
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.pin = pin
+        self.n = n
+        self._pixels = [(0,) * bpp] * n
+        self.writes = 0
+
+    def __setitem__(self, i, color):
+        self._pixels[i] = color
+
+    def __getitem__(self, i):
+        return self._pixels[i]
+
+    def __len__(self):
+        return self.n
+
+    def fill(self, color):
+        self._pixels = [color] * self.n
+
+    def write(self):
+        self.writes += 1
+
+
+class DeflateIO:
+    """deflate.DeflateIO (read side) on top of zlib."""
+
+    def __init__(self, stream, format=0, wbits=0, close=False):
+        if format == 1:      # ZLIB
+            wbits = wbits or 15
+        elif format == 2:    # GZIP
+            wbits = 16 + (wbits or 15)
+        else:                # RAW / AUTO
+            wbits = -(wbits or 15)
+        self._stream = stream
+        self._d = zlib.decompressobj(wbits)
+        self._pending = b""
+
+    def read(self, n=-1):
+        while (n < 0 or len(self._pending) < n) and not self._d.eof:
+            chunk = self._stream.read(256)
+            if not chunk:
+                break
+            self._pending += self._d.decompress(chunk)
+        if n < 0:
+            n = len(self._pending)
+        out, self._pending = self._pending[:n], self._pending[n:]
+        return out
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def install(medium):
+    """Register the stand-in modules and bind bluetooth.BLE() to `medium`."""
+    global _medium
+    _medium = medium
+    _module("bluetooth", BLE=_ble, UUID=UUID,
+            FLAG_BROADCAST=0x0001, FLAG_READ=0x0002, FLAG_WRITE_NO_RESPONSE=0x0004,
+            FLAG_WRITE=0x0008, FLAG_NOTIFY=0x0010, FLAG_INDICATE=0x0020)
+    for name in ("ptr", "ptr8", "ptr16", "ptr32", "uint"):
+        setattr(builtins, name, _ViperType(name))
+    _module("micropython", const=lambda x: x, schedule=_schedule, native=_identity,
+            viper=_identity, alloc_emergency_exception_buf=lambda n: None,
+            mem_info=lambda *a: None)
+    _module("machine", Pin=Pin, PWM=PWM, Timer=Timer, freq=lambda *a: 160000000,
+            unique_id=lambda: b"\x00\x00\x00\x00\x00\x00", reset=lambda: None)
+    _module("neopixel", NeoPixel=NeoPixel)
+    _module("ubinascii", hexlify=binascii.hexlify, unhexlify=binascii.unhexlify,
+            crc32=binascii.crc32, b2a_base64=binascii.b2a_base64, a2b_base64=binascii.a2b_base64)
+    _module("ujson", load=json.load, loads=json.loads, dump=json.dump, dumps=json.dumps)
+    _module("deflate", DeflateIO=DeflateIO, RAW=0, ZLIB=1, GZIP=2, AUTO=3)
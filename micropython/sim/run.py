@@ -0,0 +1,93 @@
+"""
+Load test: run N virtual devices on one simulated medium and report IRQ load,
+matching activity, ring-buffer pressure and memory.
+
+Run from the micropython/ directory:
+    python -m sim.run --devices 100 --seconds 5 --area 30
+    python -m sim.run --devices 50 --seconds 30 --profile
+    python -m sim.run --devices 50 --mixed
+
+Every advert is delivered to every scanner in range, so wall time grows with
+the square of --devices: on a desktop CPU one simulated second takes about
+5 s at 100 devices, 25 s at 200 and a few minutes at 500.
+"""
+
+import argparse
+import cProfile
+import pstats
+import time
+import tracemalloc
+
+from . import Fleet, Medium
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a room full of NIMI devices")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10.0, help="simulated seconds")
+    parser.add_argument("--area", type=float, default=20.0, help="room side length in metres")
+    parser.add_argument("--keywords", type=int, default=5, help="keywords per device")
+    parser.add_argument("--universe", type=int, default=100, help="size of the shared keyword pool")
+    parser.add_argument("--loss", type=float, default=0.0, help="extra per-packet loss probability")
+    parser.add_argument("--loop-ms", type=int, default=20, help="main loop period")
+    parser.add_argument("--boot-spread-ms", type=int, default=1000, help="devices power on at random within this window")
+    parser.add_argument("--passive", action="store_true", help="passive scanning, match from the primary advert")
+    parser.add_argument("--mixed", action="store_true", help="alternate active and passive devices")
+    parser.add_argument("--foreign", type=int, default=0, help="non-NIMI advertisers (phones, beacons) in the room")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--profile", action="store_true", help="print the top functions by cumulative time")
+    parser.add_argument("--echo", action="store_true", help="echo firmware output")
+    args = parser.parse_args(argv)
+
+    tracemalloc.start()
+    medium = Medium(area_m=args.area, loss=args.loss, seed=args.seed)
+    fleet = Fleet(medium, devices=args.devices, keywords_per_device=args.keywords,
+                  universe_size=args.universe, loop_ms=args.loop_ms, echo=args.echo, seed=args.seed,
+                  passive=args.passive, foreign=args.foreign, mixed=args.mixed)
+    setup_bytes = tracemalloc.get_traced_memory()[0]
+    fleet.start(args.boot_spread_ms)
+
+    profiler = cProfile.Profile() if args.profile else None
+    t0 = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    medium.run_for(args.seconds * 1e6)
+    if profiler:
+        profiler.disable()
+    wall = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    s = fleet.stats()
+    print("devices            %d in %.0fx%.0f m" % (s["devices"], args.area, args.area))
+    print("simulated          %.1f s in %.1f s wall (%.2fx real time)" % (s["sim_seconds"], wall, s["sim_seconds"] / wall))
+    print("advertising events %d, packets delivered %d" % (s["adv_events"], s["packets_delivered"]))
+    print("IRQs               %d (%.0f per device per s), mean %.1f us, max %.1f us (host CPU)" % (
+        s["irqs"], s["irqs"] / max(1, s["devices"]) / args.seconds, s["irq_mean_us"], s["irq_max_us"]))
+    print("main loop          %.2f s host CPU total" % s["loop_seconds"])
+    print("matches            %d, devices with a match %d" % (s["matches"], s["devices_matched"]))
+    if args.mixed:
+        modes = s["mode_matches"]
+        print("mixed modes        active matched %d active and %d passive peers, passive matched %d active and %d passive" % (
+            modes[False, False], modes[False, True], modes[True, False], modes[True, True]))
+    print("proximity gate     %d peer packets skipped as too far away" % s["gated"])
+    print("match memo         %d packets answered from the per-peer cache" % s["memo_hits"])
+    print("match log          %d records, %d flash writes, %d bytes on flash" % (
+        s["log_records"], s["log_flushes"], s["log_bytes"]))
+    print("foreign adverts    %d dropped in the IRQ handler" % s["foreign_dropped"])
+    print("ring               dropped %d (%d not scan results), high water %d" % (
+        s["ring_dropped"], s["ring_control_dropped"], s["ring_high_water"]))
+    print("advertising        %.0f ms mean interval, %d adverts estimated by the firmware" % (
+        s["adv_interval_ms"], s["adverts_estimated"]))
+    print("scan duty          %.1f %% mean" % (s["scan_duty"] * 100))
+    print("seen entries       %d (%.1f per device)" % (s["seen_entries"], s["seen_entries"] / max(1, s["devices"])))
+    print("memory             %.1f KB per device at setup, %.1f MB peak" % (
+        setup_bytes / 1024 / max(1, s["devices"]), peak / 1e6))
+    print("log lines          %s" % ", ".join("%s=%d" % kv for kv in sorted(s["log_lines"].items())))
+
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import struct
+try:
+    from micropython import const
+except ImportError:  # imported by the host-side collector on CPython
+    def const(x):
+        return x
+try:
+    from time import ticks_diff
+except ImportError:
+    def ticks_diff(a, b):
+        return a - b
+try:
+    import gc
+    _mem_free = gc.mem_free
+except (ImportError, AttributeError):
+    _mem_free = None
+
+# Device telemetry, published on TELEMETRY_UUID and dumped on the serial console as "TEL <hex>".
+# Fixed little-endian record, shared with tools/collect_telemetry.py and the backend:
+#
+#   version(1) reserved(1) scans_per_s(2) uptime_s(4) scans(4) nimi(4) matches(4)
+#   ring_dropped(4) irqs(4) irq_avg_us(2) irq_max_us(2) mem_free(4) mem_low(4)
+#   boot_adv_ms(4) boot_scan_ms(4)                                          version 2+
+#
+# scans/nimi/matches/irqs are totals since boot; scans_per_s and the IRQ timings cover the
+# last sampling window. mem_low is the lowest gc.mem_free() seen at any sample. boot_*_ms
+# are the ticks_ms() (time since reset) of the first advert and the first scan, 0 until then.
+
+TELEMETRY_VERSION = const(2)
+TELEMETRY_FORMAT = "<BBHIIIIIIHHIIII"
+TELEMETRY_SIZE = const(48)
+TELEMETRY_FIELDS = ("version", "reserved", "scans_per_s", "uptime_s", "scans", "nimi", "matches",
+                    "ring_dropped", "irqs", "irq_avg_us", "irq_max_us", "mem_free", "mem_low",
+                    "boot_adv_ms", "boot_scan_ms")
+
+# older records still arriving from devices that have not been updated
+_FORMATS = {
+    1: ("<BBHIIIIIIHHII", TELEMETRY_FIELDS[:13]),
+    TELEMETRY_VERSION: (TELEMETRY_FORMAT, TELEMETRY_FIELDS),
+}
+
+TELEMETRY_PERIOD_MS = const(5000)
+
+
+class Telemetry:
+    """
+    Hot-path counters. The IRQ handler only bumps small ints (irq_done, scans); sample()
+    folds the window into totals once per period so nothing in the IRQ grows past a small int.
+    """
+
+    def __init__(self, now_ms=0, period_ms=TELEMETRY_PERIOD_MS):
+        self.period_ms = period_ms
+        self.scans = 0
+        self.nimi = 0
+        self.matches = 0
+        self.ring_dropped = 0
+        self.irqs = 0
+        self.uptime_s = 0
+        self.scans_per_s = 0
+        self.irq_avg_us = 0
+        self.irq_max_us = 0
+        self.mem_free = 0
+        self.mem_low = 0
+        self.boot_adv_ms = 0
+        self.boot_scan_ms = 0
+        # current window, written from the IRQ handler
+        self._w_scans = 0
+        self._w_irqs = 0
+        self._w_irq_us = 0
+        self._w_irq_max = 0
+        self._last_ms = now_ms
+        self._uptime_ms = now_ms  # ticks_ms() counts from reset
+
+    def irq_done(self, us):
+        self._w_irqs += 1
+        self._w_irq_us += us
+        if us > self._w_irq_max:
+            self._w_irq_max = us
+
+    def scan(self):
+        self._w_scans += 1
+
+    def sample(self, now_ms, ring_dropped=0, force=False):
+        """Close the window if a period has passed. Returns True when new values are ready."""
+        elapsed = ticks_diff(now_ms, self._last_ms)
+        if elapsed < self.period_ms and not force:
+            return False
+        self._last_ms = now_ms
+        self._uptime_ms += elapsed
+        self.uptime_s = self._uptime_ms // 1000
+
+        scans, irqs, irq_us, irq_max = self._w_scans, self._w_irqs, self._w_irq_us, self._w_irq_max
+        self._w_scans = self._w_irqs = self._w_irq_us = self._w_irq_max = 0
+        self.scans += scans
+        self.irqs += irqs
+        self.scans_per_s = min(0xFFFF, scans * 1000 // elapsed) if elapsed > 0 else 0
+        self.irq_avg_us = min(0xFFFF, irq_us // irqs) if irqs else 0
+        self.irq_max_us = min(0xFFFF, irq_max)
+        self.ring_dropped = ring_dropped
+        if _mem_free is not None:
+            self.mem_free = _mem_free()
+            if not self.mem_low or self.mem_free < self.mem_low:
+                self.mem_low = self.mem_free
+        return True
+
+    def pack(self):
+        return struct.pack(TELEMETRY_FORMAT, TELEMETRY_VERSION, 0, self.scans_per_s,
+                           self.uptime_s & 0xFFFFFFFF, self.scans & 0xFFFFFFFF, self.nimi & 0xFFFFFFFF,
+                           self.matches & 0xFFFFFFFF, self.ring_dropped & 0xFFFFFFFF, self.irqs & 0xFFFFFFFF,
+                           self.irq_avg_us, self.irq_max_us, self.mem_free, self.mem_low,
+                           self.boot_adv_ms, self.boot_scan_ms)
+
+
+def decode(raw):
+    """Unpack a telemetry record into a dict, or None if it is not one we understand."""
+    if not raw or raw[0] not in _FORMATS:
+        return None
+    fmt, fields = _FORMATS[raw[0]]
+    size = struct.calcsize(fmt)
+    if len(raw) < size:
+        return None
+    return dict(zip(fields, struct.unpack(fmt, bytes(raw[:size]))))
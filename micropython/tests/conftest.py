@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the firmware modules import each other as top-level modules, as on the device
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,106 @@
+import zlib
+
+import ble_transfer as bt
+from ble_transfer import TransferReceiver
+
+PAYLOAD = bytes(range(256)) * 3
+
+
+def _chunks(payload, size):
+    return [payload[i:i + size] for i in range(0, len(payload), size)]
+
+
+def _start(rx, payload, size, crc=None):
+    crc = zlib.crc32(payload) & 0xFFFFFFFF if crc is None else crc
+    return rx.feed(bt.encode_start(len(payload), crc, size), 0)
+
+
+def test_chunk_size_fits_one_write_at_the_minimum_mtu():
+    size = bt.chunk_size_for(bt.ATT_MTU_MIN)
+    assert size == bt.MIN_CHUNK
+    assert len(bt.encode_data(0, bytes(size))) == bt.ATT_MTU_MIN - 3
+    assert bt.chunk_size_for(247) == 239
+
+
+def test_out_of_order_chunks_complete():
+    rx = TransferReceiver()
+    size = bt.MIN_CHUNK
+    assert _start(rx, PAYLOAD, size)
+    chunks = _chunks(PAYLOAD, size)
+    for seq in reversed(range(len(chunks))):
+        rx.feed(bt.encode_data(seq, chunks[seq]), 0)
+    rx.feed(bt.encode_end(), 0)
+    assert rx.state == bt.STATE_COMPLETE
+    assert bytes(rx.payload()) == PAYLOAD
+
+
+def test_missing_chunk_then_resume():
+    rx = TransferReceiver()
+    size = 40
+    chunks = _chunks(PAYLOAD, size)
+    _start(rx, PAYLOAD, size)
+    for seq, chunk in enumerate(chunks):
+        if seq != 3:
+            rx.feed(bt.encode_data(seq, chunk), 0)
+    rx.feed(bt.encode_end(), 0)
+    assert rx.state == bt.STATE_MISSING
+    assert rx.next_missing() == 3
+    # the link dropped: the same START resumes and keeps what arrived
+    _start(rx, PAYLOAD, size)
+    assert rx.state == bt.STATE_RECEIVING
+    assert rx.received == len(PAYLOAD) - size
+    assert bt.decode_status(rx.status())[1] == 3
+    rx.feed(bt.encode_data(3, chunks[3]), 0)
+    rx.feed(bt.encode_end(), 0)
+    assert rx.state == bt.STATE_COMPLETE
+    assert bytes(rx.payload()) == PAYLOAD
+
+
+def test_crc_mismatch():
+    rx = TransferReceiver()
+    _start(rx, PAYLOAD, 64, crc=1)
+    for seq, chunk in enumerate(_chunks(PAYLOAD, 64)):
+        rx.feed(bt.encode_data(seq, chunk), 0)
+    rx.feed(bt.encode_end(), 0)
+    assert rx.state == bt.STATE_ERR_CRC
+
+
+def test_frame_cut_at_the_end_of_a_read():
+    rx = TransferReceiver()
+    size = 32
+    chunks = _chunks(PAYLOAD, size)
+    _start(rx, PAYLOAD, size)
+    frames = [bt.encode_data(seq, chunk) for seq, chunk in enumerate(chunks)]
+    # the stack's append buffer filled up in the middle of every fourth frame: each read
+    # holds whole frames and then the head of one whose tail never arrived
+    for i in range(0, len(frames), 4):
+        group = frames[i:i + 4]
+        rx.feed(b"".join(group[:-1]) + group[-1][:len(group[-1]) // 2], 0)
+    assert rx.bad_frames == len(range(0, len(frames), 4))
+    rx.feed(bt.encode_end(), 0)
+    assert rx.state == bt.STATE_MISSING
+    assert rx.next_missing() == 3
+    # re-sending the missing chunks completes it
+    while rx.state == bt.STATE_MISSING:
+        seq = rx.next_missing()
+        rx.feed(bt.encode_data(seq, chunks[seq]), 0)
+        rx.feed(bt.encode_end(), 0)
+    assert rx.state == bt.STATE_COMPLETE
+    assert bytes(rx.payload()) == PAYLOAD
+
+
+def test_concatenated_frames_in_one_write():
+    rx = TransferReceiver()
+    payload = PAYLOAD[:100]
+    frames = bt.encode_start(len(payload), zlib.crc32(payload), 50)
+    frames += bt.encode_data(1, payload[50:]) + bt.encode_data(0, payload[:50]) + bt.encode_end()
+    assert rx.feed(frames, 0)
+    assert rx.state == bt.STATE_COMPLETE
+
+
+def test_start_rejects_chunks_below_the_minimum_and_oversize_transfers():
+    rx = TransferReceiver(capacity=1024)
+    rx.feed(bt.encode_start(100, 0, bt.MIN_CHUNK - 1), 0)
+    assert rx.state == bt.STATE_ERR_FORMAT
+    rx.feed(bt.encode_start(2048, 0, 64), 0)
+    assert rx.state == bt.STATE_ERR_SIZE
@@ -0,0 +1,41 @@
+import pytest
+
+from sim import Medium, load_firmware
+
+
+@pytest.fixture(scope="module")
+def ble_utils():
+    return load_firmware(Medium(seed=1), False)
+
+
+def _flood(ble_utils, ring, n):
+    for _ in range(n):
+        ring.put_scan(ble_utils.IRQ_SCAN_RESULT, 0, bytes(6), 0, -50, b"\x02\x01\x06")
+
+
+def test_scan_flood_leaves_room_for_control_events(ble_utils):
+    ring = ble_utils.EventRing(slots=16, control=4)
+    _flood(ble_utils, ring, 100)
+    assert len(ring) == 12
+    assert ring.dropped == 88
+    assert ring.put_handles(ble_utils.IRQ_CENTRAL_DISCONNECT, 1)
+    assert ring.put_handles(ble_utils.IRQ_GATTS_WRITE, 1, 7)
+    assert ring.control_dropped == 0
+    # queued in order, behind the scan results already there
+    events = []
+    while True:
+        off = ring.peek()
+        if off < 0:
+            break
+        events.append(ring.event(off))
+        ring.pop()
+    assert events[-2:] == [ble_utils.IRQ_CENTRAL_DISCONNECT, ble_utils.IRQ_GATTS_WRITE]
+
+
+def test_control_events_drop_only_when_the_reserve_is_gone(ble_utils):
+    ring = ble_utils.EventRing(slots=8, control=2)
+    _flood(ble_utils, ring, 10)
+    for _ in range(3):
+        ring.put_handles(ble_utils.IRQ_SCAN_DONE, 0)
+    assert len(ring) == 8
+    assert ring.control_dropped == 1
@@ -0,0 +1,51 @@
+import struct
+
+import match_log
+from sim import Fleet, Medium
+
+_IRQ_PERIPHERAL_CONNECT = 7
+_IRQ_GATTC_NOTIFY = 18
+
+
+def _connect(medium, central, dev):
+    events = []
+    central.irq(lambda event, data: events.append((event, tuple(
+        bytes(x) if isinstance(x, memoryview) else x for x in data))))
+    central.gap_connect(0, dev.radio.mac)
+    medium.run_for(100000)
+    handle = [data[0] for event, data in events if event == _IRQ_PERIPHERAL_CONNECT][-1]
+    return handle, events
+
+
+def test_download_uses_the_mtu_of_the_requesting_link():
+    medium = Medium(area_m=2, seed=7)
+    fleet = Fleet(medium, devices=1, seed=7)
+    fleet.start(10)
+    medium.run_for(200000)
+    dev = fleet.devices[0]
+    p = dev.peripheral
+    for i in range(20):
+        p.match_log.append(0, 1000 + i, bytes(6), 0, -50, [i])
+
+    # a first central raises the MTU, then leaves
+    first = medium.create_radio()
+    first.active(True)
+    first.config(mtu=247)
+    handle, _ = _connect(medium, first, dev)
+    first.gattc_exchange_mtu(handle)
+    medium.run_for(100000)
+    first.gap_disconnect(handle)
+    medium.run_for(500000)
+
+    # the next one never negotiates: frames must fit 23 - 3 bytes
+    second = medium.create_radio()
+    second.active(True)
+    handle, events = _connect(medium, second, dev)
+    second.gattc_write(handle, p._log_handle, bytes((match_log.LOG_CMD_DOWNLOAD,)), 1)
+    medium.run_for(3000000)
+    frames = [data[2] for event, data in events if event == _IRQ_GATTC_NOTIFY and data[1] == p._log_handle]
+    assert frames and frames[-1][0] == match_log.LOG_FRAME_END
+    raw = b"".join(f[1:] for f in frames if f[0] == match_log.LOG_FRAME_DATA)
+    assert max(len(f) for f in frames) <= 20
+    assert struct.unpack("<I", frames[-1][1:5])[0] == len(raw)
+    assert [r["time_s"] for r in match_log.decode(raw)] == list(range(1000, 1020))
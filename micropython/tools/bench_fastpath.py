@@ -0,0 +1,60 @@
+"""
+On-device benchmark of the scan-path loops: plain Python (fastpath.*_py) against the
+native/viper copies in fastpath_native, on packets shaped like real NIMI adverts. Every
+result is compared first, so this is also the on-board check that the emitter agrees.
+
+Upload the firmware first (upload_esp32.ps1), then:
+    mpremote connect COM3 run micropython/tools/bench_fastpath.py
+"""
+
+import time
+from array import array
+
+import fastpath
+from adv_format import encode_block, find_block, AD_MAX
+
+try:
+    import fastpath_native
+except (ImportError, SyntaxError, ValueError) as e:
+    fastpath_native = None
+    print("no native emitter on this port (%s); the firmware runs the Python versions" % e)
+
+ROUNDS = 500
+
+ours = [0x1A2B3C4D, 0x00C0FFEE, 0xDEADBEEF, 0x12345678, 0x0BADF00D, 0x7FFFFFFF, 0x80000001, 0x55AA55AA]
+ids = array("I", ours)
+name = b"NIMI_DEV_3A7F"
+ids_packet = encode_block([0x11111111, 0xDEADBEEF, 0x22222222, 0x80000001], AD_MAX - len(name) - 2)
+ids_packet += bytes((len(name) + 1, 0x09)) + name
+bloom_packet = encode_block(ours[:3] + [(0x33333333 * k) & 0xFFFFFFFF for k in range(1, 10)], AD_MAX)
+ids_end = find_block(ids_packet)[2]
+_, bloom_start, bloom_end = find_block(bloom_packet)
+bloom_bits = bloom_packet[bloom_start:bloom_end]
+
+CASES = (
+    ("find_ad", (ids_packet, len(ids_packet), 0x09, 0x08)),
+    ("match_ids", (ids_packet, ids_end, ids, len(ids))),
+    ("bloom_matches", (bloom_bits, ours)),
+)
+
+
+def timed_us(func, args):
+    t0 = time.ticks_us()
+    for _ in range(ROUNDS):
+        func(*args)
+    return time.ticks_diff(time.ticks_us(), t0) / ROUNDS
+
+
+print("fastpath in use: %s" % fastpath.EMITTER)
+for func_name, args in CASES:
+    slow = getattr(fastpath, func_name + "_py")
+    line = "%-14s python %7.1f us" % (func_name, timed_us(slow, args))
+    if fastpath_native:
+        fast = getattr(fastpath_native, func_name)
+        if fast(*args) != slow(*args):
+            line += "   MISMATCH: %r != %r" % (fast(*args), slow(*args))
+        else:
+            py_us = timed_us(slow, args)
+            native_us = timed_us(fast, args)
+            line = "%-14s python %7.1f us  native %7.1f us  %5.1fx" % (func_name, py_us, native_us, py_us / max(native_us, 0.1))
+    print(line)
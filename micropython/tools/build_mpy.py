@@ -0,0 +1,105 @@
+"""
+Cross-compile the firmware modules to .mpy so the ESP32-C3 does not compile them from
+source (heap and boot time) on every power-on.
+
+Usage (from the repo root):
+    python micropython/tools/build_mpy.py                 # -> micropython/build/*.mpy
+    python micropython/tools/build_mpy.py --manifest      # also write build/manifest.py for a frozen build
+    powershell micropython/upload_esp32.ps1 -Compiled     # build, then upload main.py + the .mpy files
+
+main.py stays source: the board only runs main.py itself, and it is kept tiny. mpy-cross must
+match the firmware's .mpy version (`pip install mpy-cross==<firmware version>`); the
+`-march` default targets the C3 so @micropython.native/viper functions compile too.
+
+For a frozen build, point the board's FROZEN_MANIFEST at build/manifest.py and rebuild the
+firmware; frozen modules run from flash and take no heap for their bytecode at all.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+FIRMWARE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# every module main.py imports, directly or not; keep in step with upload_esp32.ps1
+MODULES = (
+    "ble_utils.py",
+    "ble_transfer.py",
+    "adv_format.py",
+    "fastpath.py",
+    "fastpath_native.py",
+    "scheduling.py",
+    "alerts.py",
+    "telemetry.py",
+    "match_log.py",
+    "console.py",
+    "runtime.py",
+)
+# hold @micropython.native/viper code, which needs -march; without it fastpath uses its Python fallback
+NATIVE_MODULES = ("fastpath_native.py",)
+
+MANIFEST = '''# Generated by tools/build_mpy.py. Freeze the NIMI firmware modules into the image:
+#   make BOARD=ESP32_GENERIC_C3 FROZEN_MANIFEST={path}
+include("$(PORT_DIR)/boards/manifest.py")
+{modules}
+'''
+
+
+def find_mpy_cross(explicit=None):
+    exe = explicit or shutil.which("mpy-cross")
+    if exe is None:
+        raise SystemExit("mpy-cross not found: pip install mpy-cross==<firmware version>, or pass --mpy-cross")
+    return exe
+
+
+def compile_module(mpy_cross, src, dst, march, optimize):
+    cmd = [mpy_cross, "-o", dst, "-s", os.path.basename(src)]
+    if march:
+        cmd.append("-march=" + march)
+    if optimize:
+        cmd.append("-O%d" % optimize)
+    cmd.append(src)
+    subprocess.run(cmd, check=True)
+
+
+def write_manifest(out_dir):
+    path = os.path.join(out_dir, "manifest.py")
+    lines = "\n".join('module("%s", base_path="%s")' % (name, FIRMWARE_DIR.replace("\\", "/")) for name in MODULES)
+    with open(path, "w") as f:
+        f.write(MANIFEST.format(path=path.replace("\\", "/"), modules=lines))
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-compile the NIMI firmware to .mpy")
+    parser.add_argument("--out", default=os.path.join(FIRMWARE_DIR, "build"), help="output directory")
+    parser.add_argument("--mpy-cross", help="mpy-cross executable (default: from PATH)")
+    parser.add_argument("--march", default="rv32imc", help="native code target ('' for bytecode only)")
+    parser.add_argument("-O", dest="optimize", type=int, default=1,
+                        help="optimisation level; 1+ strips asserts and __debug__ blocks")
+    parser.add_argument("--manifest", action="store_true", help="also write manifest.py for a frozen build")
+    args = parser.parse_args(argv)
+
+    mpy_cross = find_mpy_cross(args.mpy_cross)
+    os.makedirs(args.out, exist_ok=True)
+    total = 0
+    for name in MODULES:
+        if name in NATIVE_MODULES and not args.march:
+            print("%-18s skipped (no --march)" % name)
+            continue
+        src = os.path.join(FIRMWARE_DIR, name)
+        dst = os.path.join(args.out, name[:-3] + ".mpy")
+        compile_module(mpy_cross, src, dst, args.march, args.optimize)
+        size = os.path.getsize(dst)
+        total += size
+        print("%-18s %6d -> %6d bytes" % (name, os.path.getsize(src), size))
+    print("total .mpy        %6d bytes in %s" % (total, args.out))
+    if args.manifest:
+        print("manifest          ", write_manifest(args.out))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Collect device telemetry (see telemetry.py) and forward it to the backend.
+
+Usage:
+    python tools/collect_telemetry.py --serial COM3 --device NIMI_DEV_3A7F
+    python tools/collect_telemetry.py --ble                      # every NIMI_DEV_* in range
+    python tools/collect_telemetry.py --ble --backend http://localhost:9080 --interval 30
+
+Over serial it sends the console command "tel" and parses the "TEL <hex>" reply; over BLE
+it reads TELEMETRY_UUID from each device. Every record is POSTed to <backend>/telemetry.
+"""
+
+import argparse
+import asyncio
+import binascii
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import telemetry  # noqa: E402
+
+TELEMETRY_UUID = "e07498ca-ad5b-474e-940d-16f1fbe7e8cd"
+NAME_PREFIX = "NIMI_DEV_"
+SERIAL_REPLY_TIMEOUT_S = 2.0
+
+
+def post(backend, device, raw):
+    body = json.dumps({"device": device, "payload": binascii.hexlify(raw).decode()}).encode()
+    req = urllib.request.Request(backend.rstrip("/") + "/telemetry", data=body,
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status == 200
+    except (urllib.error.URLError, OSError) as e:
+        print("Backend error:", e)
+        return False
+
+
+def read_serial(port):
+    """Ask the device for one telemetry record over the serial console."""
+    import serial
+
+    with serial.Serial(port, 115200, timeout=0.2) as ser:
+        ser.reset_input_buffer()
+        ser.write(b"tel\r\n")
+        deadline = time.monotonic() + SERIAL_REPLY_TIMEOUT_S
+        while time.monotonic() < deadline:
+            line = ser.readline().decode(errors="replace").strip()
+            if line.startswith("TEL "):
+                return binascii.unhexlify(line[4:])
+    return None
+
+
+async def read_ble(timeout=10.0):
+    """Yield (name, raw) for every NIMI device found in one scan."""
+    from bleak import BleakClient, BleakScanner
+    from bleak.exc import BleakError
+
+    devices = await BleakScanner.discover(timeout=timeout)
+    for device in devices:
+        if not (device.name or "").startswith(NAME_PREFIX):
+            continue
+        try:
+            async with BleakClient(device) as client:
+                yield device.name, bytes(await client.read_gatt_char(TELEMETRY_UUID))
+        except (asyncio.TimeoutError, BleakError, OSError) as e:
+            print("%s: read failed: %s" % (device.name, e))
+
+
+def report(name, raw, backend):
+    values = telemetry.decode(raw)
+    if values is None:
+        print("%s: unknown telemetry record %s" % (name, binascii.hexlify(raw).decode()))
+        return
+    print("%s: %s" % (name, " ".join("%s=%d" % (k, values[k]) for k in telemetry.TELEMETRY_FIELDS[2:] if k in values)))
+    if backend:
+        post(backend, name, raw)
+
+
+async def collect_ble(backend, interval, once):
+    while True:
+        async for name, raw in read_ble():
+            report(name, raw, backend)
+        if once:
+            return
+        await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect NIMI device telemetry")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--serial", metavar="PORT", help="serial port of one device")
+    source.add_argument("--ble", action="store_true", help="read every NIMI device in range over BLE")
+    parser.add_argument("--device", help="device name to record for --serial (default: the port)")
+    parser.add_argument("--backend", default="http://localhost:9080", help="backend base URL ('' to only print)")
+    parser.add_argument("--interval", type=float, default=60.0, help="seconds between collections")
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    if args.ble:
+        asyncio.run(collect_ble(args.backend, args.interval, args.once))
+        return
+    name = args.device or args.serial
+    while True:
+        raw = read_serial(args.serial)
+        if raw is None:
+            print("%s: no telemetry reply" % name)
+        else:
+            report(name, raw, args.backend)
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
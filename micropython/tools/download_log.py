@@ -0,0 +1,132 @@
+"""
+Download a device's match log (see match_log.py) and write it out as CSV.
+
+Usage:
+    python tools/download_log.py --serial COM3 > matches.csv
+    python tools/download_log.py --ble NIMI_DEV_3A7F --out matches.csv
+    python tools/download_log.py --serial COM3 --raw matches.bin --clear
+
+Over serial it sends the console command "log" and collects the "LOG <hex>" lines; over
+BLE it subscribes to MATCH_LOG_UUID, writes LOG_CMD_DOWNLOAD and reassembles the
+notifications. --clear erases the log on the device once the download checked out.
+"""
+
+import argparse
+import asyncio
+import binascii
+import csv
+import datetime
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import match_log  # noqa: E402
+
+MATCH_LOG_UUID = "f07498ca-ad5b-474e-940d-16f1fbe7e8cd"
+SERIAL_REPLY_TIMEOUT_S = 10.0
+BLE_DOWNLOAD_TIMEOUT_S = 60.0
+# time.time() on the device counts from 2000-01-01
+DEVICE_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def read_serial(port, clear=False):
+    """Return the raw log over the serial console, or None if the dump did not complete."""
+    import serial
+
+    with serial.Serial(port, 115200, timeout=0.2) as ser:
+        ser.reset_input_buffer()
+        ser.write(b"log\r\n")
+        raw = bytearray()
+        deadline = time.monotonic() + SERIAL_REPLY_TIMEOUT_S
+        while time.monotonic() < deadline:
+            line = ser.readline().decode(errors="replace").strip()
+            if line.startswith("LOG END"):
+                if int(line.split()[2]) != len(raw):
+                    print("serial: expected %s bytes, got %d" % (line.split()[2], len(raw)), file=sys.stderr)
+                    return None
+                if clear:
+                    ser.write(b"log clear\r\n")
+                return bytes(raw)
+            if line.startswith("LOG "):
+                raw += binascii.unhexlify(line[4:])
+                deadline = time.monotonic() + SERIAL_REPLY_TIMEOUT_S
+    return None
+
+
+async def read_ble(name, clear=False):
+    """Return the raw log streamed over GATT notifications, or None on failure."""
+    from bleak import BleakClient, BleakScanner
+
+    device = await BleakScanner.find_device_by_name(name, timeout=10.0)
+    if device is None:
+        print("%s: not found" % name, file=sys.stderr)
+        return None
+    raw = bytearray()
+    done = asyncio.Event()
+    result = {}
+
+    def on_notify(_, data):
+        if data[0] == match_log.LOG_FRAME_DATA:
+            raw.extend(data[1:])
+        elif data[0] == match_log.LOG_FRAME_END:
+            result["total"] = struct.unpack_from("<I", data, 1)[0]
+            done.set()
+
+    async with BleakClient(device) as client:
+        await client.start_notify(MATCH_LOG_UUID, on_notify)
+        await client.write_gatt_char(MATCH_LOG_UUID, bytes((match_log.LOG_CMD_DOWNLOAD,)), response=True)
+        try:
+            await asyncio.wait_for(done.wait(), BLE_DOWNLOAD_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            print("%s: download timed out after %d bytes" % (name, len(raw)), file=sys.stderr)
+            return None
+        if result["total"] != len(raw):
+            print("%s: expected %d bytes, got %d" % (name, result["total"], len(raw)), file=sys.stderr)
+            return None
+        if clear:
+            await client.write_gatt_char(MATCH_LOG_UUID, bytes((match_log.LOG_CMD_CLEAR,)), response=True)
+    return bytes(raw)
+
+
+def write_csv(records, out):
+    writer = csv.writer(out)
+    writer.writerow(("time", "seq", "addr", "addr_type", "rssi", "ids", "exact", "more"))
+    for r in records:
+        when = DEVICE_EPOCH + datetime.timedelta(seconds=r["time_s"])
+        writer.writerow((when.isoformat(), r["seq"], ":".join("%02X" % b for b in r["addr"]), r["addr_type"],
+                         r["rssi"], " ".join(str(n) for n in r["ids"]), int(r["exact"]), int(r["more"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download a NIMI device's match log")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--serial", metavar="PORT", help="serial port of the device")
+    source.add_argument("--ble", metavar="NAME", help="device name, e.g. NIMI_DEV_3A7F")
+    parser.add_argument("--out", help="CSV file (default: stdout)")
+    parser.add_argument("--raw", help="also save the raw records to this file")
+    parser.add_argument("--clear", action="store_true", help="erase the log on the device after a good download")
+    args = parser.parse_args()
+
+    if args.ble:
+        raw = asyncio.run(read_ble(args.ble, args.clear))
+    else:
+        raw = read_serial(args.serial, args.clear)
+    if raw is None:
+        return 1
+    if args.raw:
+        with open(args.raw, "wb") as f:
+            f.write(raw)
+    records = match_log.decode(raw)
+    print("%d records" % len(records), file=sys.stderr)
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            write_csv(records, f)
+    else:
+        write_csv(records, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
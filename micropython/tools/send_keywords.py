@@ -0,0 +1,171 @@
+"""
+Host-side keyword sender for the chunked BLE transfer protocol (see ble_transfer.py).
+
+Usage:
+    python tools/send_keywords.py keywords.json
+    python tools/send_keywords.py keywords.json --name NIMI_DEV_3A7F
+    python tools/send_keywords.py keywords.json --compress
+    python tools/send_keywords.py keywords.json --backend http://localhost:9080
+
+Streams the file with WRITE_NO_RESPONSE in MTU-sized chunks, then waits for the device
+to confirm the CRC. If the link drops or chunks are missing it reconnects and resumes
+from the first chunk the device is missing. With --backend, a completed transfer is reported
+to the device registry (POST /devices/heartbeat) as the keyword version the device now holds:
+the CRC32 of the uncompressed file, as in the X-Keywords-Version header of /device-payload.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+from bleak import BleakClient, BleakScanner
+from bleak.exc import BleakError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import ble_transfer as bt  # noqa: E402
+
+KEYWORDS_UUID = "b07498ca-ad5b-474e-940d-16f1fbe7e8cd"
+STATUS_UUID = "d07498ca-ad5b-474e-940d-16f1fbe7e8cd"
+NAME_PREFIX = "NIMI_DEV_"
+STATUS_TIMEOUT_S = 5.0
+MAX_ATTEMPTS = 4
+MAX_RESENDS = 3         # MISSING answers to END per attempt before reconnecting
+
+
+class TransferStalled(Exception):
+    """The device kept reporting the same chunks missing; a fresh connection may get them through."""
+
+
+async def find_device(name=None, timeout=10.0):
+    def match(device, adv):
+        dev_name = device.name or adv.local_name or ""
+        return dev_name == name if name else dev_name.startswith(NAME_PREFIX)
+
+    device = await BleakScanner.find_device_by_filter(match, timeout=timeout)
+    if device is None:
+        raise RuntimeError("No %s device found" % (name or NAME_PREFIX + "*"))
+    return device
+
+
+class Sender:
+
+    def __init__(self, payload, flags=0):
+        self.payload = payload
+        self.flags = flags
+        self.crc = zlib.crc32(payload) & 0xFFFFFFFF
+        self._status = asyncio.Queue()
+
+    def _on_status(self, _, data):
+        self._status.put_nowait(bt.decode_status(data))
+
+    def _drain_status(self):
+        # the device also notifies on its own (SUSPENDED after a stall), so drop anything queued
+        # before a command; the next status read is then that command's reply
+        while not self._status.empty():
+            self._status.get_nowait()
+
+    async def _wait_status(self, ignore=()):
+        """The next status, skipping the states in `ignore` that can only be unsolicited."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STATUS_TIMEOUT_S
+        while True:
+            status = await asyncio.wait_for(self._status.get(), max(0.0, deadline - loop.time()))
+            if status[0] not in ignore:
+                return status
+
+    async def send(self, client, chunk_size):
+        """Run one attempt over an open connection. Returns True once the device confirms."""
+        chunks = (len(self.payload) + chunk_size - 1) // chunk_size
+        await client.start_notify(STATUS_UUID, self._on_status)
+        self._drain_status()
+        await client.write_gatt_char(KEYWORDS_UUID, bt.encode_start(len(self.payload), self.crc, chunk_size, self.flags), response=True)
+        state, next_missing, received, mtu = await self._wait_status()
+        if state != bt.STATE_RECEIVING:
+            raise RuntimeError("Device refused transfer (state %d)" % state)
+        if received:
+            print("Resuming at chunk %d (%d bytes already on device)" % (next_missing, received))
+
+        for _ in range(MAX_RESENDS + 1):
+            for seq in range(next_missing, chunks):
+                chunk = self.payload[seq * chunk_size:(seq + 1) * chunk_size]
+                await client.write_gatt_char(KEYWORDS_UUID, bt.encode_data(seq, chunk), response=False)
+            # the write-with-response on END also flushes the queued no-response writes
+            self._drain_status()
+            await client.write_gatt_char(KEYWORDS_UUID, bt.encode_end(), response=True)
+            # END answers COMPLETE, MISSING or an error; a SUSPENDED here was pushed before END arrived
+            state, next_missing, received, mtu = await self._wait_status(ignore=(bt.STATE_RECEIVING, bt.STATE_SUSPENDED))
+            if state == bt.STATE_COMPLETE:
+                return True
+            if state != bt.STATE_MISSING:
+                raise RuntimeError("Transfer failed (state %d)" % state)
+            print("Device is missing chunk %d, re-sending" % next_missing)
+        raise TransferStalled("chunk %d still missing after %d re-sends" % (next_missing, MAX_RESENDS))
+
+
+def compress(payload):
+    """zlib-wrapped deflate with the small window the device inflates with."""
+    c = zlib.compressobj(9, zlib.DEFLATED, bt.DEFLATE_WBITS)
+    return c.compress(payload) + c.flush()
+
+
+def report_version(backend, device, version):
+    body = json.dumps([{"device": device, "keywords_version": version}]).encode()
+    req = urllib.request.Request(backend.rstrip("/") + "/devices/heartbeat", data=body,
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status == 200
+    except (urllib.error.URLError, OSError) as e:
+        print("Backend error:", e)
+        return False
+
+
+async def send_file(path, name=None, compressed=False, backend=None):
+    with open(path, "rb") as f:
+        payload = f.read()
+    version = zlib.crc32(payload) & 0xFFFFFFFF
+    flags = 0
+    if compressed:
+        raw_len = len(payload)
+        payload = compress(payload)
+        flags |= bt.FLAG_COMPRESSED
+        print("Compressed %d -> %d bytes" % (raw_len, len(payload)))
+    sender = Sender(payload, flags)
+    device = await find_device(name)
+    print("Sending %d bytes to %s" % (len(payload), device.name))
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            async with BleakClient(device) as client:
+                # ATT payload per write is MTU - 3, minus our DATA header
+                chunk_size = bt.chunk_size_for(client.mtu_size)
+                t0 = time.monotonic()
+                if await sender.send(client, chunk_size):
+                    print("Transfer complete in %.2f s (chunk size %d)" % (time.monotonic() - t0, chunk_size))
+                    if backend:
+                        report_version(backend, device.name, version)
+                    return True
+        except (asyncio.TimeoutError, BleakError, OSError, EOFError, TransferStalled) as e:
+            print("Attempt %d failed: %s" % (attempt, e))
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a keywords JSON file to a NIMI device over BLE")
+    parser.add_argument("file", help="keywords JSON file")
+    parser.add_argument("--name", help="exact device name, e.g. NIMI_DEV_3A7F (default: first NIMI_DEV_*)")
+    parser.add_argument("--compress", action="store_true", help="deflate the payload before sending")
+    parser.add_argument("--backend", help="backend base URL to report the new keyword version to")
+    args = parser.parse_args()
+    ok = asyncio.run(send_file(args.file, args.name, args.compress, args.backend))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
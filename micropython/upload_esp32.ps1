@@ -1,12 +1,30 @@
+param(
+    # upload precompiled .mpy modules (tools/build_mpy.py) instead of .py sources
+    [switch]$Compiled
+)
+
 $ports = @("COM3", "COM5")
 $sourceDir = "micropython"
-$files = @("main.py", "ble_utils.py")
+$files = @("main.py", "ble_utils.py", "ble_transfer.py", "adv_format.py", "fastpath.py", "fastpath_native.py", "scheduling.py", "alerts.py", "telemetry.py", "match_log.py", "console.py", "runtime.py")
+
+if ($Compiled) {
+    python "$sourceDir/tools/build_mpy.py"
+    if ($LASTEXITCODE -ne 0) { throw "mpy build failed" }
+}
 
 foreach ($port in $ports) {
     Write-Host "`nUploading files to ESP32 on $port..."
     foreach ($file in $files) {
-        Write-Host "Transferring $file to $port..."
-        mpremote connect $port cp "$sourceDir/$file" ":$file"
+        if ($Compiled -and $file -ne "main.py") {
+            # the board imports a .py before a .mpy of the same name, so drop any stale source copy
+            $mpy = [System.IO.Path]::ChangeExtension($file, ".mpy")
+            Write-Host "Transferring $mpy to $port..."
+            mpremote connect $port rm ":$file" 2>$null
+            mpremote connect $port cp "$sourceDir/build/$mpy" ":$mpy"
+        } else {
+            Write-Host "Transferring $file to $port..."
+            mpremote connect $port cp "$sourceDir/$file" ":$file"
+        }
     }
     Write-Host "Upload complete on $port!"
 }